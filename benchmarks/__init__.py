@@ -0,0 +1 @@
+"""Performance benchmarks for sphinx-source-tree (not shipped)."""
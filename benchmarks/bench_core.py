@@ -0,0 +1,233 @@
+"""Micro-benchmarks for the core of the generator.
+
+Builds a synthetic repository (see :mod:`benchmarks.synthetic`) and
+times ``_is_ignored``, ``_matches_whitelist``, ``build_tree``,
+``collect_files``, ``_apply_order`` and ``generate()`` separately, each
+as the best of several rounds.  Usage::
+
+    python -m benchmarks.bench_core [--files 2000] [--depth 4]
+        [--fanout 4] [--ignored 2] [--ignored-files 1000] [--seed 0]
+        [--repeat 5] [--json report.json] [--baseline old.json]
+
+The JSON report records the repository spec next to the timings, and
+``--baseline`` compares against an earlier report made with the same
+spec.  ``make benchmark`` writes ``benchmark-report.json``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+from sphinx_source_tree import (
+    DEFAULTS,
+    __version__,
+    _apply_order,
+    _is_ignored,
+    _matches_whitelist,
+    build_tree,
+    collect_files,
+    generate,
+    scan_project,
+)
+
+from benchmarks.synthetic import RepoSpec, make_repo, whitelist_shapes
+
+__author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
+__copyright__ = "2026 Artur Barseghyan"
+__license__ = "MIT"
+__all__ = (
+    "bench_core",
+    "main",
+)
+
+
+def _best(func: Callable[[], Any], repeat: int) -> float:
+    """Return the best wall time of *repeat* calls of *func*."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _match_all(rels: list[str], whitelist: list[str]) -> list[bool]:
+    """Return ``_matches_whitelist`` for every path in *rels*."""
+    return [_matches_whitelist(rel, whitelist) for rel in rels]
+
+
+def bench_core(
+    root: Path,
+    spec: RepoSpec,
+    repeat: int,
+) -> dict[str, dict[str, float]]:
+    """Time the core functions on the repository at *root*."""
+    ignore = list(DEFAULTS["ignore"])
+    extensions = list(DEFAULTS["extensions"])
+    # Everything a full walk sees, ignored entries included, so that
+    # _is_ignored is timed on the realistic mix of hits and misses.
+    entries = [
+        (path.relative_to(root).as_posix(), path.name)
+        for path in root.rglob("*")
+    ]
+    scan = scan_project(root, ignore)
+    files = collect_files(
+        root,
+        extensions=extensions,
+        ignore=ignore,
+        whitelist=[],
+        include_all=True,
+        scan=scan,
+    )
+    rels = [fp.relative_to(root).as_posix() for fp in files]
+    # Pin every tenth file, in reverse.
+    order = rels[::-10]
+    results: dict[str, dict[str, float]] = {}
+
+    def record(name: str, seconds: float, calls: int = 1) -> None:
+        results[name] = {"seconds": seconds, "calls": calls}
+
+    record(
+        "_is_ignored",
+        _best(
+            lambda: [_is_ignored(rel, name, ignore) for rel, name in entries],
+            repeat,
+        ),
+        len(entries),
+    )
+    for shape, whitelist in whitelist_shapes(spec).items():
+        record(
+            f"_matches_whitelist[{shape}]",
+            _best(partial(_match_all, rels, whitelist), repeat),
+            len(rels),
+        )
+    record(
+        "scan_project",
+        _best(lambda: scan_project(root, ignore), repeat),
+    )
+    for label, shared in (("", None), ("[scan]", scan)):
+        record(
+            f"build_tree{label}",
+            _best(
+                partial(
+                    build_tree,
+                    root,
+                    max_depth=10,
+                    ignore=ignore,
+                    whitelist=[],
+                    include_all=True,
+                    root=root,
+                    scan=shared,
+                ),
+                repeat,
+            ),
+        )
+        record(
+            f"collect_files{label}",
+            _best(
+                partial(
+                    collect_files,
+                    root,
+                    extensions=extensions,
+                    ignore=ignore,
+                    whitelist=[],
+                    include_all=True,
+                    scan=shared,
+                ),
+                repeat,
+            ),
+        )
+    record(
+        "_apply_order",
+        _best(lambda: _apply_order(files, order, root), repeat),
+        len(order),
+    )
+    output = root / "docs" / "source_tree.rst"
+    record(
+        "generate",
+        _best(lambda: generate(root, output, sniff=False), repeat),
+    )
+    return results
+
+
+def _report(spec: RepoSpec, repeat: int, results: dict[str, Any]) -> dict:
+    """Wrap *results* with what is needed to compare two reports."""
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spec": asdict(spec),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def _print_table(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]] | None,
+) -> None:
+    """Print *results*, with the change against *baseline* if given."""
+    header = f"{'benchmark':<30} {'seconds':>10} {'us/call':>10}"
+    print(header + (f" {'vs base':>8}" if baseline else ""))
+    for name, row in results.items():
+        line = (
+            f"{name:<30} {row['seconds']:>10.4f} "
+            f"{row['seconds'] / row['calls'] * 1e6:>10.2f}"
+        )
+        if baseline and name in baseline:
+            line += f" {row['seconds'] / baseline[name]['seconds']:>7.2f}x"
+        print(line)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmark and print a table (and optionally JSON)."""
+    defaults = RepoSpec()
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--files", type=int, default=defaults.files)
+    p.add_argument("--depth", type=int, default=defaults.depth)
+    p.add_argument("--fanout", type=int, default=defaults.fanout)
+    p.add_argument("--ignored", type=int, default=defaults.ignored)
+    p.add_argument("--ignored-files", type=int, default=defaults.ignored_files)
+    p.add_argument("--seed", type=int, default=defaults.seed)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--json", type=Path, default=None, metavar="PATH")
+    p.add_argument("--baseline", type=Path, default=None, metavar="PATH")
+    args = p.parse_args(argv)
+    spec = RepoSpec(
+        files=args.files,
+        depth=args.depth,
+        fanout=args.fanout,
+        ignored=args.ignored,
+        ignored_files=args.ignored_files,
+        seed=args.seed,
+    )
+
+    baseline = None
+    if args.baseline:
+        old = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if old.get("spec") != asdict(spec):
+            p.error(f"{args.baseline} was made with a different spec")
+        baseline = old["results"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = make_repo(Path(tmp), spec)
+        results = bench_core(root, spec, args.repeat)
+
+    _print_table(results, baseline)
+    if args.json:
+        report = _report(spec, args.repeat, results)
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
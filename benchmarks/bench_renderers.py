@@ -0,0 +1,101 @@
+"""Throughput benchmark for the output renderers.
+
+Builds a synthetic project, collects its listing once and times every
+registered renderer against it, so renderer cost is measured apart from
+the directory walk.  Usage::
+
+    python -m benchmarks.bench_renderers [--dirs 50] [--files 20]
+        [--repeat 5] [--json report.json]
+
+Bundle renderers (``text``, ``markdown``) read file contents and are
+therefore expected to be much slower than the ``literalinclude`` ones.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sphinx_source_tree import RENDERERS, collect_listing, scan_project
+
+__author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
+__copyright__ = "2026 Artur Barseghyan"
+__license__ = "MIT"
+__all__ = (
+    "bench_renderers",
+    "main",
+    "make_project",
+)
+
+SAMPLE = (
+    '"""Module {index}."""\n\n\n'
+    "def function_{index}(value):\n"
+    '    """Return *value* doubled."""\n'
+    "    return value * 2\n"
+) * 10
+
+
+def make_project(root: Path, dirs: int, files: int) -> Path:
+    """Populate *root* with *dirs* packages of *files* modules each."""
+    for d in range(dirs):
+        package = root / "src" / f"pkg_{d:03d}"
+        package.mkdir(parents=True)
+        for f in range(files):
+            (package / f"module_{f:03d}.py").write_text(
+                SAMPLE.format(index=f), encoding="utf-8"
+            )
+    return root
+
+
+def bench_renderers(root: Path, repeat: int) -> dict[str, dict[str, float]]:
+    """Time every renderer on the listing of *root* (best of *repeat*)."""
+    listing = collect_listing(root, scan=scan_project(root, []))
+    output = root / "docs" / "source_tree"
+    results: dict[str, dict[str, float]] = {}
+    for name, renderer in RENDERERS.items():
+        best = float("inf")
+        size = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = len(renderer(listing, output).encode("utf-8"))
+            best = min(best, time.perf_counter() - start)
+        results[name] = {
+            "seconds": best,
+            "files_per_second": len(listing.files) / best,
+            "output_mb_per_second": size / best / 1e6,
+            "output_bytes": size,
+        }
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmark and print a table (and optionally JSON)."""
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--dirs", type=int, default=50)
+    p.add_argument("--files", type=int, default=20)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--json", type=Path, default=None, metavar="PATH")
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = make_project(Path(tmp), args.dirs, args.files)
+        results = bench_renderers(root, args.repeat)
+
+    print(f"{'renderer':<10} {'seconds':>10} {'files/s':>12} {'MB/s':>10}")
+    for name, row in results.items():
+        print(
+            f"{name:<10} {row['seconds']:>10.4f} "
+            f"{row['files_per_second']:>12.0f} "
+            f"{row['output_mb_per_second']:>10.1f}"
+        )
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
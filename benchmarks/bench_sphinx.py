@@ -0,0 +1,184 @@
+"""Cost of building the generated document with ``sphinx-build``.
+
+For synthetic repositories of increasing size (see
+:mod:`benchmarks.synthetic`) the output is generated into a minimal
+Sphinx project, which is then built with the ``html`` and ``text``
+builders in a subprocess.  Wall time, peak RSS of the build and the
+size of the generated and built output are recorded.  Usage::
+
+    python -m benchmarks.bench_sphinx [--sizes 200 1000 5000]
+        [--builders html text] [--json report.json]
+        [-- GENERATOR-ARGS ...]
+
+Arguments after ``--`` are passed to the ``sphinx-source-tree`` CLI, so
+the effect of output-shaping options can be measured, e.g.
+``-- --python-mode skeleton --chunk-lines 300``.  Peak RSS needs
+``os.wait4`` and is ``null`` where it is not available.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from sphinx_source_tree import __version__
+from sphinx_source_tree import main as generate_main
+
+from benchmarks.synthetic import RepoSpec, make_repo
+
+__author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
+__copyright__ = "2026 Artur Barseghyan"
+__license__ = "MIT"
+__all__ = (
+    "bench_sphinx",
+    "main",
+    "run_build",
+)
+
+CONF_PY = 'project = "bench"\nextensions = []\n'
+INDEX_RST = (
+    "Benchmark\n=========\n\n.. toctree::\n   :maxdepth: 1\n\n   source_tree\n"
+)
+
+
+def _tree_size(path: Path) -> int:
+    """Return the total size of the files below *path* in bytes."""
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def run_build(docs: Path, out: Path, builder: str) -> dict[str, Any]:
+    """Run ``sphinx-build -b builder docs out`` and measure it.
+
+    Returns the wall time in seconds, the peak RSS of the build process
+    in bytes (``None`` without ``os.wait4``), the size of *out* and the
+    exit status.
+    """
+    cmd = [
+        sys.executable,
+        "-m",
+        "sphinx",
+        "-q",
+        "-b",
+        builder,
+        "-d",
+        str(out / ".doctrees"),
+        str(docs),
+        str(out),
+    ]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    peak_rss: int | None = None
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    else:
+        proc.wait()
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "peak_rss_bytes": peak_rss,
+        "output_bytes": _tree_size(out) if out.exists() else 0,
+        "returncode": proc.returncode,
+    }
+
+
+def bench_sphinx(
+    base: Path,
+    spec: RepoSpec,
+    builders: list[str],
+    generator_args: list[str],
+) -> dict[str, Any]:
+    """Generate the output for *spec* below *base* and build it."""
+    root = make_repo(base / "project", spec)
+    docs = root / "docs"
+    docs.mkdir(exist_ok=True)
+    (docs / "conf.py").write_text(CONF_PY, encoding="utf-8")
+    (docs / "index.rst").write_text(INDEX_RST, encoding="utf-8")
+    output = docs / "source_tree.rst"
+
+    start = time.perf_counter()
+    generate_main(
+        [
+            "--project-root",
+            str(root),
+            "--output",
+            str(output),
+            *generator_args,
+        ]
+    )
+    result: dict[str, Any] = {
+        "spec": asdict(spec),
+        "generate_seconds": time.perf_counter() - start,
+        "generated_bytes": output.stat().st_size,
+        "builds": {},
+    }
+    for builder in builders:
+        result["builds"][builder] = run_build(
+            docs, base / f"_build_{builder}", builder
+        )
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the benchmark and print a table (and optionally JSON)."""
+    argv = sys.argv[1:] if argv is None else argv
+    generator_args: list[str] = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, generator_args = argv[:split], argv[split + 1 :]
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--sizes", type=int, nargs="+", default=[200, 1000, 5000])
+    p.add_argument("--builders", nargs="+", default=["html", "text"])
+    p.add_argument("--depth", type=int, default=RepoSpec.depth)
+    p.add_argument("--fanout", type=int, default=RepoSpec.fanout)
+    p.add_argument("--seed", type=int, default=RepoSpec.seed)
+    p.add_argument("--json", type=Path, default=None, metavar="PATH")
+    args = p.parse_args(argv)
+
+    runs = []
+    for size in args.sizes:
+        spec = RepoSpec(
+            files=size, depth=args.depth, fanout=args.fanout, seed=args.seed
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            runs.append(
+                bench_sphinx(Path(tmp), spec, args.builders, generator_args)
+            )
+
+    print(
+        f"{'files':>7} {'builder':<8} {'rst KB':>9} {'seconds':>9} "
+        f"{'peak MB':>9} {'out MB':>9}"
+    )
+    for run in runs:
+        for builder, build in run["builds"].items():
+            rss = build["peak_rss_bytes"]
+            print(
+                f"{run['spec']['files']:>7} {builder:<8} "
+                f"{run['generated_bytes'] / 1024:>9.1f} "
+                f"{build['seconds']:>9.2f} "
+                f"{'-' if rss is None else f'{rss / 1e6:.1f}':>9} "
+                f"{build['output_bytes'] / 1e6:>9.2f}"
+                + ("" if build["returncode"] == 0 else "  (failed)")
+            )
+    if args.json:
+        report = {
+            "version": __version__,
+            "generator_args": generator_args,
+            "runs": runs,
+        }
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
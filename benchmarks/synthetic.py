@@ -0,0 +1,117 @@
+"""Deterministic synthetic repositories for the benchmarks.
+
+:func:`make_repo` lays out a project of a given size and shape: source
+files spread over a tree of configurable *depth* and *fanout*, plus
+``node_modules``-style subtrees that the default ignore list prunes.
+The same arguments always produce the same tree, so timings of two
+runs (or two commits) are comparable.  :func:`whitelist_shapes` returns
+whitelists of typical shapes for that tree.
+"""
+
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+__author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
+__copyright__ = "2026 Artur Barseghyan"
+__license__ = "MIT"
+__all__ = (
+    "RepoSpec",
+    "make_repo",
+    "whitelist_shapes",
+)
+
+# Suffixes of the generated source files and how often each one occurs.
+SUFFIXES: tuple[tuple[str, int], ...] = (
+    (".py", 6),
+    (".md", 1),
+    (".rst", 1),
+    (".toml", 1),
+    (".yaml", 1),
+    (".js", 1),
+    (".css", 1),
+)
+
+PYTHON_SAMPLE = (
+    '"""Module {index}."""\n\n\n'
+    "def function_{index}(value):\n"
+    '    """Return *value* doubled."""\n'
+    "    return value * 2\n"
+)
+
+
+@dataclass(frozen=True)
+class RepoSpec:
+    """Size and shape of a synthetic repository.
+
+    ``files`` source files are spread round-robin over the directories
+    of a tree ``depth`` levels deep with ``fanout`` subdirectories per
+    directory.  Each of the ``ignored`` subtrees (a ``node_modules``
+    under a top-level directory) holds ``ignored_files`` files.
+    """
+
+    files: int = 2000
+    depth: int = 4
+    fanout: int = 4
+    ignored: int = 2
+    ignored_files: int = 1000
+    seed: int = 0
+
+
+def _directories(spec: RepoSpec) -> list[str]:
+    """Return the relative paths of the source directories, root first."""
+    dirs = [""]
+    level = [""]
+    for _ in range(spec.depth):
+        level = [
+            f"{parent}/d{i}" if parent else f"d{i}"
+            for parent in level
+            for i in range(spec.fanout)
+        ]
+        dirs.extend(level)
+    return dirs
+
+
+def make_repo(root: Path, spec: RepoSpec) -> Path:
+    """Populate *root* with the repository described by *spec*."""
+    rng = random.Random(spec.seed)
+    suffixes = [suffix for suffix, weight in SUFFIXES for _ in range(weight)]
+    dirs = _directories(spec)
+    for rel in dirs:
+        (root / rel).mkdir(parents=True, exist_ok=True)
+    for index in range(spec.files):
+        suffix = rng.choice(suffixes)
+        path = root / dirs[index % len(dirs)] / f"file_{index:05d}{suffix}"
+        lines = rng.randint(1, 20)
+        path.write_text(
+            PYTHON_SAMPLE.format(index=index) * lines
+            if suffix == ".py"
+            else f"entry {index}\n" * lines,
+            encoding="utf-8",
+        )
+    for n in range(spec.ignored):
+        package = root / dirs[1 + n % (len(dirs) - 1)] / "node_modules"
+        for index in range(spec.ignored_files):
+            path = package / f"pkg_{index % 50:02d}" / f"index_{index:05d}.js"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("module.exports = {};\n", encoding="utf-8")
+    return root
+
+
+def whitelist_shapes(spec: RepoSpec) -> dict[str, list[str]]:
+    """Return named whitelists of typical shapes for the tree of *spec*.
+
+    ``none`` is empty (whitelisting off), ``single`` one top-level
+    directory, ``deep`` a single directory at the bottom of the tree and
+    ``many`` every directory one level below the top.
+    """
+    dirs = _directories(spec)
+    second = [rel for rel in dirs if rel.count("/") == 1]
+    return {
+        "none": [],
+        "single": ["d0"] if spec.depth else [],
+        "deep": [dirs[-1]] if spec.depth else [],
+        "many": second or dirs[1:],
+    }
@@ -8,6 +8,21 @@ if TYPE_CHECKING:
     from pathlib import Path
 
 
+@pytest.fixture(autouse=True)
+def isolated_cache(
+    tmp_path_factory: pytest.TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Keep the persistent cache out of the user's home directory.
+
+    :param tmp_path_factory: Temporary directory factory from pytest
+    :param monkeypatch: Monkeypatch fixture from pytest
+    """
+    monkeypatch.setenv(
+        "SPHINX_SOURCE_TREE_CACHE_DIR", str(tmp_path_factory.mktemp("cache"))
+    )
+
+
 @pytest.fixture
 def safe_test_path(
     tmp_path: Path,
@@ -12,11 +12,34 @@ CLI arguments always take precedence.
 from __future__ import annotations
 
 import argparse
+import ast
+import codecs
+import contextlib
+import errno
 import fnmatch
+import functools
+import hashlib
+import importlib
+import io
+import json
+import mmap
 import os
+import re
+import select
+import subprocess
 import sys
+import tempfile
+import textwrap
+import time
+import tokenize
+from concurrent.futures import (
+    BrokenExecutor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Collection, Iterable, Iterator, NamedTuple
 
 __title__ = "sphinx-source-tree"
 __version__ = "0.2.3"
@@ -24,14 +47,28 @@ __author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
 __copyright__ = "2026 Artur Barseghyan"
 __license__ = "MIT"
 __all__ = (
+    "ProjectScan",
+    "RENDERERS",
+    "TOKEN_COUNTERS",
+    "TRANSFORMS",
+    "SourceListing",
+    "Timings",
     "build_parser",
     "build_tree",
     "collect_files",
+    "collect_listing",
     "detect_language",
+    "estimate_tokens",
     "generate",
+    "generate_bundle",
+    "generate_shards",
     "load_config",
     "main",
+    "record_timings",
+    "register_renderer",
     "resolve_config",
+    "scan_project",
+    "setup",
 )
 
 DEFAULTS: dict[str, Any] = {
@@ -89,6 +126,31 @@ DEFAULTS: dict[str, Any] = {
     "file_options_profiles": {},
     "file_options_profile": None,
     "order": [],
+    "shard_by": None,
+    "format": "rst",
+    "max_file_size": None,
+    "max_file_lines": None,
+    "oversize": "skip",
+    "oversize_exempt": [],
+    "token_budget": None,
+    "token_counter": "chars",
+    "token_weights": {},
+    "cache_dir": None,
+    "sniff": True,
+    "skip_generated": False,
+    "generated_exempt": [],
+    "dedupe": False,
+    "strict_file_options": False,
+    "resolve_lines": False,
+    "chunk_lines": None,
+    "chunk_snap": False,
+    "python_mode": "full",
+    "transforms": [],
+    "manifest": None,
+    "max_files": None,
+    "max_entries_scanned": None,
+    "time_budget": None,
+    "on_scan_limit": "error",
 }
 
 LANGUAGE_MAP: dict[str, str] = {
@@ -141,10 +203,160 @@ LANGUAGE_MAP: dict[str, str] = {
     ".makefile": "makefile",
 }
 
-# Valid per-file literalinclude options (subset that controls content range).
+# Single-file formats that inline file contents (see generate_bundle).
+BUNDLE_FORMATS: tuple[str, ...] = ("text", "markdown")
+BUNDLE_RULE: str = "=" * 72
+_BACKTICK_RUN = re.compile("`+")
+
+# Ways to split the listing into several documents (see generate_shards).
+SHARD_MODES: tuple[str, ...] = ("directory", "file")
+# Suffixes Sphinx may take for a source suffix in a toctree entry; file
+# shards of such files get an extra "_" (see _shard_groups).
+SHARD_ESCAPED_SUFFIXES: tuple[str, ...] = (".rst", ".md", ".txt", ".ipynb")
+
+# What to do with files over max-file-size / max-file-lines.
+OVERSIZE_MODES: tuple[str, ...] = ("skip", "truncate")
+
+# What to do when a walk stops at max-files / max-entries-scanned /
+# time-budget.
+SCAN_LIMIT_MODES: tuple[str, ...] = ("error", "partial")
+NOTES_INTRO: str = "Some files were left out or shortened to fit the limits:"
+_SIZE_UNITS: dict[str, int] = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+# Layout version of the --manifest JSON (see _manifest_entry).
+MANIFEST_VERSION: int = 1
+
+# Overrides the persistent cache location (see _default_cache_dir).
+CACHE_DIR_ENV: str = "SPHINX_SOURCE_TREE_CACHE_DIR"
+
+# Valid per-file literalinclude options (subset that controls content range
+# and decoding).
 VALID_FILE_OPTIONS: frozenset[str] = frozenset(
-    ["lines", "start-at", "start-after", "end-before", "end-at"]
+    ["lines", "start-at", "start-after", "end-before", "end-at", "encoding"]
+)
+
+RANGE_OPTIONS: frozenset[str] = VALID_FILE_OPTIONS - {"encoding"}
+MARKER_OPTIONS: frozenset[str] = RANGE_OPTIONS - {"lines"}
+
+# Bytes read from the head of each file to detect binary content and the
+# encoding (see _sniff_file).
+SNIFF_BYTES: int = 8192
+# Signatures of compressed and image formats that may lack NUL bytes early.
+BINARY_MAGIC: tuple[bytes, ...] = (
+    b"\x1f\x8b",  # gzip
+    b"PK\x03\x04",  # zip, wheel, jar
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",
+)
+# Encoding emitted for text that is not valid UTF-8; it decodes anything.
+FALLBACK_ENCODING: str = "latin-1"
+
+# Generated-content classifier (see _classify_file): dependency lock files,
+# name patterns of generated or minified files, header markers searched
+# in the first CLASSIFY_BYTES, and line-length limits of minified code.
+LOCK_FILES: frozenset[str] = frozenset(
+    [
+        "Cargo.lock",
+        "Gemfile.lock",
+        "Pipfile.lock",
+        "composer.lock",
+        "go.sum",
+        "package-lock.json",
+        "pdm.lock",
+        "pnpm-lock.yaml",
+        "poetry.lock",
+        "uv.lock",
+        "yarn.lock",
+    ]
+)
+GENERATED_NAMES: tuple[str, ...] = ("*_pb2.py", "*_pb2_grpc.py", "*_pb2.pyi")
+MINIFIED_NAMES: tuple[str, ...] = ("*.min.js", "*.min.css", "*.min.mjs")
+GENERATED_MARKERS: tuple[bytes, ...] = (
+    b"@generated",
+    b"DO NOT EDIT",
+    b"Code generated by",
+    b"Generated by the protocol buffer compiler",
+    b"auto-generated",
+    b"autogenerated",
 )
+CLASSIFY_BYTES: int = 65536
+
+# How Python files are included (see _apply_python_mode) and the directory,
+# relative to the project root, that transformed copies are staged in.  The
+# staging directory is never scanned.
+PYTHON_MODES: tuple[str, ...] = ("full", "skeleton")
+STAGING_DIR: str = ".sphinx-source-tree"
+# Below this many files a process pool costs more than it saves.
+PROCESS_POOL_MIN: int = 8
+
+
+# Comment syntax understood by the strip-comments transform (Python uses
+# tokenize instead), keyed by highlight language.  ``line`` comments run to
+# the end of the line; with ``spaced`` they must follow whitespace or start
+# the line, with ``whole`` they must be the only thing on it.  ``regex``
+# keeps JavaScript regex literals and ``heredoc`` shell here-documents.
+class _CommentSyntax(NamedTuple):
+    line: tuple[str, ...] = ()
+    block: tuple[tuple[str, str], ...] = ()
+    quotes: str = "\"'"
+    spaced: bool = False
+    whole: bool = False
+    regex: bool = False
+    heredoc: bool = False
+
+
+_C_COMMENTS = _CommentSyntax(("//",), (("/*", "*/"),), "\"'`")
+_JS_COMMENTS = _C_COMMENTS._replace(regex=True)
+# ``//`` also occurs in unquoted CSS values such as url(http://...).
+_SASS_COMMENTS = _CommentSyntax(("//",), (("/*", "*/"),), spaced=True)
+_HASH_COMMENTS = _CommentSyntax(("#",), spaced=True)
+_MARKUP_COMMENTS = _CommentSyntax(block=(("<!--", "-->"),), quotes="")
+COMMENT_SYNTAX: dict[str, _CommentSyntax] = {
+    "bash": _HASH_COMMENTS._replace(heredoc=True),
+    "c": _C_COMMENTS,
+    "cpp": _C_COMMENTS,
+    "css": _CommentSyntax(block=(("/*", "*/"),)),
+    "cython": _HASH_COMMENTS,
+    "dockerfile": _HASH_COMMENTS,
+    "go": _C_COMMENTS,
+    "graphql": _HASH_COMMENTS,
+    "hcl": _CommentSyntax(("#", "//"), (("/*", "*/"),)),
+    "html": _MARKUP_COMMENTS,
+    "ini": _CommentSyntax(("#", ";"), whole=True),
+    "java": _C_COMMENTS,
+    "javascript": _JS_COMMENTS,
+    "jinja": _CommentSyntax(block=(("{#", "#}"),), quotes=""),
+    "jsx": _JS_COMMENTS,
+    "kotlin": _C_COMMENTS,
+    "less": _SASS_COMMENTS,
+    "lua": _CommentSyntax(("--",), (("--[[", "]]"),)),
+    "makefile": _HASH_COMMENTS,
+    "php": _CommentSyntax(("//", "#"), (("/*", "*/"),)),
+    "protobuf": _C_COMMENTS,
+    "r": _HASH_COMMENTS,
+    "ruby": _HASH_COMMENTS,
+    "rust": _C_COMMENTS,
+    "scss": _SASS_COMMENTS,
+    "sql": _CommentSyntax(("--",), (("/*", "*/"),)),
+    "swift": _C_COMMENTS,
+    "toml": _HASH_COMMENTS,
+    "tsx": _JS_COMMENTS,
+    "typescript": _JS_COMMENTS,
+    "xml": _MARKUP_COMMENTS,
+    "yaml": _HASH_COMMENTS,
+}
+# Stands in for a removed comment until the emptied lines are dropped.
+_COMMENT_MARK: str = "\x00"
+_BLANK_RUN = re.compile(r"\n(?:[ \t]*\n)+")
+
+# Files at least this large are hashed through mmap (see _hash_file).
+HASH_MMAP_THRESHOLD: int = 1 << 20
+MINIFIED_MAX_LINE: int = 1000
+MINIFIED_AVG_LINE: int = 250
 
 
 # ── config ───────────────────────────────────────────────────────────
@@ -230,6 +442,100 @@ def resolve_config(
     return cfg
 
 
+# ----------------------------------------------------------------------------
+# Timings
+# ----------------------------------------------------------------------------
+
+
+@dataclass
+class Timings:
+    """Wall time per phase and counters of a run.
+
+    ``phases`` maps phase names (``config``, ``scan``, ``ignore``,
+    ``tree``, ``collect``, ``order``, the listing filters, ``render``,
+    ``write``) to accumulated seconds; ``ignore`` is part of ``scan``.
+    ``counters`` holds ``dirs_listed``, ``entries_pruned``,
+    ``pattern_evals``, ``files_selected``, ``files_written`` and
+    ``bytes_written``.  Use :func:`record_timings` to collect one.
+    """
+
+    phases: dict[str, float] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the wall time of the ``with`` block to phase *name*."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add *seconds* to phase *name*."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Add *n* to counter *name*."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        """Return the phases and counters as plain (JSON-ready) dicts."""
+        return {"phases": dict(self.phases), "counters": dict(self.counters)}
+
+    def format(self) -> str:
+        """Return a human-readable report of the phases and counters."""
+        width = max(map(len, [*self.phases, *self.counters, "phase"]))
+        lines = [f"{'phase':<{width}}  {'seconds':>9}"]
+        for name, seconds in self.phases.items():
+            lines.append(f"{name:<{width}}  {seconds:>9.4f}")
+        lines.append("")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<{width}}  {value:>9}")
+        return "\n".join(lines)
+
+
+_timings: Timings | None = None
+
+
+@contextlib.contextmanager
+def record_timings(
+    callback: Callable[[Timings], None] | None = None,
+) -> Iterator[Timings]:
+    """Collect the :class:`Timings` of everything run inside the block.
+
+    The timings are yielded, and handed to *callback* (if given) when the
+    block exits, e.g. to forward them to build telemetry::
+
+        with record_timings(lambda t: send(t.as_dict())):
+            main(["--project-root", "."])
+
+    Outside such a block nothing is measured.
+    """
+    global _timings
+    previous, _timings = _timings, Timings()
+    timings = _timings
+    try:
+        yield timings
+    finally:
+        _timings = previous
+        if callback is not None:
+            callback(timings)
+
+
+def _phase(name: str) -> contextlib.AbstractContextManager[None]:
+    """Time a ``with`` block as phase *name* while timings are recorded."""
+    if _timings is None:
+        return contextlib.nullcontext()
+    return _timings.phase(name)
+
+
+def _count(name: str, n: int = 1) -> None:
+    """Add *n* to counter *name* while timings are recorded."""
+    if _timings is not None:
+        _timings.count(name, n)
+
+
 # ----------------------------------------------------------------------------
 # helpers
 # ----------------------------------------------------------------------------
@@ -244,33 +550,49 @@ def _is_ignored(rel_path: str, name: str, patterns: list[str]) -> bool:
       - Otherwise, match against any path component (e.g., dir/file → matches
         name, or full path)
     """
+    if _timings is None:
+        return _first_ignore_match(rel_path, patterns) is not None
+    start = time.perf_counter()
+    index = _first_ignore_match(rel_path, patterns)
+    _timings.add("ignore", time.perf_counter() - start)
+    _timings.count(
+        "pattern_evals", len(patterns) if index is None else index + 1
+    )
+    return index is not None
+
+
+def _first_ignore_match(rel_path: str, patterns: list[str]) -> int | None:
+    """Return the index of the first pattern matching *rel_path*, if any.
+
+    See :func:`_is_ignored` for the matching rules.
+    """
     # Normalize path separators to '/'
     rel_path = rel_path.replace(os.sep, "/")
     name_parts = rel_path.split("/")
 
-    for pat in patterns:
+    for index, pat in enumerate(patterns):
         # Normalize pattern separators (e.g. "dir/*.pyc" → "dir/*.pyc")
         pat = pat.replace(os.sep, "/")
 
         # If pattern contains '/', treat as glob against *entire path*
         if "/" in pat:
             if fnmatch.fnmatch(rel_path, pat):
-                return True
+                return index
         else:
             # Otherwise, match against any path component (dir/file.py →
             # matches "file.py")
             # or match against the *relative path* (e.g., "__pycache__/foo"
             # matches "*__pycache__*")
             if any(fnmatch.fnmatch(part, pat) for part in name_parts):
-                return True
+                return index
             # Also try full path with glob: e.g. pat="*.pyc" should
             # match "foo.pyc" anywhere
             if fnmatch.fnmatch(rel_path, f"*{pat}*") or fnmatch.fnmatch(
                 rel_path, f"*{pat}"
             ):
-                return True
+                return index
 
-    return False
+    return None
 
 
 def _matches_whitelist(rel_path: str, whitelist: list[str]) -> bool:
@@ -408,6 +730,309 @@ def detect_language(
     return merged.get(path.suffix, "")
 
 
+class _Entry(NamedTuple):
+    """A single directory entry recorded by :func:`scan_project`."""
+
+    name: str
+    is_dir: bool
+    is_file: bool
+
+
+@dataclass
+class ProjectScan:
+    """In-memory snapshot of a project walk.
+
+    ``entries`` maps every walked directory (relative posix path, ``""``
+    for the root) to its visible children, already sorted in tree order
+    (directories first, then case-insensitive by name).  Ignored entries
+    are pruned while walking, so ignored directories such as
+    ``node_modules`` are never listed.
+
+    ``sizes`` caches the file sizes looked up via :meth:`file_size`.
+
+    ``dir_mtimes`` records the modification time of every walked
+    directory.  Adding, removing or renaming an entry bumps the mtime of
+    its parent directory, while editing file contents does not, which
+    makes the snapshot cheap to revalidate (see :meth:`is_stale`).
+
+    ``entry_counts`` holds the number of entries each directory listing
+    returned, ignored ones included.  ``truncated`` names the limit that
+    stopped the walk early (see :func:`scan_project`), if any; the
+    snapshot then only covers part of the project.  ``walked_at`` is the
+    wall-clock time (ns) the walk started.
+    """
+
+    root: Path
+    ignore: tuple[str, ...]
+    entries: dict[str, list[_Entry]] = field(default_factory=dict)
+    dir_mtimes: dict[str, int] = field(default_factory=dict)
+    sizes: dict[str, int | None] = field(default_factory=dict)
+    entry_counts: dict[str, int] = field(default_factory=dict)
+    truncated: str | None = None
+    walked_at: int = 0
+
+    def dir_path(self, rel_dir: str) -> Path:
+        """Return the filesystem path of the walked directory *rel_dir*."""
+        return self.root / rel_dir if rel_dir else self.root
+
+    def iter_files(self) -> Iterable[str]:
+        """Yield the relative posix path of every file in the snapshot."""
+        for rel_dir, children in self.entries.items():
+            for entry in children:
+                if entry.is_file:
+                    yield f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+
+    def file_size(self, rel: str) -> int | None:
+        """Return the size of file *rel* in bytes, ``None`` if it is gone.
+
+        Sizes are looked up on first use and kept for the lifetime of
+        the snapshot.
+        """
+        if rel not in self.sizes:
+            try:
+                self.sizes[rel] = os.stat(self.root / rel).st_size
+            except OSError:
+                self.sizes[rel] = None
+        return self.sizes[rel]
+
+    def heaviest_dirs(self, n: int = 5) -> list[tuple[str, int]]:
+        """Return up to *n* ``(directory, entries)`` that cost the most.
+
+        Entries are counted over whole subtrees.  A directory most of
+        whose entries sit below one subdirectory is represented by that
+        subdirectory, so the list points at the actual culprits.
+        """
+        totals = dict(self.entry_counts)
+        for rel_dir, count in self.entry_counts.items():
+            parts = rel_dir.split("/") if rel_dir else []
+            for end in range(len(parts)):
+                ancestor = "/".join(parts[:end])
+                totals[ancestor] = totals.get(ancestor, 0) + count
+        dominated = {
+            rel_dir.rpartition("/")[0]
+            for rel_dir, total in totals.items()
+            if rel_dir and total * 2 > totals[rel_dir.rpartition("/")[0]]
+        }
+        ranked = sorted(
+            (
+                (rel_dir or ".", total)
+                for rel_dir, total in totals.items()
+                if rel_dir not in dominated
+            ),
+            key=lambda item: -item[1],
+        )
+        return ranked[:n]
+
+    def without(self, rels: Iterable[str]) -> ProjectScan:
+        """Return a copy without the entries *rels* and their subtrees.
+
+        Walk bookkeeping (mtimes, entry counts) is kept, so the copy goes
+        stale together with the original.
+        """
+        dropped = set(rels)
+        if not dropped:
+            return self
+
+        def kept(rel: str) -> bool:
+            parts = rel.split("/")
+            return not any(
+                "/".join(parts[:end]) in dropped
+                for end in range(1, len(parts) + 1)
+            )
+
+        entries = {
+            rel_dir: [
+                entry
+                for entry in children
+                if kept(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+            ]
+            for rel_dir, children in self.entries.items()
+            if not rel_dir or kept(rel_dir)
+        }
+        return replace(self, entries=entries)
+
+    def is_stale(self) -> bool:
+        """True when any walked directory was modified or removed."""
+        return any(
+            _mtime_ns(self.dir_path(rel_dir)) != mtime
+            for rel_dir, mtime in self.dir_mtimes.items()
+        )
+
+
+def _mtime_ns(path: Path | str) -> int | None:
+    """Return the mtime of *path* in nanoseconds, ``None`` if it is gone."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def scan_project(
+    root: Path,
+    ignore: list[str],
+    *,
+    max_depth: int | None = None,
+    max_files: int | None = None,
+    max_entries_scanned: int | None = None,
+    time_budget: float | None = None,
+    previous: ProjectScan | None = None,
+) -> ProjectScan:
+    """Walk *root* once and return a :class:`ProjectScan`.
+
+    Directories matching *ignore*, and the ``STAGING_DIR`` of transformed
+    copies, are pruned and never listed.  When
+    *max_depth* is given, only directories up to that many levels below
+    *root* are listed (``0`` lists *root* itself only).  Symlinked
+    directories are recorded but not descended into.
+
+    The walk stops early once it found more than *max_files* files,
+    looked at more than *max_entries_scanned* directory entries (ignored
+    ones included) or ran for more than *time_budget* seconds; the
+    limit is recorded in ``truncated``.
+
+    With *previous*, an earlier scan of the same root and ignore list,
+    directories whose mtime did not change since are not listed again;
+    their entries are taken over from *previous*.
+    """
+    with _phase("scan"):
+        return _scan(
+            root,
+            ignore,
+            max_depth,
+            _ScanLimits(max_files, max_entries_scanned, time_budget),
+            previous,
+        )
+
+
+# Directories modified this close before a walk are listed again by the
+# next one: with coarse timestamps a change made later in the same tick
+# would not move their mtime.
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+def _reusable_entries(
+    previous: ProjectScan | None, rel_dir: str, mtime: int
+) -> list[_Entry] | None:
+    """Return the entries of *rel_dir* in *previous* if still current."""
+    if (
+        previous is None
+        or previous.truncated is not None
+        or rel_dir not in previous.entry_counts
+        or previous.dir_mtimes.get(rel_dir) != mtime
+        or mtime >= previous.walked_at - _RACY_WINDOW_NS
+    ):
+        return None
+    return previous.entries[rel_dir]
+
+
+class _ScanLimits(NamedTuple):
+    """Limits of one walk (see :func:`scan_project`)."""
+
+    max_files: int | None = None
+    max_entries_scanned: int | None = None
+    time_budget: float | None = None
+
+
+def _scan(
+    root: Path,
+    ignore: list[str],
+    max_depth: int | None,
+    limits: _ScanLimits,
+    previous: ProjectScan | None = None,
+) -> ProjectScan:
+    """Walk *root* for :func:`scan_project`."""
+    scan = ProjectScan(
+        root=root, ignore=tuple(ignore), walked_at=time.time_ns()
+    )
+    stack: list[tuple[str, int]] = [("", 0)]
+    limited = limits != _ScanLimits()
+    deadline = (
+        None
+        if limits.time_budget is None
+        else time.perf_counter() + limits.time_budget
+    )
+    files = entries = 0
+    while stack and scan.truncated is None:
+        rel_dir, level = stack.pop()
+        dir_path = scan.dir_path(rel_dir)
+        try:
+            # Stat before listing so a change made mid-listing still shows
+            # up as a stale mtime on the next check.
+            mtime = scan.dir_mtimes[rel_dir] = os.stat(dir_path).st_mtime_ns
+            reused = _reusable_entries(previous, rel_dir, mtime)
+            if reused is None:
+                with os.scandir(dir_path) as it:
+                    raw = list(it)
+        except OSError:
+            scan.entries[rel_dir] = []
+            continue
+        if previous is not None and reused is not None:
+            scan.entries[rel_dir] = reused
+            scan.entry_counts[rel_dir] = previous.entry_counts[rel_dir]
+            if limited:
+                entries += previous.entry_counts[rel_dir]
+                files += sum(entry.is_file for entry in reused)
+                scan.truncated = _limit_hit(limits, files, entries, deadline)
+            for entry in reused:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                # Symlinked directories were not descended into.
+                if (
+                    entry.is_dir
+                    and rel in previous.entry_counts
+                    and (max_depth is None or level < max_depth)
+                ):
+                    stack.append((rel, level + 1))
+            continue
+        _count("dirs_listed")
+        scan.entry_counts[rel_dir] = len(raw)
+
+        children: list[_Entry] = []
+        for de in raw:
+            if limited:
+                entries += 1
+                scan.truncated = _limit_hit(limits, files, entries, deadline)
+                if scan.truncated:
+                    break
+            rel = f"{rel_dir}/{de.name}" if rel_dir else de.name
+            if rel == STAGING_DIR or _is_ignored(rel, de.name, ignore):
+                _count("entries_pruned")
+                continue
+            is_dir = de.is_dir()
+            children.append(_Entry(de.name, is_dir, de.is_file()))
+            files += children[-1].is_file
+            if (
+                is_dir
+                and not de.is_symlink()
+                and (max_depth is None or level < max_depth)
+            ):
+                stack.append((rel, level + 1))
+        children.sort(key=lambda e: (e.is_file, e.name.lower()))
+        scan.entries[rel_dir] = children
+    if limited and scan.truncated is None:
+        # The last entries may have taken the walk past max-files.
+        scan.truncated = _limit_hit(limits, files, entries, None)
+    return scan
+
+
+def _limit_hit(
+    limits: _ScanLimits,
+    files: int,
+    entries: int,
+    deadline: float | None,
+) -> str | None:
+    """Return the limit of *limits* a walk has run past, if any."""
+    if limits.max_files is not None and files > limits.max_files:
+        return f"max-files = {limits.max_files}"
+    if (
+        limits.max_entries_scanned is not None
+        and entries > limits.max_entries_scanned
+    ):
+        return f"max-entries-scanned = {limits.max_entries_scanned}"
+    if deadline is not None and time.perf_counter() > deadline:
+        return f"time-budget = {limits.time_budget:g}s"
+    return None
+
+
 def build_tree(
     path: Path,
     *,
@@ -417,26 +1042,30 @@ def build_tree(
     include_all: bool,
     root: Path,
     prefix: str = "",
+    scan: ProjectScan | None = None,
 ) -> str:
     """Return an ASCII directory tree for *path* (recursive).
 
     Entries are filtered *before* connectors are assigned so that the
     last visible entry always receives ``└──``.
+
+    When *scan* is given the tree is rendered from that snapshot instead
+    of walking the filesystem again.
     """
     if max_depth < 0:
         return ""
 
-    entries = sorted(
-        path.iterdir(), key=lambda p: (p.is_file(), p.name.lower())
-    )
+    rel_dir = path.relative_to(root).as_posix()
+    rel_dir = "" if rel_dir == "." else rel_dir
+    if scan is None:
+        start_level = len(rel_dir.split("/")) if rel_dir else 0
+        scan = scan_project(root, ignore, max_depth=start_level + max_depth)
 
-    visible: list[Path] = []
-    for entry in entries:
-        rel = entry.relative_to(root).as_posix()
-        if _is_ignored(rel, entry.name, ignore):
-            continue
+    visible: list[_Entry] = []
+    for entry in scan.entries.get(rel_dir, []):
+        rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
         if not include_all and whitelist:
-            if entry.is_dir():
+            if entry.is_dir:
                 if not _should_show_dir(rel, whitelist):
                     continue
             elif not _matches_whitelist(rel, whitelist):
@@ -448,16 +1077,17 @@ def build_tree(
         is_last = idx == len(visible) - 1
         connector = "\u2514\u2500\u2500 " if is_last else "\u251c\u2500\u2500 "
         lines.append(f"{prefix}{connector}{entry.name}")
-        if entry.is_dir():
+        if entry.is_dir:
             extension = "    " if is_last else "\u2502   "
             sub = build_tree(
-                entry,
+                path / entry.name,
                 max_depth=max_depth - 1,
                 ignore=ignore,
                 whitelist=whitelist,
                 include_all=include_all,
                 root=root,
                 prefix=prefix + extension,
+                scan=scan,
             )
             if sub:
                 lines.extend(sub.splitlines())
@@ -472,14 +1102,20 @@ def collect_files(
     ignore: list[str],
     whitelist: list[str],
     include_all: bool,
+    scan: ProjectScan | None = None,
 ) -> list[Path]:
-    """Return a sorted list of files eligible for ``literalinclude``."""
+    """Return a sorted list of files eligible for ``literalinclude``.
+
+    Files inside ignored directories are never collected.  When *scan*
+    is given the files are taken from that snapshot instead of walking
+    the filesystem again.
+    """
+    if scan is None:
+        scan = scan_project(root, ignore)
     result: list[Path] = []
-    for fp in sorted(root.rglob("*")):
-        if not fp.is_file() or fp.suffix not in extensions:
-            continue
-        rel = fp.relative_to(root).as_posix()
-        if _is_ignored(rel, fp.name, ignore):
+    for rel in scan.iter_files():
+        fp = root / rel
+        if fp.suffix not in extensions:
             continue
         if (
             not include_all
@@ -488,7 +1124,7 @@ def collect_files(
         ):
             continue
         result.append(fp)
-    return result
+    return sorted(result)
 
 
 def generate(
@@ -505,6 +1141,29 @@ def generate(
     extra_languages: dict[str, str] | None = None,
     file_options: dict[str, dict[str, Any]] | None = None,
     order: list[str] | None = None,
+    max_file_size: int | str | None = None,
+    max_file_lines: int | None = None,
+    oversize: str = "skip",
+    oversize_exempt: list[str] | None = None,
+    token_budget: int | None = None,
+    token_weights: dict[str, float] | None = None,
+    token_counter: str | Callable[[str], int] | None = None,
+    sniff: bool = True,
+    skip_generated: bool = False,
+    generated_exempt: list[str] | None = None,
+    dedupe: bool = False,
+    strict_file_options: bool = False,
+    resolve_lines: bool = False,
+    chunk_lines: int | None = None,
+    chunk_snap: bool = False,
+    python_mode: str = "full",
+    transforms: list[str] | None = None,
+    max_files: int | None = None,
+    max_entries_scanned: int | None = None,
+    time_budget: float | None = None,
+    on_scan_limit: str = "error",
+    cache_dir: Path | str | None = None,
+    scan: ProjectScan | None = None,
 ) -> str:
     """Build the full ``.rst`` document and return it as a string.
 
@@ -582,9 +1241,270 @@ def generate(
             [[tool.sphinx-source-tree.files]]
             output = "docs/source_tree.rst"
             order = ["src/core.py", "src/utils.py"]
+    max_file_size:
+        Files larger than this many bytes (or a size such as ``"512K"``
+        or ``"2M"``) are oversized.  The size comes
+        from the scan, so small files are never opened.
+    max_file_lines:
+        Files with more lines than this are oversized.
+    oversize:
+        ``"skip"`` drops oversized files from the listing;
+        ``"truncate"`` includes the head of the file that fits the limits
+        via a ``:lines:`` range.  Either way a note listing the affected
+        files follows the directory tree.  Files that already have a
+        ``lines`` option are left alone.
+    oversize_exempt:
+        Patterns (same syntax as *ignore*) of files that are always
+        included in full.
+    token_budget:
+        Maximum estimated number of tokens of the included file
+        contents.  Files are picked greedily: those listed in *order*
+        first, then by *token_weights*, then in listing order; files
+        that no longer fit are dropped and listed in a note.
+    token_weights:
+        ``{pattern: weight}`` priorities for *token_budget* (patterns use
+        the *ignore* syntax, the first match wins, the default weight is
+        ``1``).  Higher weights are picked first.
+    token_counter:
+        Name of a counter in ``TOKEN_COUNTERS`` (default ``"chars"``,
+        roughly four characters per token), a ``"module:function"``
+        import path, or a callable taking the text and returning its
+        token count.
+    sniff:
+        Read the head of every file (in parallel, cached by size and
+        mtime) to skip binary content and add ``:encoding:`` to files
+        that are not valid UTF-8.
+    skip_generated:
+        Skip lock files and files that look generated (``@generated``
+        style headers, ``*_pb2.py``) or minified (``*.min.js``, very
+        long lines).  Only the head of each file is read; results are
+        cached and every skip is reported.
+    generated_exempt:
+        Patterns (same syntax as *ignore*) of files never skipped by
+        *skip_generated*.
+    dedupe:
+        Include files with byte-identical content (and the same
+        *file_options*) only once; later copies are rendered as a short
+        "identical to" reference.  Only files sharing a size are hashed.
+    strict_file_options:
+        Every marker and ``lines`` range in *file_options* is checked
+        against the file before anything is emitted, and all problems
+        are reported together.  By default that report is a warning;
+        when true a ``ValueError`` is raised instead.
+    resolve_lines:
+        Replace the markers of every *file_options* entry with the
+        numeric ``lines`` range they resolve to.
+    chunk_lines:
+        Split files longer than this many lines into consecutive
+        ``lines`` ranges, each included under its own subheading.  Files
+        with range options are never split.
+    chunk_snap:
+        Move chunk boundaries of Python files back to the start of the
+        nearest top-level statement (function, class, ...) so that
+        definitions are not cut in half.  Chunks never grow beyond
+        *chunk_lines*.
+    python_mode:
+        ``"full"`` includes Python files as they are.  ``"skeleton"``
+        keeps only imports, class and function signatures, docstrings
+        and class-level annotations, with bodies replaced by ``...``.
+        Skeletons are built with :mod:`ast` in a process pool, cached
+        by content hash and written below ``.sphinx-source-tree/`` in
+        the project root; the includes point there.  Files that cannot
+        be parsed, or that have range options, are included in full.
+    transforms:
+        Names of content transforms in ``TRANSFORMS`` applied in order
+        to every included file: ``"strip-comments"`` (``tokenize`` for
+        Python, a small lexer for the other languages of
+        ``COMMENT_SYNTAX``) and ``"collapse-blank-lines"``.  Changed
+        files are staged like skeletons, results are cached by content
+        hash and the bytes saved per language are reported.  Files with
+        range options are left alone.
+    max_files:
+        Stop walking the project after more than this many files.
+    max_entries_scanned:
+        Stop walking the project after looking at more than this many
+        directory entries, ignored ones included.
+    time_budget:
+        Stop walking the project after this many seconds.
+    on_scan_limit:
+        What to do when the walk stopped at one of the limits above:
+        ``"error"`` raises ``ValueError``, ``"partial"`` renders what was
+        found, with `` (partial)`` appended to the title.  Either way the
+        directories holding the most entries are named.  The limits do
+        not apply to a *scan* passed in.
+    cache_dir:
+        Directory of the persistent cache used for token estimates,
+        sniffing, classification results, content hashes, Python
+        skeletons and transform results.
+        Defaults to ``$SPHINX_SOURCE_TREE_CACHE_DIR``, else
+        ``$XDG_CACHE_HOME/sphinx-source-tree`` or
+        ``~/.cache/sphinx-source-tree``.
+    scan:
+        A :class:`ProjectScan` of *project_root* taken with the same
+        *ignore* patterns.  When omitted the project is walked once and
+        the snapshot is shared by the tree and the file listing.
+    """
+    root = Path(project_root).resolve()
+    listing = collect_listing(
+        root,
+        depth=depth,
+        extensions=extensions,
+        ignore=ignore,
+        whitelist=whitelist,
+        include_all=include_all,
+        title=title,
+        linenos=linenos,
+        extra_languages=extra_languages,
+        file_options=file_options,
+        order=order,
+        max_file_size=max_file_size,
+        max_file_lines=max_file_lines,
+        oversize=oversize,
+        oversize_exempt=oversize_exempt,
+        token_budget=token_budget,
+        token_weights=token_weights,
+        token_counter=token_counter,
+        sniff=sniff,
+        skip_generated=skip_generated,
+        generated_exempt=generated_exempt,
+        dedupe=dedupe,
+        strict_file_options=strict_file_options,
+        resolve_lines=resolve_lines,
+        chunk_lines=chunk_lines,
+        chunk_snap=chunk_snap,
+        python_mode=python_mode,
+        transforms=transforms,
+        max_files=max_files,
+        max_entries_scanned=max_entries_scanned,
+        time_budget=time_budget,
+        on_scan_limit=on_scan_limit,
+        cache_dir=cache_dir,
+        scan=scan,
+        exclude=[output],
+    )
+    return _render_rst(listing, Path(output).resolve())
+
+
+@dataclass
+class SourceListing:
+    """Everything a renderer needs, collected once per output.
+
+    ``tree`` is the ASCII directory tree (without the root line and
+    without indentation); ``files`` is the ordered ``literalinclude``
+    listing and ``file_options`` the validated per-file range options
+    keyed by relative posix path.  ``notes`` holds ``(path, reason)``
+    pairs for files that were dropped or truncated, and ``duplicates``
+    maps files with the same content as an earlier file to that file;
+    renderers emit a reference instead of their contents.  ``chunks``
+    maps large files to the 1-based inclusive line ranges they are
+    split into, and ``staged`` maps files to the transformed copy that
+    is included in their place.  ``scratch`` maps staged copies that a
+    check (see ``--check``) did not write to a temporary file with their
+    new content.
+    """
+
+    root: Path
+    title: str
+    depth: int
+    tree: str
+    files: list[Path]
+    file_options: dict[str, dict[str, str]] = field(default_factory=dict)
+    extra_languages: dict[str, str] | None = None
+    linenos: bool = False
+    notes: list[tuple[str, str]] = field(default_factory=list)
+    duplicates: dict[Path, Path] = field(default_factory=dict)
+    chunks: dict[Path, list[tuple[int, int]]] = field(default_factory=dict)
+    staged: dict[Path, Path] = field(default_factory=dict)
+    scratch: dict[Path, Path] = field(default_factory=dict)
+
+    def rel(self, fp: Path) -> str:
+        """Return *fp* relative to the project root, in posix form."""
+        return fp.relative_to(self.root).as_posix()
+
+    def source(self, fp: Path) -> Path:
+        """Return the path whose contents are included for *fp*."""
+        return self.staged.get(fp, fp)
+
+    def read_path(self, fp: Path) -> Path:
+        """Return the path to read the included contents of *fp* from."""
+        source = self.source(fp)
+        return self.scratch.get(source, source)
+
+    def language(self, fp: Path) -> str:
+        """Return the highlight language of *fp*."""
+        return detect_language(fp, self.extra_languages)
+
+    def options(self, fp: Path) -> dict[str, str]:
+        """Return the inclusion-range options configured for *fp*."""
+        return self.file_options.get(self.rel(fp), {})
+
+    def sections(self, fp: Path) -> list[tuple[str, dict[str, str]]]:
+        """Return ``(caption, options)`` for each include of *fp*.
+
+        A single entry captioned with the relative path, or one entry
+        per chunk with a ``lines`` option and the range in the caption.
+        """
+        rel, options = self.rel(fp), self.options(fp)
+        if fp not in self.chunks:
+            return [(rel, options)]
+        return [
+            (
+                f"{rel} (lines {first}-{last})",
+                {**options, "lines": f"{first}-{last}"},
+            )
+            for first, last in self.chunks[fp]
+        ]
+
+
+def collect_listing(
+    project_root: Path | str = ".",
+    *,
+    depth: int = 10,
+    extensions: list[str] | None = None,
+    ignore: list[str] | None = None,
+    whitelist: list[str] | None = None,
+    include_all: bool = True,
+    title: str = "Project source-tree",
+    linenos: bool = False,
+    extra_languages: dict[str, str] | None = None,
+    file_options: dict[str, dict[str, Any]] | None = None,
+    order: list[str] | None = None,
+    max_file_size: int | str | None = None,
+    max_file_lines: int | None = None,
+    oversize: str = "skip",
+    oversize_exempt: list[str] | None = None,
+    token_budget: int | None = None,
+    token_weights: dict[str, float] | None = None,
+    token_counter: str | Callable[[str], int] | None = None,
+    sniff: bool = True,
+    skip_generated: bool = False,
+    generated_exempt: list[str] | None = None,
+    dedupe: bool = False,
+    strict_file_options: bool = False,
+    resolve_lines: bool = False,
+    chunk_lines: int | None = None,
+    chunk_snap: bool = False,
+    python_mode: str = "full",
+    transforms: list[str] | None = None,
+    max_files: int | None = None,
+    max_entries_scanned: int | None = None,
+    time_budget: float | None = None,
+    on_scan_limit: str = "error",
+    cache_dir: Path | str | None = None,
+    scan: ProjectScan | None = None,
+    exclude: Iterable[Path | str] | None = None,
+) -> SourceListing:
+    """Collect the tree and the ordered file list into a :class:`SourceListing`.
+
+    This is the format-independent half of :func:`generate`; pass the
+    result to any of the ``RENDERERS`` to emit several formats from a
+    single scan.  Parameters are the same as for :func:`generate`, plus
+    *exclude*: files and directories left out of both the tree and the
+    listing (relative paths resolve against the current working
+    directory, like *output*), which is how the documents being
+    generated keep from listing themselves.
     """
     root = Path(project_root).resolve()
-    output_dir = Path(output).resolve().parent
     _extensions = (
         extensions if extensions is not None else list(DEFAULTS["extensions"])
     )
@@ -592,135 +1512,3530 @@ def generate(
     _whitelist = (
         whitelist if whitelist is not None else list(DEFAULTS["whitelist"])
     )
+    if on_scan_limit not in SCAN_LIMIT_MODES:
+        raise ValueError(
+            f"Invalid on-scan-limit {on_scan_limit!r}; expected one of "
+            f"{SCAN_LIMIT_MODES}"
+        )
+    if chunk_lines is not None and chunk_lines < 1:
+        raise ValueError(
+            f"Invalid chunk-lines {chunk_lines!r}; expected a positive number"
+        )
+    if scan is None:
+        scan = scan_project(
+            root,
+            _ignore,
+            max_files=max_files,
+            max_entries_scanned=max_entries_scanned,
+            time_budget=time_budget,
+        )
+    if scan.truncated and on_scan_limit == "error":
+        raise ValueError(
+            f"The scan of {root} stopped at {scan.truncated}; most entries "
+            f"were in {_heaviest_list(scan)}.  Ignore what is not needed "
+            f"or raise the limit."
+        )
+    if exclude:
+        excluded = [Path(path).resolve() for path in exclude]
+        scan = scan.without(
+            path.relative_to(root).as_posix()
+            for path in excluded
+            if path != root and path.is_relative_to(root)
+        )
 
-    # Normalise file_options keys to relative-posix strings
-    _file_options: dict[str, dict[str, str]] = {}
-    for key, opts in (file_options or {}).items():
-        key_path = Path(key)
-        if key_path.is_absolute():
-            try:
-                rel_key = key_path.relative_to(root).as_posix()
-            except ValueError:
-                rel_key = key_path.as_posix()
-        else:
-            rel_key = Path(key).as_posix()
-        _file_options[rel_key] = _validate_file_options(opts, source=key)
-
-    underline = "=" * len(title)
-    header = (
-        f"{title}\n"
-        f"{underline}\n"
-        f"\n"
-        f"Below is the layout of the project (to {depth} levels), "
-        f"followed by\nthe contents of each key file.\n"
-        f"\n"
-        f".. code-block:: text\n"
-        f"   :caption: Project directory layout\n"
-        f"\n"
-        f"   {root.name}/"
+    with _phase("tree"):
+        tree = build_tree(
+            root,
+            max_depth=depth,
+            ignore=_ignore,
+            whitelist=_whitelist,
+            include_all=include_all,
+            root=root,
+            scan=scan,
+        )
+    with _phase("collect"):
+        files = collect_files(
+            root,
+            extensions=_extensions,
+            ignore=_ignore,
+            whitelist=_whitelist,
+            include_all=include_all,
+            scan=scan,
+        )
+    with _phase("order"):
+        # Apply explicit ordering (only affects literalinclude listing)
+        files = _apply_order(files, order or [], root)
+    listing = SourceListing(
+        root=root,
+        title=title,
+        depth=depth,
+        tree=tree,
+        files=files,
+        file_options=_normalise_file_options(file_options, root),
+        extra_languages=extra_languages,
+        linenos=linenos,
     )
+    if scan.truncated:
+        _mark_partial(listing, scan)
+    with _phase("filters"):
+        if sniff:
+            _apply_sniffing(listing, cache_dir)
+        _check_ranges(
+            listing, strict=strict_file_options, resolve=resolve_lines
+        )
+        if skip_generated:
+            _apply_classifier(listing, generated_exempt or [], cache_dir)
+        if max_file_size is not None or max_file_lines is not None:
+            _apply_size_limits(
+                listing,
+                scan,
+                max_file_size=_parse_size(max_file_size),
+                max_file_lines=max_file_lines,
+                oversize=oversize,
+                exempt=oversize_exempt or [],
+            )
+        if dedupe:
+            _apply_dedupe(listing, scan, cache_dir)
+        if python_mode != "full":
+            _apply_python_mode(listing, python_mode, cache_dir)
+        if transforms:
+            _apply_transforms(listing, transforms, cache_dir)
+        if chunk_lines:
+            _apply_chunking(listing, scan, chunk_lines, snap=chunk_snap)
+        if token_budget is not None:
+            _apply_token_budget(
+                listing,
+                budget=token_budget,
+                weights=token_weights or {},
+                order=order or [],
+                counter=token_counter,
+                cache_dir=cache_dir,
+            )
+    _count("files_selected", len(listing.files))
+    return listing
 
-    tree = build_tree(
-        root,
-        max_depth=depth,
-        ignore=_ignore,
-        whitelist=_whitelist,
-        include_all=include_all,
-        root=root,
-        prefix="   ",
+
+def _heaviest_list(scan: ProjectScan) -> str:
+    """Return the heaviest directories of *scan* as readable text."""
+    return ", ".join(
+        f"{rel} ({count} entries)" for rel, count in scan.heaviest_dirs()
     )
 
-    parts: list[str] = [header, tree, ""]
 
-    files = collect_files(
-        root,
-        extensions=_extensions,
-        ignore=_ignore,
-        whitelist=_whitelist,
-        include_all=include_all,
+def _mark_partial(listing: SourceListing, scan: ProjectScan) -> None:
+    """Mark *listing*, built from a walk that stopped early, as partial."""
+    print(
+        f"Warning: the scan of {scan.root} stopped at {scan.truncated}; "
+        f"the output is partial.  Most entries were in "
+        f"{_heaviest_list(scan)}.",
+        file=sys.stderr,
     )
+    listing.title += " (partial)"
+    listing.notes[:0] = [
+        (rel, f"partial scan, stopped at {scan.truncated}; {count} entries")
+        for rel, count in scan.heaviest_dirs()
+    ]
 
-    # Apply explicit ordering (only affects literalinclude listing)
-    files = _apply_order(files, order or [], root)
 
-    for fp in files:
-        rel = fp.relative_to(root).as_posix()
-        include_path = os.path.relpath(fp, output_dir).replace(os.sep, "/")
-        lang = detect_language(fp, extra_languages)
-        section_underline = "-" * len(rel)
-        block: list[str] = [
-            rel,
-            section_underline,
-            "",
-            f".. literalinclude:: {include_path}",
-        ]
-        if lang:
-            block.append(f"   :language: {lang}")
-        block.append(f"   :caption: {rel}")
-        if linenos:
-            block.append("   :linenos:")
-        # Append any per-file inclusion-range options
-        for opt_key, opt_val in _file_options.get(rel, {}).items():
-            block.append(f"   :{opt_key}: {opt_val}")
-        block.append("")
-        parts.extend(block)
+def _apply_size_limits(
+    listing: SourceListing,
+    scan: ProjectScan,
+    *,
+    max_file_size: int | None,
+    max_file_lines: int | None,
+    oversize: str,
+    exempt: list[str],
+) -> None:
+    """Drop or truncate the oversized files of *listing* in place."""
+    if oversize not in OVERSIZE_MODES:
+        raise ValueError(
+            f"Invalid oversize {oversize!r}; expected one of {OVERSIZE_MODES}"
+        )
+    kept: list[Path] = []
+    for fp in listing.files:
+        rel = listing.rel(fp)
+        options = listing.file_options.get(rel, {})
+        size = scan.file_size(rel)
+        if (
+            size is None
+            or "lines" in options
+            or _is_ignored(rel, fp.name, exempt)
+        ):
+            kept.append(fp)
+            continue
+        reason = ""
+        if max_file_size is not None and size > max_file_size:
+            reason = (
+                f"{_format_size(size)} exceeds max-file-size "
+                f"({_format_size(max_file_size)})"
+            )
+        # A file cannot have more lines than bytes, so only large files
+        # are opened to count lines.
+        elif (
+            max_file_lines is not None
+            and size > max_file_lines
+            and _count_lines(fp, stop_after=max_file_lines) > max_file_lines
+        ):
+            reason = f"more than {max_file_lines} lines (max-file-lines)"
+        if not reason:
+            kept.append(fp)
+            continue
+        if oversize == "skip":
+            listing.notes.append((rel, f"skipped, {reason}"))
+            continue
+        head = _head_lines(fp, max_file_size, max_file_lines)
+        if not head:
+            listing.notes.append(
+                (rel, f"skipped, {reason} (even its first line)")
+            )
+            continue
+        listing.file_options[rel] = {**options, "lines": f"1-{head}"}
+        listing.notes.append((rel, f"truncated to {head} lines, {reason}"))
+        kept.append(fp)
+    listing.files = kept
 
-    return "\n".join(parts)
 
+def _cached_map(
+    cache_name: str,
+    files: list[Path],
+    func: Callable[[Path], Any],
+    cache_dir: Path | str | None,
+    root: Path,
+) -> dict[Path, Any]:
+    """Return ``func(fp)`` for every file, computing misses in parallel.
 
-def _generate_from_cfg(cfg: dict[str, Any]) -> str:
-    """Call ``generate()`` using a resolved config dict."""
-    return generate(
-        project_root=cfg["project_root"],
-        output=cfg.get("output", DEFAULTS["output"]),
-        depth=cfg.get("depth", DEFAULTS["depth"]),
-        extensions=cfg.get("extensions"),
-        ignore=cfg.get("ignore"),
-        whitelist=cfg.get("whitelist"),
-        include_all=cfg.get("include_all", DEFAULTS["include_all"]),
-        title=cfg.get("title", DEFAULTS["title"]),
-        linenos=cfg.get("linenos", DEFAULTS["linenos"]),
-        extra_languages=cfg.get("extra_languages"),
-        file_options=_resolve_file_options_profile(cfg),
-        order=cfg.get("order"),
+    Results are kept in the persistent cache *cache_name*, so *func* only
+    runs for files that are new or changed since the last run.  Entries
+    of files below *root* that no longer exist are dropped.
+    """
+    cache = _FileCache(cache_name, cache_dir)
+    results: dict[Path, Any] = {}
+    pending: list[Path] = []
+    for fp in files:
+        cached = cache.get(str(fp), fp)
+        if cached is None:
+            pending.append(fp)
+        else:
+            results[fp] = cached
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(32, len(pending))) as pool:
+            for fp, result in zip(pending, pool.map(func, pending)):
+                results[fp] = result
+                cache.set(str(fp), fp, result)
+    cache.prune(root)
+    cache.save()
+    return results
+
+
+def _apply_sniffing(
+    listing: SourceListing,
+    cache_dir: Path | str | None,
+) -> None:
+    """Drop binary files and set ``encoding`` options in place."""
+    results = _cached_map(
+        "sniff", listing.files, _sniff_file, cache_dir, listing.root
     )
+    kept: list[Path] = []
+    for fp in listing.files:
+        rel = listing.rel(fp)
+        result = results[fp]
+        if result == "binary":
+            listing.notes.append((rel, "skipped, binary content"))
+            continue
+        options = listing.file_options.get(rel, {})
+        if result and "encoding" not in options:
+            listing.file_options[rel] = {**options, "encoding": result}
+        kept.append(fp)
+    listing.files = kept
 
 
-def _write_output(content: str, out_path: Path) -> None:
-    """Write *content* to *out_path*, creating parent directories as needed."""
-    if not out_path.is_absolute():
-        out_path = Path.cwd() / out_path
-    out_path = out_path.resolve()
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(content, encoding="utf-8")
-    print(f"Wrote {out_path}")
+def _sniff_file(fp: Path) -> str:
+    """Classify the head of *fp*.
 
+    Returns ``"binary"``, the encoding to pass to ``literalinclude``, or
+    ``""`` for UTF-8 (with or without a BOM), which needs no option.
+    """
+    try:
+        with fp.open("rb") as fh:
+            head = fh.read(SNIFF_BYTES)
+    except OSError:
+        return ""
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    if head.startswith(BINARY_MAGIC) or b"\x00" in head:
+        return "binary"
+    try:
+        # Incremental decoding tolerates a character cut at SNIFF_BYTES.
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return ""
 
-# ----------------------------------------------------------------------------
-# CLI
-# ----------------------------------------------------------------------------
 
+def _check_ranges(
+    listing: SourceListing,
+    *,
+    strict: bool,
+    resolve: bool,
+) -> None:
+    """Verify the range options of *listing*, optionally resolving them.
 
-def build_parser() -> argparse.ArgumentParser:
-    """Create the argument parser (exposed for documentation / testing)."""
-    p = argparse.ArgumentParser(
-        prog="sphinx-source-tree",
-        description=(
-            "Generate a .rst file with an ASCII project tree "
-            "and literalinclude blocks for every source file."
-        ),
+    All problems are collected first and reported in one message: a
+    warning, or a ``ValueError`` when *strict* is true.
+    """
+    problems: list[str] = []
+    for fp in listing.files:
+        rel = listing.rel(fp)
+        options = listing.file_options.get(rel, {})
+        if not options.keys() & RANGE_OPTIONS:
+            continue
+        try:
+            indices = _resolve_range(fp, options)
+        except (OSError, ValueError) as exc:
+            problems.append(f"  {rel}: {exc}")
+            continue
+        if resolve and options.keys() & MARKER_OPTIONS:
+            resolved = {
+                key: value
+                for key, value in options.items()
+                if key not in RANGE_OPTIONS
+            }
+            listing.file_options[rel] = {
+                **resolved,
+                "lines": _format_line_spec(indices),
+            }
+    if not problems:
+        return
+    message = (
+        f"file-options do not match {len(problems)} file(s):\n"
+        + "\n".join(problems)
     )
-    p.add_argument(
-        "-V",
-        "--version",
-        action="version",
-        version=f"%(prog)s {__version__}",
+    if strict:
+        raise ValueError(message)
+    print(
+        f"Warning: {message}\nsphinx-build will fail on these; bundles "
+        f"include the whole file.",
+        file=sys.stderr,
     )
-    p.add_argument(
-        "-p",
-        "--project-root",
-        type=Path,
-        default=None,
+
+
+def _apply_classifier(
+    listing: SourceListing,
+    exempt: list[str],
+    cache_dir: Path | str | None,
+) -> None:
+    """Drop lock, generated and minified files from *listing* in place."""
+    candidates = [
+        fp
+        for fp in listing.files
+        if not _is_ignored(listing.rel(fp), fp.name, exempt)
+    ]
+    results = _cached_map(
+        "classify", candidates, _classify_file, cache_dir, listing.root
+    )
+    kept: list[Path] = []
+    for fp in listing.files:
+        reason = results.get(fp, "")
+        if not reason:
+            kept.append(fp)
+            continue
+        rel = listing.rel(fp)
+        listing.notes.append((rel, f"skipped, {reason}"))
+        print(f"Skipping {rel}: {reason}.", file=sys.stderr)
+    listing.files = kept
+
+
+def _classify_file(fp: Path) -> str:
+    """Return why *fp* looks generated, minified or a lock file, or ``""``.
+
+    Names are checked first; otherwise at most ``CLASSIFY_BYTES`` are
+    read to look for generator markers near the top and for the very
+    long lines typical of minified code.
+    """
+    name = fp.name
+    if name in LOCK_FILES:
+        return "lock file"
+    if any(fnmatch.fnmatch(name, pat) for pat in GENERATED_NAMES):
+        return "generated file"
+    if any(fnmatch.fnmatch(name, pat) for pat in MINIFIED_NAMES):
+        return "minified file"
+    try:
+        with fp.open("rb") as fh:
+            head = fh.read(CLASSIFY_BYTES)
+    except OSError:
+        return ""
+    if any(marker in head[:2048] for marker in GENERATED_MARKERS):
+        return "generated file (header marker)"
+    lines = head.split(b"\n")
+    if len(head) == CLASSIFY_BYTES and len(lines) > 1:
+        lines.pop()  # The last line may be cut short
+    longest = max(map(len, lines), default=0)
+    # Average line length is only meaningful with some content to go by.
+    if longest > MINIFIED_MAX_LINE or (
+        len(head) >= 4096 and len(head) / len(lines) > MINIFIED_AVG_LINE
+    ):
+        return f"minified content (longest line {longest} bytes)"
+    return ""
+
+
+def _apply_dedupe(
+    listing: SourceListing,
+    scan: ProjectScan,
+    cache_dir: Path | str | None,
+) -> None:
+    """Record files with the same content as an earlier file, in place."""
+    by_size: dict[int, list[Path]] = {}
+    for fp in listing.files:
+        size = scan.file_size(listing.rel(fp))
+        if size is not None:
+            by_size.setdefault(size, []).append(fp)
+    candidates = [
+        fp for group in by_size.values() if len(group) > 1 for fp in group
+    ]
+    hashes = _cached_map(
+        "hashes", candidates, _hash_file, cache_dir, listing.root
+    )
+    first: dict[tuple[str, str], Path] = {}
+    for fp in listing.files:
+        if fp not in hashes:
+            continue
+        key = (hashes[fp], json.dumps(listing.options(fp), sort_keys=True))
+        original = first.setdefault(key, fp)
+        if original is not fp:
+            listing.duplicates[fp] = original
+
+
+def _hash_file(fp: Path) -> str:
+    """Return the BLAKE2 digest of *fp*, streaming large files via mmap."""
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with fp.open("rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size >= HASH_MMAP_THRESHOLD:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    digest.update(mm)
+            else:
+                digest.update(fh.read())
+    except (OSError, ValueError):
+        # Unreadable files get a unique digest and are never deduplicated.
+        return f"unreadable:{fp}"
+    return digest.hexdigest()
+
+
+def _apply_chunking(
+    listing: SourceListing,
+    scan: ProjectScan,
+    chunk_lines: int,
+    *,
+    snap: bool,
+) -> None:
+    """Record the chunks of every long file of *listing* in place."""
+    for fp in listing.files:
+        rel = listing.rel(fp)
+        size = scan.file_size(rel)
+        if (
+            size is None
+            or size <= chunk_lines
+            or fp in listing.duplicates
+            or listing.options(fp).keys() & RANGE_OPTIONS
+        ):
+            continue
+        # A staged copy is never larger than its original, so the size
+        # check above still holds for it.
+        source = listing.read_path(fp)
+        total = _count_lines(source)
+        if total <= chunk_lines:
+            continue
+        starts: list[int] = []
+        if snap and fp.suffix in (".py", ".pyi"):
+            starts = _top_level_starts(source, listing.options(fp))
+        listing.chunks[fp] = _chunk_ranges(total, chunk_lines, starts)
+
+
+def _chunk_ranges(
+    total: int,
+    chunk_lines: int,
+    starts: list[int],
+) -> list[tuple[int, int]]:
+    """Split lines ``1..total`` into ranges of at most *chunk_lines*.
+
+    When a line number in *starts* falls inside a chunk (after its first
+    line) the chunk ends right before the last such line.
+    """
+    ranges: list[tuple[int, int]] = []
+    first = 1
+    while first <= total:
+        last = min(first + chunk_lines - 1, total)
+        if last < total:
+            snapped = [n for n in starts if first < n <= last + 1]
+            if snapped:
+                last = max(snapped) - 1
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def _top_level_starts(fp: Path, options: dict[str, str]) -> list[int]:
+    """Return the first line of every top-level statement of *fp*.
+
+    Decorators count as part of the statement they decorate.  Files that
+    cannot be parsed yield no boundaries.
+    """
+    try:
+        tree = ast.parse(
+            fp.read_bytes().decode(options.get("encoding", "utf-8"))
+        )
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError):
+        return []
+    return sorted(
+        min(
+            [node.lineno]
+            + [dec.lineno for dec in getattr(node, "decorator_list", [])]
+        )
+        for node in tree.body
+    )
+
+
+def _apply_python_mode(
+    listing: SourceListing,
+    mode: str,
+    cache_dir: Path | str | None,
+) -> None:
+    """Stage skeletons of the Python files of *listing* in place.
+
+    Skeletons are cached per file with the hash of its content, so an
+    unchanged file is only parsed once, whatever its mtime, and a copy
+    of it is not parsed at all.  Cache misses are parsed in a process
+    pool.
+    """
+    if mode not in PYTHON_MODES:
+        raise ValueError(
+            f"Invalid python-mode {mode!r}; expected one of {PYTHON_MODES}"
+        )
+    if mode == "full":
+        return
+    sources: dict[Path, bytes] = {}
+    for fp in listing.files:
+        if (
+            fp.suffix not in (".py", ".pyi")
+            or fp in listing.duplicates
+            or listing.options(fp).keys() & RANGE_OPTIONS
+        ):
+            continue
+        with contextlib.suppress(OSError):
+            sources[fp] = fp.read_bytes()
+    digests = {
+        fp: hashlib.blake2b(data, digest_size=20).hexdigest()
+        for fp, data in sources.items()
+    }
+    cache = _FileCache("skeletons", cache_dir)
+    skeletons: dict[str, Any] = {}
+    pending: dict[str, bytes] = {}
+    for fp, digest in digests.items():
+        cached = cache.get_content(str(fp), digest)
+        if cached is None:
+            pending[digest] = sources[fp]
+        else:
+            skeletons[digest] = cached
+    if pending:
+        parsed = _process_map(_python_skeleton, list(pending.values()))
+        for digest, skeleton in zip(pending, parsed):
+            # False marks a file that does not parse.
+            skeletons[digest] = False if skeleton is None else skeleton
+    for fp, digest in digests.items():
+        cache.set_content(str(fp), digest, skeletons[digest])
+    cache.prune(listing.root)
+    cache.save()
+
+    for fp, digest in digests.items():
+        skeleton = skeletons[digest]
+        if not skeleton:
+            print(
+                f"Warning: cannot parse {listing.rel(fp)}; including the "
+                f"full source.",
+                file=sys.stderr,
+            )
+            continue
+        _stage(listing, fp, skeleton, mode)
+
+
+def _stage(listing: SourceListing, fp: Path, content: str, kind: str) -> None:
+    """Write *content* as the staged copy of *fp* and include that instead.
+
+    Copies live in ``STAGING_DIR/<kind>/<rel>`` below the project root
+    and are always UTF-8, so an ``encoding`` option of *fp* is dropped.
+    """
+    rel = listing.rel(fp)
+    staged = listing.root / STAGING_DIR / kind / rel
+    if _atomic_write(content, staged) and _scratch_dir is not None:
+        # A check wrote nothing; later steps read the new content here.
+        scratch = _scratch_dir / kind / rel
+        scratch.parent.mkdir(parents=True, exist_ok=True)
+        scratch.write_text(content, encoding="utf-8")
+        listing.scratch[staged] = scratch
+    listing.staged[fp] = staged
+    options = listing.file_options.pop(rel, {})
+    options.pop("encoding", None)
+    if options:
+        listing.file_options[rel] = options
+
+
+def _prune_staged(listings: list[SourceListing]) -> None:
+    """Delete the staged copies that none of *listings* include.
+
+    Only the ``STAGING_DIR`` of the roots of *listings* is looked at.
+    Copies are left behind by deleted files and by switching a mode
+    off; empty directories are removed too.
+    """
+    keep = {path for listing in listings for path in listing.staged.values()}
+    for root in {listing.root for listing in listings}:
+        for dirpath, _, filenames in os.walk(root / STAGING_DIR, topdown=False):
+            for name in filenames:
+                path = Path(dirpath, name)
+                if path not in keep:
+                    with contextlib.suppress(OSError):
+                        path.unlink()
+            with contextlib.suppress(OSError):
+                Path(dirpath).rmdir()
+
+
+def _process_map(func: Callable[[Any], Any], items: list[Any]) -> list[Any]:
+    """Return ``func(item)`` for every item, in order.
+
+    Large batches are spread over a process pool; small ones, or
+    platforms where processes cannot be started, run in-process.
+    """
+    if len(items) >= PROCESS_POOL_MIN:
+        try:
+            with ProcessPoolExecutor() as pool:
+                return list(pool.map(func, items, chunksize=8))
+        except (BrokenExecutor, NotImplementedError, OSError):
+            pass
+    return [func(item) for item in items]
+
+
+def _python_skeleton(source: bytes) -> str | None:
+    """Return the skeleton of the Python *source*, ``None`` if it is invalid.
+
+    The module docstring, imports, ``__all__``, classes (with their
+    decorators, bases, docstrings and annotated attributes) and function
+    signatures with their docstrings are kept; function bodies become
+    ``...``.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    tree.body = _skeleton_body(tree.body, module=True)
+    return ast.unparse(tree) + "\n"
+
+
+def _skeleton_body(body: list[ast.stmt], *, module: bool) -> list[ast.stmt]:
+    """Return the statements of *body* that belong in a skeleton."""
+    kept: list[ast.stmt] = []
+    for index, node in enumerate(body):
+        if index == 0 and _is_docstring(node):
+            kept.append(node)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            stub: list[ast.stmt] = [ast.Expr(ast.Constant(...))]
+            if node.body and _is_docstring(node.body[0]):
+                stub.insert(0, node.body[0])
+            node.body = stub
+            kept.append(node)
+        elif isinstance(node, ast.ClassDef):
+            node.body = _skeleton_body(node.body, module=False) or [
+                ast.Expr(ast.Constant(...))
+            ]
+            kept.append(node)
+        elif module and isinstance(node, (ast.Import, ast.ImportFrom)):
+            kept.append(node)
+        elif module and isinstance(node, ast.Assign):
+            if any(
+                isinstance(target, ast.Name) and target.id == "__all__"
+                for target in node.targets
+            ):
+                kept.append(node)
+        elif not module and isinstance(node, ast.AnnAssign):
+            kept.append(node)
+    return kept
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    """True when *node* is a string literal statement."""
+    return (
+        isinstance(node, ast.Expr)
+        and isinstance(node.value, ast.Constant)
+        and isinstance(node.value.value, str)
+    )
+
+
+def _apply_transforms(
+    listing: SourceListing,
+    transforms: list[str],
+    cache_dir: Path | str | None,
+) -> None:
+    """Run the *transforms* over the files of *listing*, staging results.
+
+    Results are cached per file and list of transforms with the hash of
+    the content; cache misses run in a process pool.  The bytes saved
+    are reported per language.
+    """
+    for name in transforms:
+        if name not in TRANSFORMS:
+            raise ValueError(
+                f"Invalid transform {name!r}; expected one of "
+                f"{tuple(TRANSFORMS)}"
+            )
+    jobs: dict[Path, tuple[str, str, tuple[str, ...]]] = {}
+    for fp in listing.files:
+        options = listing.options(fp)
+        # Ranges refer to lines of the original file.
+        if fp in listing.duplicates or options.keys() & RANGE_OPTIONS:
+            continue
+        try:
+            text = listing.read_path(fp).read_text(
+                encoding=options.get("encoding", "utf-8"), errors="replace"
+            )
+        except OSError:
+            continue
+        jobs[fp] = (text, listing.language(fp), tuple(transforms))
+    keys = {
+        fp: hashlib.blake2b(
+            "\0".join([text, language, *names]).encode(), digest_size=20
+        ).hexdigest()
+        for fp, (text, language, names) in jobs.items()
+    }
+    cache = _FileCache("transforms", cache_dir)
+    qualifier = "\0" + "+".join(transforms)
+    results: dict[str, str] = {}
+    pending: dict[str, tuple[str, str, tuple[str, ...]]] = {}
+    for fp, key in keys.items():
+        cached = cache.get_content(f"{fp}{qualifier}", key)
+        if cached is None:
+            pending[key] = jobs[fp]
+        else:
+            results[key] = cached
+    if pending:
+        done = _process_map(_transform_source, list(pending.values()))
+        results.update(zip(pending, done))
+    for fp, key in keys.items():
+        cache.set_content(f"{fp}{qualifier}", key, results[key])
+    cache.prune(listing.root)
+    cache.save()
+
+    saved: dict[str, list[int]] = {}
+    for fp, key in keys.items():
+        text, language, _ = jobs[fp]
+        result = results[key]
+        before, after = len(text.encode()), len(result.encode())
+        totals = saved.setdefault(language or "text", [0, 0])
+        totals[0] += before
+        totals[1] += before - after
+        if result != text:
+            _stage(listing, fp, result, "transformed")
+    total = sum(before for before, _ in saved.values())
+    if total:
+        per_language = ", ".join(
+            f"{language} {_format_size(diff)}"
+            for language, (_, diff) in sorted(
+                saved.items(), key=lambda item: -item[1][1]
+            )
+            if diff
+        )
+        diff_total = sum(diff for _, diff in saved.values())
+        print(
+            f"Transforms saved {_format_size(diff_total)} of "
+            f"{_format_size(total)}"
+            + (f": {per_language}." if per_language else "."),
+            file=sys.stderr,
+        )
+
+
+def _transform_source(job: tuple[str, str, tuple[str, ...]]) -> str:
+    """Apply the named transforms of *job* to its text, in order."""
+    text, language, names = job
+    for name in names:
+        text = TRANSFORMS[name](text, language)
+    return text
+
+
+def _strip_comments(text: str, language: str) -> str:
+    """Remove comments from *text*, dropping lines left empty.
+
+    Python is tokenized; other languages in ``COMMENT_SYNTAX`` go through
+    a simple lexer that knows their comment and string delimiters.
+    Text in other languages, or that does not tokenize, is returned
+    unchanged.  A ``#!`` line is kept.
+    """
+    if language == "python":
+        marked = _mark_python_comments(text)
+    elif language in COMMENT_SYNTAX:
+        marked = _comment_pattern(language).sub(_mark_comment, text)
+    else:
+        return text
+    if marked is None or _COMMENT_MARK not in marked:
+        return text
+    lines: list[str] = []
+    for line in marked.splitlines(keepends=True):
+        if _COMMENT_MARK in line:
+            body = line.replace(_COMMENT_MARK, "").rstrip()
+            if not body:
+                continue
+            line = body + line[len(line.rstrip("\r\n")) :]
+        lines.append(line)
+    return "".join(lines)
+
+
+def _mark_python_comments(text: str) -> str | None:
+    """Replace the comments of Python *text* by ``_COMMENT_MARK``."""
+    lines = text.splitlines(keepends=True)
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (SyntaxError, tokenize.TokenError):
+        return None
+    for tok in reversed(tokens):
+        if tok.type != tokenize.COMMENT:
+            continue
+        row, col = tok.start
+        if row == 1 and tok.string.startswith("#!"):
+            continue
+        line = lines[row - 1]
+        lines[row - 1] = line[:col] + _COMMENT_MARK + line[tok.end[1] :]
+    return "".join(lines)
+
+
+@functools.cache
+def _comment_pattern(language: str) -> re.Pattern[str]:
+    """Return the lexer regex of *language*, see ``COMMENT_SYNTAX``.
+
+    Strings (and regex literals, here-documents) are matched and kept
+    first, so comment delimiters inside them are ignored.  Only backtick
+    strings and here-documents span lines.  A ``/`` starts a regex
+    literal where a division cannot follow: after an opening bracket,
+    ``=``, ``:``, ``!``, ``&``, ``|``, ``?``, ``;``, ``return`` or at the
+    start of a line.
+    """
+    syntax = COMMENT_SYNTAX[language]
+    strings = []
+    for quote in syntax.quotes:
+        q = re.escape(quote)
+        stop = q if quote == "`" else rf"{q}\n"
+        strings.append(rf"{q}(?:\\.|[^{stop}\\])*{q}?")
+    alternatives = [f"(?P<string>{'|'.join(strings)})"] if strings else []
+    if syntax.regex:
+        alternatives.append(
+            r"(?P<regex>(?:(?<=[(,=:\[!&|?{};])|(?<=\breturn)|^)"
+            r"[ \t]*/(?![/*])(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/)"
+        )
+    if syntax.heredoc:
+        alternatives.append(
+            r"(?P<heredoc>(?<!<)<<-?[ \t]*(?P<quote>['\"]?)"
+            r"(?P<tag>[A-Za-z_]\w*)(?P=quote)[^\n]*\n.*?^\t*(?P=tag)$)"
+        )
+    for open_, close in syntax.block:
+        alternatives.append(
+            rf"{re.escape(open_)}(?:.*?{re.escape(close)}|.*\Z)"
+        )
+    markers = "|".join(re.escape(marker) for marker in syntax.line)
+    if syntax.whole:
+        alternatives.append(rf"^[ \t]*(?:{markers})[^\n]*")
+    elif syntax.spaced:
+        alternatives.append(rf"(?:^|(?<=\s))(?:{markers})[^\n]*")
+    elif markers:
+        alternatives.append(rf"(?:{markers})[^\n]*")
+    return re.compile("|".join(alternatives), re.MULTILINE | re.DOTALL)
+
+
+def _mark_comment(match: re.Match[str]) -> str:
+    """Keep a matched string, replace a matched comment by the mark."""
+    if match.lastgroup:
+        return match.group()
+    return _COMMENT_MARK
+
+
+def _collapse_blank_lines(text: str, language: str) -> str:
+    """Squeeze runs of blank lines in *text* into one blank line."""
+    return _BLANK_RUN.sub("\n\n", text).lstrip("\n")
+
+
+# Built-in content transforms, selected by name via transforms.  Each one
+# takes the text and its highlight language and returns the new text.
+TRANSFORMS: dict[str, Callable[[str, str], str]] = {
+    "strip-comments": _strip_comments,
+    "collapse-blank-lines": _collapse_blank_lines,
+}
+
+
+def _count_lines(fp: Path, *, stop_after: int | None = None) -> int:
+    """Count the lines of *fp*, stopping early past *stop_after* lines."""
+    count = 0
+    last = b"\n"
+    try:
+        with fp.open("rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 16), b""):
+                count += chunk.count(b"\n")
+                last = chunk[-1:]
+                if stop_after is not None and count > stop_after:
+                    return count
+    except OSError:
+        return 0
+    return count + (last != b"\n")
+
+
+def _head_lines(
+    fp: Path,
+    max_file_size: int | None,
+    max_file_lines: int | None,
+) -> int:
+    """Return how many leading lines of *fp* fit within both limits.
+
+    ``0`` means that not even the first line fits *max_file_size* (a
+    minified bundle, say).
+    """
+    lines = max_file_lines
+    if max_file_size is not None:
+        try:
+            with fp.open("rb") as fh:
+                head = fh.read(max_file_size)
+        except OSError:
+            head = b""
+        by_size = head.count(b"\n")
+        if not by_size:
+            return 0
+        lines = by_size if lines is None else min(lines, by_size)
+    return max(1, lines or 1)
+
+
+def _parse_size(value: int | str | None) -> int | None:
+    """Parse a byte size such as ``1048576``, ``"512K"`` or ``"1 MB"``."""
+    if value is None or isinstance(value, int):
+        return value
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)(?:i?B)?\s*", value, re.I)
+    if not match:
+        raise ValueError(f"Invalid size {value!r}; expected e.g. 500K or 2M")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def _format_size(size: int) -> str:
+    """Return *size* in bytes in a human readable form."""
+    if size < 1024:
+        return f"{size} B"
+    scaled = float(size)
+    for unit in ("KB", "MB", "GB"):
+        scaled /= 1024
+        if scaled < 1024 or unit == "GB":
+            break
+    return f"{scaled:.1f} {unit}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of *text* at about four characters each."""
+    return (len(text) + 3) // 4
+
+
+def _count_words(text: str) -> int:
+    """Estimate the token count of *text* at about 0.75 words each."""
+    return (len(text.split()) * 4 + 2) // 3
+
+
+# Built-in token counters, selected by name via token-counter.
+TOKEN_COUNTERS: dict[str, Callable[[str], int]] = {
+    "chars": estimate_tokens,
+    "words": _count_words,
+}
+
+
+def _resolve_token_counter(
+    counter: str | Callable[[str], int] | None,
+) -> tuple[str, Callable[[str], int]]:
+    """Return the cache name and the function of a token counter."""
+    if counter is None:
+        counter = "chars"
+    if callable(counter):
+        return f"{counter.__module__}.{counter.__qualname__}", counter
+    if counter in TOKEN_COUNTERS:
+        return counter, TOKEN_COUNTERS[counter]
+    module_name, sep, attr = counter.partition(":")
+    if not sep:
+        raise ValueError(
+            f"Invalid token-counter {counter!r}; expected one of "
+            f"{tuple(TOKEN_COUNTERS)} or 'module:function'"
+        )
+    try:
+        func = getattr(importlib.import_module(module_name), attr)
+    except (ImportError, AttributeError) as exc:
+        raise ValueError(
+            f"Cannot load token-counter {counter!r}: {exc}"
+        ) from exc
+    return counter, func
+
+
+def _token_estimates(
+    listing: SourceListing,
+    counter: str | Callable[[str], int] | None,
+    cache_dir: Path | str | None,
+) -> dict[Path, int]:
+    """Return the estimated tokens of each file of *listing* but duplicates.
+
+    Estimates of what is included (after range options) are cached per
+    content digest (see :func:`_hash_file`), counter and options, so a
+    touched, copied or moved file is not counted again.
+    """
+    name, count = _resolve_token_counter(counter)
+    sources = {
+        fp: listing.read_path(fp)
+        for fp in listing.files
+        if fp not in listing.duplicates
+    }
+    hashes = _cached_map(
+        "hashes", list(sources.values()), _hash_file, cache_dir, listing.root
+    )
+    cache = _FileCache("tokens", cache_dir)
+    tokens: dict[Path, int] = {}
+    for fp, source in sources.items():
+        options = listing.options(fp)
+        key = f"{source}\0{name}"
+        digest = hashlib.blake2b(
+            "\0".join(
+                [hashes[source], name, json.dumps(options, sort_keys=True)]
+            ).encode(),
+            digest_size=20,
+        ).hexdigest()
+        estimate = cache.get_content(key, digest)
+        if estimate is None:
+            estimate = count(_read_included(source, options, warn=False))
+        cache.set_content(key, digest, estimate)
+        tokens[fp] = estimate
+    cache.prune(listing.root)
+    cache.save()
+    return tokens
+
+
+def _apply_token_budget(
+    listing: SourceListing,
+    *,
+    budget: int,
+    weights: dict[str, float],
+    order: list[str],
+    counter: str | Callable[[str], int] | None,
+    cache_dir: Path | str | None,
+) -> None:
+    """Drop the files of *listing* that do not fit *budget*, in place."""
+    tokens = _token_estimates(listing, counter, cache_dir)
+    pinned = {
+        (listing.root / entry).resolve(): rank
+        for rank, entry in enumerate(order)
+    }
+
+    def priority(item: tuple[int, Path]) -> tuple[int, float, int]:
+        index, fp = item
+        if fp in pinned:
+            return (0, pinned[fp], index)
+        rel = listing.rel(fp)
+        weight = next(
+            (
+                w
+                for pat, w in weights.items()
+                if _is_ignored(rel, fp.name, [pat])
+            ),
+            1.0,
+        )
+        return (1, -weight, index)
+
+    used = 0
+    kept: set[Path] = set()
+    for _, fp in sorted(enumerate(listing.files), key=priority):
+        if fp in tokens and used + tokens[fp] <= budget:
+            kept.add(fp)
+            used += tokens[fp]
+    # A duplicate is a short reference: it stays exactly when its original
+    # does, at no cost.
+    for fp, original in listing.duplicates.items():
+        tokens[fp] = 0
+        if original in kept:
+            kept.add(fp)
+    dropped = [fp for fp in listing.files if fp not in kept]
+    for fp in dropped:
+        if fp in listing.duplicates:
+            ref = listing.rel(listing.duplicates[fp])
+            reason = f"dropped along with identical {ref}"
+        else:
+            reason = (
+                f"dropped, ~{tokens[fp]} tokens do not fit token-budget "
+                f"({budget})"
+            )
+        listing.notes.append((listing.rel(fp), reason))
+    listing.files = [fp for fp in listing.files if fp in kept]
+    listing.duplicates = {
+        fp: original
+        for fp, original in listing.duplicates.items()
+        if fp in kept
+    }
+    if dropped:
+        print(
+            f"Token budget: {used} of {budget} tokens used by "
+            f"{len(kept)} files; dropped {len(dropped)} files.",
+            file=sys.stderr,
+        )
+
+
+# ----------------------------------------------------------------------------
+# Persistent cache
+# ----------------------------------------------------------------------------
+
+
+def _default_cache_dir() -> Path:
+    """Return the directory of the persistent cache."""
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        return Path(override)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "sphinx-source-tree"
+
+
+def _file_signature(fp: Path) -> list[int] | None:
+    """Return ``[size, mtime_ns]`` of *fp*, ``None`` if it is gone."""
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class _FileCache:
+    """Per-file results persisted as JSON between runs.
+
+    Entries are stored under a caller-chosen key together with the
+    size and mtime of the file they were computed from; a lookup only
+    hits while the file is unchanged.  The cache is best effort: an
+    unreadable or unwritable cache file behaves like an empty one.
+    """
+
+    def __init__(self, name: str, cache_dir: Path | str | None = None):
+        base = Path(cache_dir) if cache_dir else _default_cache_dir()
+        self.path = base / f"{name}.json"
+        self._data: dict[str, list[Any]] | None = None
+        self._digests: dict[str, Any] | None = None
+        self._dirty = False
+
+    @property
+    def data(self) -> dict[str, list[Any]]:
+        if self._data is None:
+            try:
+                loaded = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                loaded = None
+            self._data = loaded if isinstance(loaded, dict) else {}
+        return self._data
+
+    def get(self, key: str, fp: Path | None = None) -> Any:
+        """Return the value stored for *key* if *fp* is unchanged.
+
+        Without *fp* the key itself identifies the content (e.g. a
+        hash) and the entry never goes stale.
+        """
+        entry = self.data.get(key)
+        if entry and entry[0] == (_file_signature(fp) if fp else []):
+            return entry[1]
+        return None
+
+    def set(self, key: str, fp: Path | None, value: Any) -> None:
+        """Store *value* for *key*, tied to the current state of *fp*."""
+        signature = _file_signature(fp) if fp else []
+        if signature is not None:
+            self.data[key] = [signature, value]
+            self._dirty = True
+
+    def get_content(self, key: str, digest: str) -> Any:
+        """Return the value computed from content *digest*, if any.
+
+        For caches keyed by file path (see :meth:`set_content`): the
+        entry of *key* is used when its digest matches, else that of any
+        other path with the same content.
+        """
+        entry = self.get(key)
+        if entry and entry[0] == digest:
+            return entry[1]
+        if self._digests is None:
+            self._digests = {
+                value[1][0]: value[1][1]
+                for value in self.data.values()
+                if isinstance(value[1], list) and len(value[1]) == 2
+            }
+        return self._digests.get(digest)
+
+    def set_content(self, key: str, digest: str, value: Any) -> None:
+        """Store *value*, computed from content *digest*, under *key*.
+
+        *key* is the absolute path of the file, optionally followed by a
+        NUL character and a qualifier, so each file has one entry that
+        edits replace (see :meth:`prune`).
+        """
+        if self.get(key) != [digest, value]:
+            self.set(key, None, [digest, value])
+        if self._digests is not None:
+            self._digests[digest] = value
+
+    def prune(self, root: Path) -> None:
+        """Drop the entries of files below *root* that no longer exist."""
+        prefix = f"{root}{os.sep}"
+        gone = [
+            key
+            for key in self.data
+            if key.startswith(prefix)
+            and not os.path.exists(key.partition("\0")[0])
+        ]
+        for key in gone:
+            del self.data[key]
+        self._dirty = self._dirty or bool(gone)
+
+    def save(self) -> None:
+        """Write the cache back if anything changed (never while checking)."""
+        if not self._dirty or _pending_writes is not None:
+            return
+        with contextlib.suppress(OSError):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write(json.dumps(self.data), self.path)
+        self._dirty = False
+
+
+# ----------------------------------------------------------------------------
+# Renderers
+# ----------------------------------------------------------------------------
+
+
+def _render_rst(listing: SourceListing, output: Path) -> str:
+    """Render *listing* as reStructuredText with ``literalinclude``s."""
+    output_dir = output.parent
+    parts: list[str] = [
+        _document_header(listing.title, listing.depth, listing.root),
+        textwrap.indent(listing.tree, "   "),
+        "",
+        *_notes_block(listing, "rst"),
+    ]
+    for fp in listing.files:
+        parts.extend(_file_section(listing, fp, output_dir))
+    return "\n".join(parts)
+
+
+def _notes_block(listing: SourceListing, fmt: str) -> list[str]:
+    """Return the lines of the size-limit note of *listing* in *fmt*.
+
+    Empty when no file was dropped or truncated; otherwise the block
+    ends with a blank line.
+    """
+    if not listing.notes:
+        return []
+    if fmt == "rst":
+        items = [f"   - ``{rel}``: {reason}" for rel, reason in listing.notes]
+        return [".. note::", "", f"   {NOTES_INTRO}", "", *items, ""]
+    if fmt == "myst":
+        items = [f"- `{rel}`: {reason}" for rel, reason in listing.notes]
+        return ["```{note}", NOTES_INTRO, "", *items, "```", ""]
+    if fmt == "markdown":
+        items = [f"> - `{rel}`: {reason}" for rel, reason in listing.notes]
+        return [f"> **Note:** {NOTES_INTRO}", ">", *items, ""]
+    items = [f"  - {rel}: {reason}" for rel, reason in listing.notes]
+    return [f"Note: {NOTES_INTRO}", "", *items, ""]
+
+
+def _render_myst(listing: SourceListing, output: Path) -> str:
+    """Render *listing* as MyST Markdown with ``literalinclude``s."""
+    output_dir = output.parent
+    tree = f"{listing.root.name}/\n{listing.tree}"
+    fence = _fence(tree)
+    parts: list[str] = [
+        f"# {listing.title}",
+        "",
+        (
+            f"Below is the layout of the project (to {listing.depth} "
+            f"levels), followed by\nthe contents of each key file."
+        ),
+        "",
+        f"{fence}{{code-block}} text",
+        ":caption: Project directory layout",
+        "",
+        tree,
+        fence,
+        "",
+        *_notes_block(listing, "myst"),
+    ]
+    for fp in listing.files:
+        rel = listing.rel(fp)
+        original = listing.duplicates.get(fp)
+        if original is not None:
+            parts.extend(
+                [
+                    f"## {rel}",
+                    "",
+                    f"Identical to `{listing.rel(original)}`.",
+                    "",
+                ]
+            )
+            continue
+        include_path = os.path.relpath(listing.source(fp), output_dir).replace(
+            os.sep, "/"
+        )
+        parts.extend([f"## {rel}", ""])
+        sections = listing.sections(fp)
+        for caption, options in sections:
+            if len(sections) > 1:
+                parts.extend([f"### {caption}", ""])
+            parts.append(f"```{{literalinclude}} {include_path}")
+            language = listing.language(fp)
+            if language:
+                parts.append(f":language: {language}")
+            parts.append(f":caption: {caption}")
+            if listing.linenos:
+                parts.append(":linenos:")
+            for opt_key, opt_val in options.items():
+                parts.append(f":{opt_key}: {opt_val}")
+            parts.extend(["```", ""])
+    return "\n".join(parts)
+
+
+def _render_text(listing: SourceListing, output: Path) -> str:
+    """Render *listing* as a plain-text bundle with inlined contents."""
+    return "".join(_iter_bundle(listing, "text"))
+
+
+def _render_markdown(listing: SourceListing, output: Path) -> str:
+    """Render *listing* as a Markdown bundle with inlined contents."""
+    return "".join(_iter_bundle(listing, "markdown"))
+
+
+# A renderer turns a SourceListing into the content of the document written
+# to the given output path (used to compute relative include paths).
+Renderer = Callable[[SourceListing, Path], str]
+
+RENDERERS: dict[str, Renderer] = {
+    "rst": _render_rst,
+    "myst": _render_myst,
+    "text": _render_text,
+    "markdown": _render_markdown,
+}
+
+# Suffix of the file each format is written to when several formats are
+# emitted from one [[files]] entry and no explicit path is configured.
+RENDERER_SUFFIXES: dict[str, str] = {
+    "rst": ".rst",
+    "myst": ".md",
+    "text": ".txt",
+    "markdown": ".md",
+}
+
+
+def register_renderer(name: str, renderer: Renderer, suffix: str) -> None:
+    """Make *renderer* available as output format *name*.
+
+    *renderer* receives the :class:`SourceListing` and the resolved
+    output path and returns the document content; *suffix* is used to
+    derive the output path when several formats are emitted at once.
+    Registering an existing name replaces that renderer.
+    """
+    RENDERERS[name] = renderer
+    RENDERER_SUFFIXES[name] = suffix
+
+
+def generate_shards(
+    project_root: Path | str = ".",
+    output: Path | str = "docs/source_tree.rst",
+    *,
+    shard_by: str = "directory",
+    depth: int = 10,
+    extensions: list[str] | None = None,
+    ignore: list[str] | None = None,
+    whitelist: list[str] | None = None,
+    include_all: bool = True,
+    title: str = "Project source-tree",
+    linenos: bool = False,
+    extra_languages: dict[str, str] | None = None,
+    file_options: dict[str, dict[str, Any]] | None = None,
+    order: list[str] | None = None,
+    max_file_size: int | str | None = None,
+    max_file_lines: int | None = None,
+    oversize: str = "skip",
+    oversize_exempt: list[str] | None = None,
+    token_budget: int | None = None,
+    token_weights: dict[str, float] | None = None,
+    token_counter: str | Callable[[str], int] | None = None,
+    sniff: bool = True,
+    skip_generated: bool = False,
+    generated_exempt: list[str] | None = None,
+    dedupe: bool = False,
+    strict_file_options: bool = False,
+    resolve_lines: bool = False,
+    chunk_lines: int | None = None,
+    chunk_snap: bool = False,
+    python_mode: str = "full",
+    transforms: list[str] | None = None,
+    max_files: int | None = None,
+    max_entries_scanned: int | None = None,
+    time_budget: float | None = None,
+    on_scan_limit: str = "error",
+    cache_dir: Path | str | None = None,
+    scan: ProjectScan | None = None,
+) -> dict[Path, str]:
+    """Build a sharded set of ``.rst`` documents and return them by path.
+
+    Instead of one document holding every ``literalinclude``, *output*
+    becomes an index with the title, the directory tree and a
+    ``toctree``, and the listing is split into shards stored in a
+    directory named after *output* (``docs/source_tree.rst`` →
+    ``docs/source_tree/``).  Sphinx can then read the shards in parallel
+    and only re-read the shard whose inputs changed.
+
+    Parameters
+    ----------
+    shard_by:
+        ``"directory"`` emits one document per directory holding
+        collected files (``docs/source_tree/src/index.rst`` for ``src``,
+        ``docs/source_tree/index.rst`` for the project root);
+        ``"file"`` emits one document per file
+        (``docs/source_tree/src/app.py.rst``).
+
+    All other parameters are the same as for :func:`generate`.  Shards
+    follow the order of their first file in the (ordered) listing.
+    Nothing is written to disk.
+    """
+    listing = collect_listing(
+        project_root,
+        depth=depth,
+        extensions=extensions,
+        ignore=ignore,
+        whitelist=whitelist,
+        include_all=include_all,
+        title=title,
+        linenos=linenos,
+        extra_languages=extra_languages,
+        file_options=file_options,
+        order=order,
+        max_file_size=max_file_size,
+        max_file_lines=max_file_lines,
+        oversize=oversize,
+        oversize_exempt=oversize_exempt,
+        token_budget=token_budget,
+        token_weights=token_weights,
+        token_counter=token_counter,
+        sniff=sniff,
+        skip_generated=skip_generated,
+        generated_exempt=generated_exempt,
+        dedupe=dedupe,
+        strict_file_options=strict_file_options,
+        resolve_lines=resolve_lines,
+        chunk_lines=chunk_lines,
+        chunk_snap=chunk_snap,
+        python_mode=python_mode,
+        transforms=transforms,
+        max_files=max_files,
+        max_entries_scanned=max_entries_scanned,
+        time_budget=time_budget,
+        on_scan_limit=on_scan_limit,
+        cache_dir=cache_dir,
+        scan=scan,
+        exclude=[output, Path(output).with_suffix("")],
+    )
+    return _render_rst_shards(listing, Path(output).resolve(), shard_by)
+
+
+def _render_rst_shards(
+    listing: SourceListing,
+    output: Path,
+    shard_by: str,
+) -> dict[Path, str]:
+    """Render *listing* as an index document plus shards (see above)."""
+    if shard_by not in SHARD_MODES:
+        raise ValueError(
+            f"Invalid shard-by {shard_by!r}; expected one of {SHARD_MODES}"
+        )
+    root = listing.root
+    documents: dict[Path, str] = {}
+    toctree: list[str] = []
+    for shard_path, shard_files in _shard_groups(
+        listing.files, root, output, shard_by
+    ).items():
+        shard_dir = shard_path.parent
+        if shard_by == "file":
+            fp = shard_files[0]
+            rel = listing.rel(fp)
+            parts = [rel, "=" * len(rel), ""]
+            parts.extend(_rst_include(listing, fp, shard_dir))
+        else:
+            rel_dir = shard_files[0].parent.relative_to(root).as_posix()
+            heading = f"{root.name}/" if rel_dir == "." else f"{rel_dir}/"
+            parts = [heading, "=" * len(heading), ""]
+            for fp in shard_files:
+                parts.extend(_file_section(listing, fp, shard_dir))
+        documents[shard_path] = "\n".join(parts)
+        # Only the ".rst" appended to the shard name is dropped.
+        toctree.append(
+            "   " + shard_path.relative_to(output.parent).as_posix()[:-4]
+        )
+
+    index = [
+        _document_header(listing.title, listing.depth, root),
+        textwrap.indent(listing.tree, "   "),
+        "",
+        *_notes_block(listing, "rst"),
+    ]
+    if toctree:
+        index.extend([".. toctree::", "   :maxdepth: 1", "", *toctree, ""])
+    return {output: "\n".join(index), **documents}
+
+
+def generate_bundle(
+    project_root: Path | str = ".",
+    *,
+    fmt: str = "text",
+    output: Path | str | None = None,
+    depth: int = 10,
+    extensions: list[str] | None = None,
+    ignore: list[str] | None = None,
+    whitelist: list[str] | None = None,
+    include_all: bool = True,
+    title: str = "Project source-tree",
+    extra_languages: dict[str, str] | None = None,
+    file_options: dict[str, dict[str, Any]] | None = None,
+    order: list[str] | None = None,
+    max_file_size: int | str | None = None,
+    max_file_lines: int | None = None,
+    oversize: str = "skip",
+    oversize_exempt: list[str] | None = None,
+    token_budget: int | None = None,
+    token_weights: dict[str, float] | None = None,
+    token_counter: str | Callable[[str], int] | None = None,
+    sniff: bool = True,
+    skip_generated: bool = False,
+    generated_exempt: list[str] | None = None,
+    dedupe: bool = False,
+    strict_file_options: bool = False,
+    resolve_lines: bool = False,
+    chunk_lines: int | None = None,
+    chunk_snap: bool = False,
+    python_mode: str = "full",
+    transforms: list[str] | None = None,
+    max_files: int | None = None,
+    max_entries_scanned: int | None = None,
+    time_budget: float | None = None,
+    on_scan_limit: str = "error",
+    cache_dir: Path | str | None = None,
+    scan: ProjectScan | None = None,
+) -> str:
+    """Build a single-file context bundle and return it as a string.
+
+    Unlike :func:`generate`, the contents of every collected file are
+    inlined (honouring the *file_options* ranges exactly like Sphinx's
+    ``literalinclude`` would), so an ``llms-full.txt`` style file can be
+    produced without running Sphinx at all.
+
+    Parameters
+    ----------
+    fmt:
+        ``"text"`` (plain text with ruled file headers) or
+        ``"markdown"`` (headings and fenced code blocks).
+    output:
+        Path the bundle is going to be written to (**not** written by
+        this function); it is left out of the listing.
+
+    All other parameters are the same as for :func:`generate`.
+    """
+    if fmt not in BUNDLE_FORMATS:
+        raise ValueError(
+            f"Invalid bundle format {fmt!r}; expected one of {BUNDLE_FORMATS}"
+        )
+    listing = collect_listing(
+        project_root,
+        depth=depth,
+        extensions=extensions,
+        ignore=ignore,
+        whitelist=whitelist,
+        include_all=include_all,
+        title=title,
+        extra_languages=extra_languages,
+        file_options=file_options,
+        order=order,
+        max_file_size=max_file_size,
+        max_file_lines=max_file_lines,
+        oversize=oversize,
+        oversize_exempt=oversize_exempt,
+        token_budget=token_budget,
+        token_weights=token_weights,
+        token_counter=token_counter,
+        sniff=sniff,
+        skip_generated=skip_generated,
+        generated_exempt=generated_exempt,
+        dedupe=dedupe,
+        strict_file_options=strict_file_options,
+        resolve_lines=resolve_lines,
+        chunk_lines=chunk_lines,
+        chunk_snap=chunk_snap,
+        python_mode=python_mode,
+        transforms=transforms,
+        max_files=max_files,
+        max_entries_scanned=max_entries_scanned,
+        time_budget=time_budget,
+        on_scan_limit=on_scan_limit,
+        cache_dir=cache_dir,
+        scan=scan,
+        exclude=[output] if output is not None else None,
+    )
+    return "".join(_iter_bundle(listing, fmt))
+
+
+def _iter_bundle(listing: SourceListing, fmt: str) -> Iterable[str]:
+    """Yield a bundle piece by piece, one file's contents at a time."""
+    tree = f"{listing.root.name}/\n{listing.tree}"
+    title = listing.title
+    if fmt == "markdown":
+        yield f"# {title}\n\n## Project directory layout\n\n"
+        yield f"```text\n{tree}\n```\n"
+    else:
+        yield f"{title}\n{'=' * len(title)}\n\nProject directory layout\n\n"
+        yield f"{tree}\n"
+    notes = _notes_block(listing, fmt)
+    if notes:
+        yield "\n" + "\n".join(notes)
+
+    for fp in listing.files:
+        original = listing.duplicates.get(fp)
+        if original is not None:
+            rel, ref = listing.rel(fp), listing.rel(original)
+            if fmt == "markdown":
+                yield f"\n## {rel}\n\nIdentical to `{ref}`.\n"
+            else:
+                yield (
+                    f"\n{BUNDLE_RULE}\nFile: {rel}\n{BUNDLE_RULE}\n"
+                    f"(identical to {ref})\n"
+                )
+            continue
+        for label, content in _bundle_sections(listing, fp):
+            if content and not content.endswith("\n"):
+                content += "\n"
+            if fmt == "markdown":
+                fence = _fence(content)
+                lang = listing.language(fp)
+                yield f"\n## {label}\n\n{fence}{lang}\n{content}{fence}\n"
+            else:
+                yield (
+                    f"\n{BUNDLE_RULE}\nFile: {label}\n{BUNDLE_RULE}\n{content}"
+                )
+
+
+def _bundle_sections(
+    listing: SourceListing,
+    fp: Path,
+) -> list[tuple[str, str]]:
+    """Return ``(label, content)`` for each section of *fp* in a bundle.
+
+    A chunked file is read once and sliced per chunk.
+    """
+    options, source = listing.options(fp), listing.read_path(fp)
+    if fp not in listing.chunks:
+        label = listing.rel(fp) + "".join(
+            f" [{key}: {value}]" for key, value in options.items()
+        )
+        # Range problems were already reported by collect_listing().
+        return [(label, _read_included(source, options, warn=False))]
+    text = source.read_text(
+        encoding=options.get("encoding", "utf-8"), errors="replace"
+    )
+    lines = text.splitlines(keepends=True)
+    return [
+        (caption, "".join(lines[first - 1 : last]))
+        for caption, (first, last) in zip(
+            (caption for caption, _ in listing.sections(fp)),
+            listing.chunks[fp],
+        )
+    ]
+
+
+def _fence(content: str) -> str:
+    """Return a backtick fence longer than any backtick run in *content*."""
+    longest = max(map(len, _BACKTICK_RUN.findall(content)), default=0)
+    return "`" * max(3, longest + 1)
+
+
+def _parse_line_spec(spec: str, total: int) -> list[int]:
+    """Parse a ``:lines:`` spec into zero-based line indexes.
+
+    Mirrors Sphinx's ``parse_line_num_spec``: comma-separated numbers and
+    ``a-b`` ranges, where ``-b`` starts at the first line and ``a-`` runs
+    to the last one (*total*).
+    """
+    items: list[int] = []
+    for part in spec.split(","):
+        begend = part.strip().split("-")
+        try:
+            if begend == ["", ""]:
+                raise ValueError
+            if len(begend) == 1:
+                items.append(int(begend[0]) - 1)
+            elif len(begend) == 2:
+                start = int(begend[0] or 1)
+                end = int(begend[1] or max(start, total))
+                if start > end:
+                    raise ValueError
+                items.extend(range(start - 1, end))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"invalid line number spec: {spec!r}") from None
+    return items
+
+
+def _select_lines(lines: list[str], options: dict[str, str]) -> list[str]:
+    """Apply ``literalinclude`` range *options* to *lines*.
+
+    Filters run in Sphinx's order: ``start-at``/``start-after``, then
+    ``end-at``/``end-before``, then ``lines``.  Raises ``ValueError``
+    when a marker is not found or no lines are selected.
+    """
+    return [lines[idx] for idx in _select_indices(lines, options)]
+
+
+def _select_indices(lines: list[str], options: dict[str, str]) -> list[int]:
+    """Return the 0-based indices of the *lines* :func:`_select_lines` keeps."""
+    start, stop = 0, len(lines)
+    if "start-at" in options or "start-after" in options:
+        after = "start-at" not in options
+        marker = options["start-after" if after else "start-at"]
+        for idx, line in enumerate(lines):
+            if marker in line:
+                start = idx + 1 if after else idx
+                break
+        else:
+            name = "start-after" if after else "start-at"
+            raise ValueError(f"{name} pattern not found: {marker}")
+
+    if "end-at" in options or "end-before" in options:
+        at = "end-at" in options
+        marker = options["end-at" if at else "end-before"]
+        for idx in range(start, stop):
+            if marker in lines[idx]:
+                if at:
+                    stop = idx + 1
+                    break
+                if idx > start:  # end-before ignores a match on the first line
+                    stop = idx
+                    break
+        else:
+            name = "end-at" if at else "end-before"
+            raise ValueError(f"{name} pattern not found: {marker}")
+    return _apply_line_spec(list(range(start, stop)), options)
+
+
+def _apply_line_spec(selected: list[int], options: dict[str, str]) -> list[int]:
+    """Narrow *selected* line indices down to the ``lines`` option."""
+    if "lines" not in options:
+        return selected
+    spec = options["lines"]
+    total = len(selected)
+    selected = [selected[n] for n in _parse_line_spec(spec, total) if n < total]
+    if not selected:
+        raise ValueError(f"line spec {spec!r}: no lines pulled")
+    return selected
+
+
+def _resolve_range(fp: Path, options: dict[str, str]) -> list[int]:
+    """Return the 0-based line numbers ``literalinclude`` shows of *fp*.
+
+    Markers are searched directly in a memory map of the file and lines
+    are counted by newlines, so nothing is decoded.  Encodings that are
+    not ASCII compatible (UTF-16/32) fall back to decoding the text.
+    Raises ``ValueError`` like :func:`_select_lines`.
+    """
+    encoding = options.get("encoding", "utf-8")
+    if encoding.lower().replace("_", "-").startswith(("utf-16", "utf-32")):
+        text = fp.read_text(encoding=encoding, errors="replace")
+        return _select_indices(text.splitlines(keepends=True), options)
+    with fp.open("rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return _range_in(b"", options, encoding)
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _range_in(mm, options, encoding)
+
+
+def _range_in(data: Any, options: dict[str, str], encoding: str) -> list[int]:
+    """Byte-level version of :func:`_select_indices` for a buffer."""
+
+    def line_start(pos: int) -> int:
+        return data.rfind(b"\n", 0, pos) + 1
+
+    def next_line(pos: int) -> int:
+        newline = data.find(b"\n", pos)
+        return len(data) if newline < 0 else newline + 1
+
+    begin, end = 0, len(data)
+    if "start-at" in options or "start-after" in options:
+        name = "start-at" if "start-at" in options else "start-after"
+        pos = data.find(options[name].encode(encoding, "replace"))
+        if pos < 0:
+            raise ValueError(f"{name} pattern not found: {options[name]}")
+        begin = line_start(pos) if name == "start-at" else next_line(pos)
+
+    if "end-at" in options or "end-before" in options:
+        name = "end-at" if "end-at" in options else "end-before"
+        # end-before ignores a match on the first selected line
+        search_from = begin if name == "end-at" else next_line(begin)
+        pos = data.find(options[name].encode(encoding, "replace"), search_from)
+        if pos < 0 or (name == "end-before" and begin >= len(data)):
+            raise ValueError(f"{name} pattern not found: {options[name]}")
+        end = next_line(pos) if name == "end-at" else line_start(pos)
+
+    first = data[:begin].count(b"\n")
+    chunk = data[begin:end]
+    total = chunk.count(b"\n") + (not chunk.endswith(b"\n") and bool(chunk))
+    return _apply_line_spec(list(range(first, first + total)), options)
+
+
+def _format_line_spec(indices: list[int]) -> str:
+    """Return a ``lines`` spec (``"3-7,10"``) for 0-based *indices*."""
+    runs: list[list[int]] = []
+    for idx in indices:
+        if runs and idx == runs[-1][1] + 1:
+            runs[-1][1] = idx
+        else:
+            runs.append([idx, idx])
+    return ",".join(
+        f"{lo + 1}" if lo == hi else f"{lo + 1}-{hi + 1}" for lo, hi in runs
+    )
+
+
+def _read_included(
+    fp: Path,
+    options: dict[str, str],
+    *,
+    warn: bool = True,
+) -> str:
+    """Return the part of *fp* a ``literalinclude`` with *options* shows.
+
+    When the options cannot be applied (e.g. a marker no longer exists)
+    a warning is printed (unless *warn* is false) and the whole file is
+    returned.
+    """
+    text = fp.read_text(
+        encoding=options.get("encoding", "utf-8"), errors="replace"
+    )
+    if not options:
+        return text
+    try:
+        return "".join(_select_lines(text.splitlines(keepends=True), options))
+    except ValueError as exc:
+        if warn:
+            print(
+                f"Warning: {exc} in {fp}; including the whole file.",
+                file=sys.stderr,
+            )
+        return text
+
+
+def _shard_groups(
+    files: list[Path],
+    root: Path,
+    output: Path,
+    shard_by: str,
+) -> dict[Path, list[Path]]:
+    """Group *files* by the shard document that lists them.
+
+    Keys are shard paths below the directory named after *output*, in
+    order of first appearance in *files*.  A file shard is named after
+    the file plus ``.rst``; files ending in one of
+    ``SHARD_ESCAPED_SUFFIXES`` (or in ``_``) get a ``_`` in between, so
+    the toctree entry never ends in a source suffix (``x.rst`` →
+    ``x.rst_.rst``, entry ``x.rst_``).
+    """
+    shard_root = output.with_suffix("")
+    groups: dict[Path, list[Path]] = {}
+    for fp in files:
+        rel = fp.relative_to(root)
+        if shard_by == "file":
+            name = rel.as_posix()
+            if name.endswith(("_", *SHARD_ESCAPED_SUFFIXES)):
+                name += "_"
+            shard_path = shard_root / f"{name}.rst"
+        else:
+            shard_path = shard_root / rel.parent / "index.rst"
+        groups.setdefault(shard_path, []).append(fp)
+    return groups
+
+
+def _normalise_file_options(
+    file_options: dict[str, dict[str, Any]] | None,
+    root: Path,
+) -> dict[str, dict[str, str]]:
+    """Return *file_options* keyed by relative-posix path, validated."""
+    normalised: dict[str, dict[str, str]] = {}
+    for key, opts in (file_options or {}).items():
+        key_path = Path(key)
+        if key_path.is_absolute():
+            try:
+                rel_key = key_path.relative_to(root).as_posix()
+            except ValueError:
+                rel_key = key_path.as_posix()
+        else:
+            rel_key = Path(key).as_posix()
+        normalised[rel_key] = _validate_file_options(opts, source=key)
+    return normalised
+
+
+def _document_header(title: str, depth: int, root: Path) -> str:
+    """Return the title and the opening of the directory-layout block."""
+    underline = "=" * len(title)
+    return (
+        f"{title}\n"
+        f"{underline}\n"
+        f"\n"
+        f"Below is the layout of the project (to {depth} levels), "
+        f"followed by\nthe contents of each key file.\n"
+        f"\n"
+        f".. code-block:: text\n"
+        f"   :caption: Project directory layout\n"
+        f"\n"
+        f"   {root.name}/"
+    )
+
+
+def _file_section(
+    listing: SourceListing,
+    fp: Path,
+    output_dir: Path,
+) -> list[str]:
+    """Return a titled section holding the ``literalinclude`` of *fp*."""
+    rel = listing.rel(fp)
+    return [rel, "-" * len(rel), "", *_rst_include(listing, fp, output_dir)]
+
+
+def _rst_include(
+    listing: SourceListing,
+    fp: Path,
+    base_dir: Path,
+    *,
+    headings: bool = True,
+) -> list[str]:
+    """Return the ``literalinclude`` of *fp*, or a note for a duplicate.
+
+    A chunked file yields one include per chunk, each under a ``~``
+    subheading unless *headings* is false.
+    """
+    original = listing.duplicates.get(fp)
+    if original is not None:
+        return [f"Identical to ``{listing.rel(original)}``.", ""]
+    include_path = os.path.relpath(listing.source(fp), base_dir).replace(
+        os.sep, "/"
+    )
+    sections = listing.sections(fp)
+    block: list[str] = []
+    for caption, options in sections:
+        if headings and len(sections) > 1:
+            block.extend([caption, "~" * len(caption), ""])
+        block.extend(
+            _literalinclude_block(
+                include_path,
+                caption=caption,
+                language=listing.language(fp),
+                linenos=listing.linenos,
+                options=options,
+            )
+        )
+    return block
+
+
+def _literalinclude_block(
+    include_path: str,
+    *,
+    caption: str,
+    language: str,
+    linenos: bool,
+    options: dict[str, str],
+) -> list[str]:
+    """Return the lines of one ``literalinclude`` directive.
+
+    Per-file inclusion-range *options* come last, after ``:caption:``
+    and ``:linenos:``.  The block ends with a blank line.
+    """
+    block: list[str] = [f".. literalinclude:: {include_path}"]
+    if language:
+        block.append(f"   :language: {language}")
+    block.append(f"   :caption: {caption}")
+    if linenos:
+        block.append("   :linenos:")
+    for opt_key, opt_val in options.items():
+        block.append(f"   :{opt_key}: {opt_val}")
+    block.append("")
+    return block
+
+
+def _generate_from_cfg(
+    cfg: dict[str, Any],
+    scan: ProjectScan | None = None,
+) -> str:
+    """Call ``generate()`` using a resolved config dict."""
+    return generate(**_generate_kwargs(cfg), scan=scan)
+
+
+def _generate_kwargs(cfg: dict[str, Any]) -> dict[str, Any]:
+    """Return the ``generate()`` keyword arguments for a resolved config."""
+    return {
+        "project_root": cfg["project_root"],
+        "output": cfg.get("output", DEFAULTS["output"]),
+        "depth": cfg.get("depth", DEFAULTS["depth"]),
+        "extensions": cfg.get("extensions"),
+        "ignore": cfg.get("ignore"),
+        "whitelist": cfg.get("whitelist"),
+        "include_all": cfg.get("include_all", DEFAULTS["include_all"]),
+        "title": cfg.get("title", DEFAULTS["title"]),
+        "linenos": cfg.get("linenos", DEFAULTS["linenos"]),
+        "extra_languages": cfg.get("extra_languages"),
+        "file_options": _resolve_file_options_profile(cfg),
+        "order": cfg.get("order"),
+        "max_file_size": _parse_size(cfg.get("max_file_size")),
+        "max_file_lines": cfg.get("max_file_lines"),
+        "oversize": cfg.get("oversize") or DEFAULTS["oversize"],
+        "oversize_exempt": cfg.get("oversize_exempt"),
+        "token_budget": cfg.get("token_budget"),
+        "token_weights": cfg.get("token_weights"),
+        "token_counter": cfg.get("token_counter"),
+        "sniff": cfg.get("sniff", DEFAULTS["sniff"]),
+        "skip_generated": cfg.get("skip_generated", DEFAULTS["skip_generated"]),
+        "generated_exempt": cfg.get("generated_exempt"),
+        "dedupe": cfg.get("dedupe", DEFAULTS["dedupe"]),
+        "strict_file_options": cfg.get(
+            "strict_file_options", DEFAULTS["strict_file_options"]
+        ),
+        "resolve_lines": cfg.get("resolve_lines", DEFAULTS["resolve_lines"]),
+        "chunk_lines": cfg.get("chunk_lines"),
+        "chunk_snap": cfg.get("chunk_snap", DEFAULTS["chunk_snap"]),
+        "python_mode": cfg.get("python_mode") or DEFAULTS["python_mode"],
+        "transforms": cfg.get("transforms"),
+        "max_files": cfg.get("max_files"),
+        "max_entries_scanned": cfg.get("max_entries_scanned"),
+        "time_budget": cfg.get("time_budget"),
+        "on_scan_limit": cfg.get("on_scan_limit") or DEFAULTS["on_scan_limit"],
+        "cache_dir": cfg.get("cache_dir"),
+    }
+
+
+def _formats(cfg: dict[str, Any]) -> list[str]:
+    """Return the output formats of one output config, validated."""
+    fmt = cfg.get("format") or DEFAULTS["format"]
+    formats = [fmt] if isinstance(fmt, str) else list(dict.fromkeys(fmt))
+    for name in formats:
+        if name not in RENDERERS:
+            raise ValueError(
+                f"Invalid format {name!r}; expected one of {tuple(RENDERERS)}"
+            )
+    return formats
+
+
+def _format_outputs(cfg: dict[str, Any]) -> dict[str, Path]:
+    """Map each format of one output config to the path it is written to.
+
+    A single format is written to ``output``.  With several formats each
+    one gets ``output`` with the format's suffix unless ``format_outputs``
+    names an explicit path for it.  Two formats may not share a path.
+    """
+    out_path = Path(cfg.get("output", DEFAULTS["output"])).resolve()
+    formats = _formats(cfg)
+    explicit = cfg.get("format_outputs") or {}
+    paths: dict[str, Path] = {}
+    for fmt in formats:
+        if fmt in explicit:
+            paths[fmt] = Path(explicit[fmt]).resolve()
+        elif len(formats) == 1:
+            paths[fmt] = out_path
+        else:
+            paths[fmt] = out_path.with_suffix(RENDERER_SUFFIXES[fmt])
+    seen: dict[Path, str] = {}
+    for fmt, path in paths.items():
+        if path in seen:
+            raise ValueError(
+                f"Formats {seen[path]!r} and {fmt!r} would both be written "
+                f"to {path}; set format-outputs to tell them apart"
+            )
+        seen[path] = fmt
+    return paths
+
+
+def _listing_from_cfg(
+    cfg: dict[str, Any],
+    scan: ProjectScan | None = None,
+) -> SourceListing:
+    """Call ``collect_listing()`` using a resolved config dict.
+
+    The documents the config produces are left out of the listing.
+    """
+    kwargs = _generate_kwargs(cfg)
+    del kwargs["output"]
+    return collect_listing(**kwargs, scan=scan, exclude=_output_paths(cfg))
+
+
+def _output_paths(cfg: dict[str, Any]) -> list[Path]:
+    """Return the documents of one output config, shard directory included."""
+    paths: list[Path] = list(_format_outputs(cfg).values())
+    if cfg.get("shard_by") and "rst" in _formats(cfg):
+        paths.append(_format_outputs(cfg)["rst"].with_suffix(""))
+    return paths
+
+
+def _render_outputs(
+    cfg: dict[str, Any],
+    scan: ProjectScan | None = None,
+) -> dict[Path, str]:
+    """Render every document of one output config, keyed by path.
+
+    The listing is collected once and handed to the renderer of each
+    configured format (see :func:`_format_outputs` for the paths).  An
+    ``rst`` output is split into shards when ``shard_by`` is set (see
+    :func:`generate_shards`).  Relative paths resolve against the
+    current working directory.
+    """
+    return _render_listing(cfg, _listing_from_cfg(cfg, scan=scan))
+
+
+def _render_listing(
+    cfg: dict[str, Any],
+    listing: SourceListing,
+) -> dict[Path, str]:
+    """Render *listing* in every format of one output config, by path."""
+    paths = _format_outputs(cfg)
+    shard_by = cfg.get("shard_by")
+    if shard_by and "rst" not in paths:
+        print(
+            f"Warning: shard-by is ignored for format "
+            f"{', '.join(repr(fmt) for fmt in paths)}.",
+            file=sys.stderr,
+        )
+    documents: dict[Path, str] = {}
+    with _phase("render"):
+        for fmt, out_path in paths.items():
+            if fmt == "rst" and shard_by:
+                documents.update(
+                    _render_rst_shards(listing, out_path, shard_by)
+                )
+            else:
+                documents[out_path] = RENDERERS[fmt](listing, out_path)
+    return documents
+
+
+def _manifest_entry(
+    cfg: dict[str, Any],
+    listing: SourceListing,
+    scan: ProjectScan | None = None,
+) -> dict[str, Any]:
+    """Describe one output config and its *listing* for a manifest.
+
+    Paths are relative to the project root (outputs outside it stay
+    absolute).  Sizes come from *scan* when given.
+    """
+    root = listing.root
+
+    def rel(path: Path) -> str:
+        try:
+            return path.relative_to(root).as_posix()
+        except ValueError:
+            return str(path)
+
+    files: list[dict[str, Any]] = []
+    for fp in listing.files:
+        path = listing.rel(fp)
+        item: dict[str, Any] = {
+            "path": path,
+            "size": scan.file_size(path) if scan else _file_size(fp),
+            "language": listing.language(fp),
+            "options": listing.options(fp),
+        }
+        if fp in listing.staged:
+            item["source"] = rel(listing.staged[fp])
+        if fp in listing.duplicates:
+            item["duplicate_of"] = listing.rel(listing.duplicates[fp])
+        if fp in listing.chunks:
+            item["chunks"] = [list(chunk) for chunk in listing.chunks[fp]]
+        files.append(item)
+    return {
+        "project_root": str(root),
+        "outputs": {
+            fmt: rel(path) for fmt, path in _format_outputs(cfg).items()
+        },
+        "shard_by": cfg.get("shard_by"),
+        "title": listing.title,
+        "depth": listing.depth,
+        "linenos": listing.linenos,
+        "extra_languages": listing.extra_languages or {},
+        "tree": listing.tree,
+        "files": files,
+        "notes": [
+            {"path": path, "reason": reason} for path, reason in listing.notes
+        ],
+    }
+
+
+def _file_size(fp: Path) -> int | None:
+    """Return the size of *fp* in bytes, ``None`` if it is gone."""
+    try:
+        return os.stat(fp).st_size
+    except OSError:
+        return None
+
+
+def _size_report(
+    cfg: dict[str, Any],
+    listing: SourceListing,
+    scan: ProjectScan | None = None,
+    top: int = 10,
+) -> str:
+    """Return the *top* files and directories by size of *listing*.
+
+    Bytes come from *scan* (or a stat) unless a file is staged or has
+    range options, lines are counted without decoding and tokens are
+    the cached estimates of the configured token counter.  Shares are
+    of the estimated tokens of the whole output; duplicates, included
+    by reference, are left out.
+    """
+    tokens = _token_estimates(
+        listing, cfg.get("token_counter"), cfg.get("cache_dir")
+    )
+    sizes: dict[str, tuple[int, int, int]] = {}
+    for fp, estimate in tokens.items():
+        rel, options, source = (
+            listing.rel(fp),
+            listing.options(fp),
+            listing.read_path(fp),
+        )
+        if options:
+            text = _read_included(source, options, warn=False)
+            size, lines = len(text.encode("utf-8")), len(text.splitlines())
+        else:
+            size = (
+                scan.file_size(rel)
+                if scan is not None and source == fp
+                else _file_size(source)
+            ) or 0
+            lines = _count_lines(source)
+        sizes[rel] = (size, lines, estimate)
+
+    dirs: dict[str, list[int]] = {}
+    for rel, row in sizes.items():
+        parts = rel.split("/")[:-1]
+        for end in range(1, len(parts) + 1):
+            totals = dirs.setdefault("/".join(parts[:end]) + "/", [0, 0, 0])
+            for index, value in enumerate(row):
+                totals[index] += value
+    total = [sum(row[index] for row in sizes.values()) for index in range(3)]
+
+    def table(heading: str, rows: dict[str, Any]) -> list[str]:
+        ranked = sorted(rows.items(), key=lambda item: -item[1][2])[:top]
+        lines = [
+            heading,
+            f"{'bytes':>12} {'lines':>9} {'tokens':>10} {'share':>6}  path",
+        ]
+        for path, (size, count, estimate) in ranked:
+            share = estimate / total[2] * 100 if total[2] else 0.0
+            lines.append(
+                f"{size:>12,} {count:>9,} {estimate:>10,} {share:>5.1f}%  "
+                f"{path}"
+            )
+        return lines
+
+    outputs = ", ".join(str(path) for path in _format_outputs(cfg).values())
+    summary = (
+        f"Size report for {outputs}:\n  {len(sizes)} files, "
+        f"{total[0]:,} bytes, {total[1]:,} lines, ~{total[2]:,} tokens"
+    )
+    return "\n".join(
+        [
+            summary,
+            *table("Largest files:", sizes),
+            *table("Largest directories:", dirs),
+        ]
+    )
+
+
+def _write_manifests(manifests: dict[Path, list[dict[str, Any]]]) -> None:
+    """Write each manifest file with the entries of its outputs."""
+    for path, entries in manifests.items():
+        manifest = {"version": MANIFEST_VERSION, "outputs": entries}
+        _write_output(
+            json.dumps(manifest, indent=2, ensure_ascii=False) + "\n", path
+        )
+
+
+def _load_manifest(
+    path: Path,
+    project_root: Path | str | None = None,
+) -> list[tuple[dict[str, Any], SourceListing]]:
+    """Return ``(cfg, listing)`` for every output recorded in *path*.
+
+    The listings are rebuilt from the manifest alone; nothing is walked.
+    *project_root* replaces the recorded root, e.g. when the manifest
+    was written on another machine.
+    """
+    try:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as exc:
+        raise ValueError(f"Cannot read manifest {path}: {exc}") from exc
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(
+            f"Unsupported manifest version {manifest.get('version')!r} "
+            f"in {path}; expected {MANIFEST_VERSION}"
+        )
+    try:
+        return [
+            _manifest_listing(entry, project_root)
+            for entry in manifest["outputs"]
+        ]
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"Malformed manifest {path}: {exc!r}") from exc
+
+
+def _manifest_listing(
+    entry: dict[str, Any],
+    project_root: Path | str | None,
+) -> tuple[dict[str, Any], SourceListing]:
+    """Rebuild the output config and listing of one manifest entry."""
+    root = Path(project_root or entry["project_root"]).resolve()
+    outputs = {fmt: root / out for fmt, out in entry["outputs"].items()}
+    cfg = {
+        "project_root": str(root),
+        "output": str(next(iter(outputs.values()))),
+        "format": list(outputs),
+        "format_outputs": {fmt: str(out) for fmt, out in outputs.items()},
+        "shard_by": entry.get("shard_by"),
+    }
+    listing = SourceListing(
+        root=root,
+        title=entry["title"],
+        depth=entry["depth"],
+        tree=entry["tree"],
+        files=[root / item["path"] for item in entry["files"]],
+        file_options={
+            item["path"]: item["options"]
+            for item in entry["files"]
+            if item["options"]
+        },
+        extra_languages=entry.get("extra_languages") or None,
+        linenos=entry.get("linenos", False),
+        notes=[(note["path"], note["reason"]) for note in entry["notes"]],
+    )
+    for item in entry["files"]:
+        fp = root / item["path"]
+        if "source" in item:
+            listing.staged[fp] = root / item["source"]
+        if "duplicate_of" in item:
+            listing.duplicates[fp] = root / item["duplicate_of"]
+        if "chunks" in item:
+            listing.chunks[fp] = [
+                (first, last) for first, last in item["chunks"]
+            ]
+    return cfg, listing
+
+
+def _output_includes(
+    cfg: dict[str, Any],
+    scan: ProjectScan | None = None,
+) -> dict[Path, list[Path]]:
+    """Map each document of one output config to the files it includes."""
+    files = _collect_from_cfg(cfg, scan=scan)
+    root = Path(cfg["project_root"]).resolve()
+    includes: dict[Path, list[Path]] = {}
+    for fmt, out_path in _format_outputs(cfg).items():
+        shard_by = cfg.get("shard_by")
+        if fmt == "rst" and shard_by:
+            ordered = _apply_order(files, cfg.get("order") or [], root)
+            includes.update(_shard_groups(ordered, root, out_path, shard_by))
+        else:
+            includes[out_path] = files
+    return includes
+
+
+def _stale_shards(
+    cfg: dict[str, Any],
+    documents: dict[Path, str],
+) -> list[Path]:
+    """Return shard files left over from a previous run of *cfg*.
+
+    Only ``.rst`` files below the shard directory of a sharded output
+    are considered; that directory is owned by the generator.
+    """
+    if not cfg.get("shard_by"):
+        return []
+    out_path = _format_outputs(cfg).get("rst")
+    if out_path is None:
+        return []
+    shard_root = out_path.with_suffix("")
+    if not shard_root.is_dir():
+        return []
+    return sorted(
+        path for path in shard_root.rglob("*.rst") if path not in documents
+    )
+
+
+def _write_outputs(
+    cfg: dict[str, Any],
+    documents: dict[Path, str],
+) -> None:
+    """Write the *documents* of one output config and drop stale shards."""
+    with _phase("write"):
+        for out_path, content in documents.items():
+            _write_output(content, out_path)
+        for path in _stale_shards(cfg, documents):
+            if _pending_writes is not None:
+                _pending_writes.append(path)
+                continue
+            path.unlink()
+            print(f"Removed {path}")
+
+
+def _collect_from_cfg(
+    cfg: dict[str, Any],
+    scan: ProjectScan | None = None,
+) -> list[Path]:
+    """Call ``collect_files()`` using a resolved config dict."""
+    ignore = cfg.get("ignore")
+    if ignore is None:
+        ignore = DEFAULTS["ignore"]
+    extensions = cfg.get("extensions")
+    return collect_files(
+        Path(cfg["project_root"]).resolve(),
+        extensions=(
+            DEFAULTS["extensions"] if extensions is None else extensions
+        ),
+        ignore=ignore,
+        whitelist=cfg.get("whitelist") or [],
+        include_all=cfg.get("include_all", DEFAULTS["include_all"]),
+        scan=scan,
+    )
+
+
+def _output_cfgs(cfg: dict[str, Any]) -> list[dict[str, Any]]:
+    """Return the per-output configs: the ``[[files]]`` entries or *cfg*."""
+    return cfg.get("files") or [cfg]
+
+
+def _scan_key(cfg: dict[str, Any]) -> tuple[str, tuple[str, ...]]:
+    """Return the key under which outputs of *cfg* can share one scan."""
+    ignore = cfg.get("ignore")
+    if ignore is None:
+        ignore = DEFAULTS["ignore"]
+    return str(Path(cfg["project_root"]).resolve()), tuple(ignore)
+
+
+def _scan_for(
+    cfg: dict[str, Any],
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan],
+    previous: dict[tuple[str, tuple[str, ...]], ProjectScan] | None = None,
+) -> ProjectScan:
+    """Return the scan for *cfg* from *scans*, walking on first use.
+
+    The walk only lists the directories that changed since the matching
+    scan in *previous*, if there is one.
+    """
+    key = _scan_key(cfg)
+    if key not in scans:
+        scans[key] = scan_project(
+            Path(key[0]),
+            list(key[1]),
+            max_files=cfg.get("max_files"),
+            max_entries_scanned=cfg.get("max_entries_scanned"),
+            time_budget=cfg.get("time_budget"),
+            previous=(previous or {}).get(key),
+        )
+    return scans[key]
+
+
+# Paths that would be written, recorded instead of writing while a
+# check runs (see _checking), and where staged content goes meanwhile.
+_pending_writes: list[Path] | None = None
+_scratch_dir: Path | None = None
+
+
+@contextlib.contextmanager
+def _checking() -> Iterator[list[Path]]:
+    """Compare instead of writing for the duration of the block.
+
+    Inside the block :func:`_atomic_write` (and everything built on it)
+    writes nothing; the paths whose content would change, and stale
+    shards that would be removed, are collected in the yielded list.
+    Persistent caches are not saved either.  Staged copies that would
+    change are kept in a temporary directory for the renderers to read.
+    """
+    global _pending_writes, _scratch_dir
+    previous = _pending_writes, _scratch_dir
+    with tempfile.TemporaryDirectory(prefix="sphinx-source-tree-") as tmp:
+        _pending_writes, _scratch_dir = [], Path(tmp)
+        pending = _pending_writes
+        try:
+            yield pending
+        finally:
+            _pending_writes, _scratch_dir = previous
+
+
+def _umask() -> int:
+    """Return the current process umask."""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _atomic_write(content: str, out_path: Path) -> bool:
+    """Write *content* to *out_path* atomically, unless already up to date.
+
+    The file is written to a temporary sibling and renamed into place, so
+    readers never observe a partial file.  When *out_path* already holds
+    *content* it is left untouched (its mtime does not move).  Returns
+    ``True`` when the file was written.
+
+    While checking (see :func:`_checking`) nothing is written; a path
+    whose content differs is recorded and ``True`` returned.
+    """
+    if _pending_writes is not None:
+        try:
+            current: str | None = out_path.read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError):
+            current = None
+        if current == content:
+            return False
+        _pending_writes.append(out_path)
+        return True
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if out_path.read_text(encoding="utf-8") == content:
+            return False
+        mode = out_path.stat().st_mode & 0o777
+    except (OSError, UnicodeDecodeError):
+        mode = 0o666 & ~_umask()
+
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{out_path.name}.", suffix=".tmp", dir=out_path.parent
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(content)
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, out_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_name)
+        raise
+    return True
+
+
+def _write_output(content: str, out_path: Path) -> bool:
+    """Write *content* to *out_path*, creating parent directories as needed.
+
+    See :func:`_atomic_write`.  Returns ``True`` when the file was written.
+    """
+    if not out_path.is_absolute():
+        out_path = Path.cwd() / out_path
+    out_path = out_path.resolve()
+    if _pending_writes is not None:
+        return _atomic_write(content, out_path)
+    if not _atomic_write(content, out_path):
+        print(f"Unchanged {out_path}")
+        return False
+    print(f"Wrote {out_path}")
+    _count("files_written")
+    _count("bytes_written", len(content.encode("utf-8")))
+    return True
+
+
+def _fingerprint_key(cfg: dict[str, Any]) -> str:
+    """Return the key of the fingerprint of one output config.
+
+    Any change to the config, the output paths or the version of the
+    generator yields a new key.
+    """
+    data = json.dumps(
+        [
+            __version__,
+            cfg,
+            str(Path(cfg["project_root"]).resolve()),
+            _format_outputs(cfg),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def _fingerprint(
+    cfg: dict[str, Any],
+    scan: ProjectScan,
+    listing: SourceListing,
+    documents: dict[Path, str],
+) -> dict[str, dict[str, Any]]:
+    """Record what the outputs of one config were generated from.
+
+    That is the mtime of every walked directory (adds, removes and
+    renames), the signature of every candidate file before filtering
+    (content edits) and the signatures of the written documents, staged
+    copies and manifest (edits to the outputs themselves).
+
+    Directory mtimes are those seen by *scan*, except where writing an
+    output that already existed bumped them without changing the tree.
+    A newly created output does change the tree (it may be listed), so
+    the fingerprint only holds from the next run on.
+    """
+    written = list(documents)
+    if cfg.get("manifest"):
+        written.append(Path(cfg["manifest"]).resolve())
+    dirs: dict[str, int | None] = {
+        str(scan.dir_path(rel)): mtime for rel, mtime in scan.dir_mtimes.items()
+    }
+    for path in written:
+        try:
+            rel_dir = path.parent.relative_to(scan.root).as_posix()
+        except ValueError:
+            rel_dir = None
+        if rel_dir == ".":
+            rel_dir = ""
+        if rel_dir not in scan.entries or any(
+            entry.name == path.name for entry in scan.entries[rel_dir]
+        ):
+            dirs[str(path.parent)] = _mtime_ns(path.parent)
+    outputs = [*written, *listing.staged.values()]
+    files = {
+        str(fp): _file_signature(fp)
+        for fp in [*_collect_from_cfg(cfg, scan=scan), *outputs]
+    }
+    return {"dirs": dirs, "files": files}
+
+
+def _fingerprint_matches(fingerprint: dict[str, dict[str, Any]]) -> bool:
+    """True when nothing recorded in *fingerprint* has changed since."""
+    return all(
+        _mtime_ns(path) == mtime for path, mtime in fingerprint["dirs"].items()
+    ) and all(
+        _file_signature(Path(path)) == signature
+        for path, signature in fingerprint["files"].items()
+    )
+
+
+def _is_up_to_date(cfg: dict[str, Any]) -> bool:
+    """True when the stored fingerprint says *cfg*'s outputs are current."""
+    fingerprint = _FileCache("fingerprints", cfg.get("cache_dir")).get(
+        _fingerprint_key(cfg)
+    )
+    try:
+        return bool(fingerprint) and _fingerprint_matches(fingerprint)
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+def _save_fingerprints(
+    generated: list[
+        tuple[dict[str, Any], ProjectScan, SourceListing, dict[Path, str]]
+    ],
+) -> None:
+    """Store the fingerprint of every freshly generated output config."""
+    caches: dict[Any, _FileCache] = {}
+    for cfg, scan, listing, documents in generated:
+        cache_dir = cfg.get("cache_dir")
+        if cache_dir not in caches:
+            caches[cache_dir] = _FileCache("fingerprints", cache_dir)
+        caches[cache_dir].set(
+            _fingerprint_key(cfg),
+            None,
+            _fingerprint(cfg, scan, listing, documents),
+        )
+    for cache in caches.values():
+        cache.save()
+
+
+# ----------------------------------------------------------------------------
+# pre-commit hook
+# ----------------------------------------------------------------------------
+
+
+class _PathRules(NamedTuple):
+    """Where one path would show up in an output (see :func:`_path_rules`)."""
+
+    in_tree: bool
+    listed: bool
+    reasons: tuple[str, ...]
+
+
+def _path_rules(
+    cfg: dict[str, Any],
+    rel: str,
+    *,
+    is_dir: bool = False,
+) -> _PathRules:
+    """Apply the ignore, whitelist, depth and extension rules of *cfg*.
+
+    *rel* is a path relative to the project root; the filesystem is not
+    consulted.  ``in_tree`` tells whether the path appears in the tree
+    and ``listed`` whether it is a candidate for inclusion (before the
+    content-based filters).  ``reasons`` says which rule decided what,
+    in the order they apply.
+    """
+    ignore = cfg.get("ignore")
+    if ignore is None:
+        ignore = DEFAULTS["ignore"]
+    parts = rel.split("/")
+    # The walk tests every ancestor before descending into it.
+    for end in range(1, len(parts) + 1):
+        prefix = "/".join(parts[:end])
+        what = prefix if end == len(parts) else f"parent directory {prefix}/"
+        if prefix == STAGING_DIR:
+            return _PathRules(False, False, (f"{what} holds staged copies",))
+        index = _first_ignore_match(prefix, ignore)
+        if index is not None:
+            return _PathRules(
+                False,
+                False,
+                (f"ignored: {what} matches ignore pattern {ignore[index]!r}",),
+            )
+    reasons = [f"not matched by any of the {len(ignore)} ignore patterns"]
+
+    whitelist = cfg.get("whitelist") or []
+    if cfg.get("include_all", DEFAULTS["include_all"]) or not whitelist:
+        visible = True
+        reasons.append(
+            "whitelist not applied (include-all)"
+            if whitelist
+            else "no whitelist"
+        )
+    else:
+        entry = next(
+            (w for w in whitelist if _matches_whitelist(rel, [w])), None
+        )
+        if entry is not None:
+            visible = True
+            reasons.append(f"under whitelist entry {entry!r}")
+        elif is_dir and _should_show_dir(rel, whitelist):
+            visible = True
+            reasons.append("parent of a whitelist entry")
+        else:
+            visible = False
+            reasons.append(
+                f"not under any whitelist entry ({', '.join(whitelist)})"
+            )
+    if not visible:
+        return _PathRules(False, False, tuple(reasons))
+
+    depth = cfg.get("depth")
+    if depth is None:
+        depth = DEFAULTS["depth"]
+    in_tree = len(parts) <= depth + 1
+    reasons.append(
+        f"level {len(parts) - 1} "
+        f"{'is within' if in_tree else 'is beyond'} depth = {depth}"
+    )
+    if is_dir:
+        return _PathRules(in_tree, False, tuple(reasons))
+    extensions = cfg.get("extensions")
+    if extensions is None:
+        extensions = DEFAULTS["extensions"]
+    suffix = Path(rel).suffix
+    listed = suffix in extensions
+    reasons.append(
+        f"extension {suffix!r} {'is' if listed else 'is not'} in extensions"
+        if suffix
+        else "no extension"
+    )
+    return _PathRules(in_tree, listed, tuple(reasons))
+
+
+def _explain(cfg: dict[str, Any], paths: list[Path]) -> str:
+    """Explain how the rules of one output config treat each of *paths*."""
+    root = Path(cfg["project_root"]).resolve()
+    lines = [", ".join(str(path) for path in _format_outputs(cfg).values())]
+    for path in paths:
+        try:
+            rel = path.relative_to(root).as_posix()
+        except ValueError:
+            lines.append(f"  {path}: left out, outside {root}")
+            continue
+        rules = _path_rules(cfg, rel, is_dir=path.is_dir())
+        places = [
+            place
+            for place, shown in (
+                ("in the tree", rules.in_tree),
+                ("listed", rules.listed),
+            )
+            if shown
+        ]
+        lines.append(
+            f"  {rel}: {' and '.join(places) or 'left out'}"
+            f"{'' if path.exists() else ' (does not exist)'}"
+        )
+        lines.extend(f"    - {reason}" for reason in rules.reasons)
+    return "\n".join(lines)
+
+
+def _reads_contents(cfg: dict[str, Any]) -> bool:
+    """True when an output of *cfg* changes with the contents of files.
+
+    Bundles inline the files, and several listing steps look at their
+    contents; a plain ``literalinclude`` listing only names them.
+    Sniffing is not counted: like watch mode, the hook assumes a text
+    file stays text.
+    """
+    return bool(
+        set(_formats(cfg)) - {"rst", "myst"}
+        or cfg.get("python_mode", "full") != "full"
+        or cfg.get("transforms")
+        or cfg.get("dedupe")
+        or cfg.get("chunk_lines")
+        or cfg.get("token_budget")
+        or cfg.get("max_file_size")
+        or cfg.get("max_file_lines")
+        or cfg.get("skip_generated")
+        or cfg.get("resolve_lines")
+        or cfg.get("manifest")
+    )
+
+
+def _affected_by(cfg: dict[str, Any], paths: list[Path]) -> bool:
+    """True when any of *paths* may change an output of *cfg*.
+
+    Paths outside the project root or hidden by the rules of *cfg* never
+    do.  Of the others, an edit to a file the outputs already show only
+    matters when they depend on contents (see :func:`_reads_contents`).
+    Whether a path was there before is told by the fingerprint of the
+    last run (see :func:`_fingerprint`): an add, remove or rename bumps
+    the mtime of the parent directory.  Every directory the fingerprint
+    recorded below the root (and not hidden by the whitelist) is checked
+    as well, since deleted files are not among *paths* (pre-commit never
+    passes them).  Without a fingerprint every
+    path the rules let through counts.
+    """
+    root = Path(cfg["project_root"]).resolve()
+    fingerprint = _FileCache("fingerprints", cfg.get("cache_dir")).get(
+        _fingerprint_key(cfg)
+    )
+    dirs = fingerprint.get("dirs", {}) if isinstance(fingerprint, dict) else {}
+    whitelist = (
+        []
+        if cfg.get("include_all", DEFAULTS["include_all"])
+        else cfg.get("whitelist") or []
+    )
+    for dir_path, mtime in dirs.items():
+        try:
+            rel_dir = Path(dir_path).relative_to(root).as_posix()
+        except ValueError:
+            continue
+        if (
+            rel_dir == "."
+            or not whitelist
+            or _should_show_dir(rel_dir, whitelist)
+        ) and _mtime_ns(dir_path) != mtime:
+            return True
+    reads_contents = _reads_contents(cfg)
+    for path in paths:
+        try:
+            rel = path.relative_to(root).as_posix()
+        except ValueError:
+            continue
+        if rel == "pyproject.toml":
+            return True
+        rules = _path_rules(cfg, rel)
+        if not (rules.in_tree or rules.listed):
+            continue
+        if fingerprint is None:
+            return True
+        if str(path.parent) not in dirs:
+            return True
+        if rules.listed and reads_contents:
+            return True
+    return False
+
+
+# ----------------------------------------------------------------------------
+# --changed-since
+# ----------------------------------------------------------------------------
+
+
+def _git_changed_files(root: Path, ref: str) -> list[str]:
+    """Return the files changed since git *ref*, relative to *root*.
+
+    Uncommitted changes count; deleted files are left out.  Raises
+    ``ValueError`` when git fails (no repository, unknown ref, no git).
+    """
+    cmd = [
+        "git",
+        "-C",
+        str(root),
+        "diff",
+        "--name-only",
+        "--relative",
+        "--diff-filter=d",
+        "-z",
+        ref,
+        "--",
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=True)
+    except FileNotFoundError as exc:
+        raise ValueError(f"Cannot run git: {exc}") from exc
+    except subprocess.CalledProcessError as exc:
+        raise ValueError(
+            f"git diff against {ref!r} failed: "
+            f"{exc.stderr.decode(errors='replace').strip()}"
+        ) from exc
+    paths = proc.stdout.decode("utf-8", errors="surrogateescape").split("\0")
+    return sorted(path for path in paths if path)
+
+
+def _changed_scan(
+    root: Path, ignore: list[str], rels: list[str]
+) -> ProjectScan:
+    """Return a snapshot of only *rels* and their ancestor directories."""
+    children: dict[str, dict[str, _Entry]] = {"": {}}
+    for rel in rels:
+        parts = rel.split("/")
+        for end in range(1, len(parts)):
+            parent = "/".join(parts[: end - 1])
+            children[parent][parts[end - 1]] = _Entry(
+                parts[end - 1], True, False
+            )
+            children.setdefault("/".join(parts[:end]), {})
+        parent = "/".join(parts[:-1])
+        children[parent][parts[-1]] = _Entry(parts[-1], False, True)
+    return ProjectScan(
+        root=root,
+        ignore=tuple(ignore),
+        entries={
+            rel_dir: sorted(
+                entries.values(), key=lambda e: (e.is_file, e.name.lower())
+            )
+            for rel_dir, entries in children.items()
+        },
+    )
+
+
+def _iter_changed_listings(
+    cfgs: list[dict[str, Any]],
+    ref: str,
+) -> Iterable[tuple[dict[str, Any], SourceListing]]:
+    """Yield ``(output config, listing)`` of the files changed since *ref*.
+
+    The changed files are taken from git and kept when the collect rules
+    of the output list them (see :func:`_path_rules`); the tree only
+    holds them and their ancestor directories.  Nothing is walked.
+    """
+    changed: dict[Path, list[str]] = {}
+    for file_cfg in cfgs:
+        root = Path(file_cfg["project_root"]).resolve()
+        if root not in changed:
+            changed[root] = _git_changed_files(root, ref)
+        rels = [
+            rel
+            for rel in changed[root]
+            if _path_rules(file_cfg, rel).listed and (root / rel).is_file()
+        ]
+        scan = _changed_scan(root, list(_scan_key(file_cfg)[1]), rels)
+        yield file_cfg, _listing_from_cfg(file_cfg, scan=scan)
+
+
+# ----------------------------------------------------------------------------
+# Watch mode
+# ----------------------------------------------------------------------------
+
+# inotify(7) constants.  Structural events are always watched; writes
+# only matter to outputs that read file contents (see _reads_contents).
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_MASK = (
+    _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+)
+_INOTIFY_CONTENT_MASK = _INOTIFY_MASK | _IN_MODIFY | _IN_CLOSE_WRITE
+
+WATCH_DEBOUNCE: float = 0.2
+WATCH_POLL_INTERVAL: float = 0.5
+
+
+class _PollingWatcher:
+    """Detect adds, removes and renames by polling directory mtimes.
+
+    Files passed to :meth:`arm` are polled too, so their edits are seen.
+    """
+
+    def __init__(self, interval: float = WATCH_POLL_INTERVAL) -> None:
+        self.interval = interval
+        self._mtimes: dict[str, int | None] = {}
+
+    def arm(
+        self,
+        scans: Iterable[ProjectScan],
+        files: Iterable[Path] = (),
+    ) -> None:
+        """Start watching every directory walked by *scans* and *files*."""
+        self._mtimes = {
+            str(scan.dir_path(rel_dir)): mtime
+            for scan in scans
+            for rel_dir, mtime in scan.dir_mtimes.items()
+        }
+        self._mtimes.update((str(fp), _mtime_ns(fp)) for fp in files)
+
+    def _poll(self) -> bool:
+        changed = False
+        for path, mtime in self._mtimes.items():
+            current = _mtime_ns(path)
+            if current != mtime:
+                self._mtimes[path] = current
+                changed = True
+        return changed
+
+    def wait(self, timeout: float | None) -> bool:
+        """Block until a change is seen (``True``) or *timeout* expires."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._poll():
+                return True
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+    def close(self) -> None:
+        """Release resources (nothing to do for polling)."""
+
+
+class _InotifyWatcher:
+    """Detect adds, removes and renames with Linux inotify (via ctypes)."""
+
+    def __init__(self, libc: Any) -> None:
+        self._libc = libc
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(_ctypes_errno(), "inotify_init1 failed")
+
+    def arm(
+        self,
+        scans: Iterable[ProjectScan],
+        files: Collection[Path] = (),
+    ) -> None:
+        """Add a watch for every directory walked by *scans*.
+
+        When *files* are given, writes to files are reported as well
+        (per directory; :func:`_regenerate` tells which ones matter).
+        Adding a watch for an already-watched directory only updates its
+        mask, so this is safe to call again after every re-scan.
+        """
+        mask = _INOTIFY_CONTENT_MASK if files else _INOTIFY_MASK
+        for scan in scans:
+            for rel_dir in scan.dir_mtimes:
+                path = os.fsencode(scan.dir_path(rel_dir))
+                if self._libc.inotify_add_watch(self._fd, path, mask) < 0:
+                    err = _ctypes_errno()
+                    # The directory may have vanished since the scan; any
+                    # other failure (e.g. ENOSPC, watch limit reached) means
+                    # inotify cannot cover the project.
+                    if err != errno.ENOENT:
+                        raise OSError(err, "inotify_add_watch failed")
+
+    def wait(self, timeout: float | None) -> bool:
+        """Block until a change is seen (``True``) or *timeout* expires."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        # Drain everything queued; the events themselves are not needed.
+        with contextlib.suppress(BlockingIOError):
+            while os.read(self._fd, 65536):
+                pass
+        return True
+
+    def close(self) -> None:
+        """Close the inotify file descriptor."""
+        with contextlib.suppress(OSError):
+            os.close(self._fd)
+
+
+def _ctypes_errno() -> int:
+    """Return ``errno`` as set by the last ctypes call."""
+    import ctypes
+
+    return ctypes.get_errno()
+
+
+def _load_libc_inotify() -> Any:
+    """Return libc when it provides inotify, ``None`` otherwise."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        libc.inotify_init1  # noqa: B018
+        libc.inotify_add_watch  # noqa: B018
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _make_watcher(poll_interval: float = WATCH_POLL_INTERVAL) -> Any:
+    """Return an inotify watcher where available, a polling one otherwise."""
+    libc = _load_libc_inotify()
+    if libc is not None:
+        try:
+            return _InotifyWatcher(libc)
+        except OSError:
+            pass
+    return _PollingWatcher(poll_interval)
+
+
+def _content_signatures(
+    cfgs: list[dict[str, Any]],
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan],
+) -> dict[Path, list[int] | None]:
+    """Return the signatures of the files whose contents *cfgs* read.
+
+    Only outputs for which :func:`_reads_contents` holds count; their
+    candidate files (before any content-based filter) are covered.
+    """
+    signatures: dict[Path, list[int] | None] = {}
+    for file_cfg in cfgs:
+        if not _reads_contents(file_cfg):
+            continue
+        scan = _scan_for(file_cfg, scans)
+        outputs = _output_paths(file_cfg)
+        for rel in scan.iter_files():
+            fp = scan.root / rel
+            if (
+                fp not in signatures
+                and _path_rules(file_cfg, rel).listed
+                and not any(fp.is_relative_to(out) for out in outputs)
+            ):
+                signatures[fp] = _file_signature(fp)
+    return signatures
+
+
+def _regenerate(
+    cfgs: list[dict[str, Any]],
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan],
+    signatures: dict[Path, list[int] | None],
+) -> tuple[
+    dict[tuple[str, tuple[str, ...]], ProjectScan],
+    dict[Path, list[int] | None],
+]:
+    """Re-scan and rewrite the outputs whose inputs changed.
+
+    The inputs are the tree and file set, plus the *signatures* of the
+    files whose contents are read (see :func:`_content_signatures`); only
+    the directories modified since *scans* are listed again.  Returns the
+    fresh scans and signatures.  Nothing is rendered when
+    they match the old ones (e.g. an editor saved through a temporary
+    file that is gone again by the time the burst settled).  An output
+    that cannot be rendered (e.g. a scan limit was hit) is reported on
+    stderr and left as it is, so the watch goes on.
+    """
+    fresh: dict[tuple[str, tuple[str, ...]], ProjectScan] = {}
+    for file_cfg in cfgs:
+        _scan_for(file_cfg, fresh, scans)
+    fresh_signatures = _content_signatures(cfgs, fresh)
+    if fresh_signatures == signatures and all(
+        key in scans and scans[key].entries == scan.entries
+        for key, scan in fresh.items()
+    ):
+        return fresh, fresh_signatures
+    for file_cfg in cfgs:
+        try:
+            documents = _render_outputs(
+                file_cfg, scan=_scan_for(file_cfg, fresh)
+            )
+        except ValueError as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            continue
+        _write_outputs(file_cfg, documents)
+    return fresh, fresh_signatures
+
+
+def _watch(
+    cfg: dict[str, Any],
+    *,
+    debounce: float = WATCH_DEBOUNCE,
+    watcher: Any = None,
+) -> None:
+    """Generate all outputs, then keep them up to date until interrupted.
+
+    The scan snapshot is kept in memory and structural changes (adds,
+    removes, renames) wake the loop; so do edits of the files whose
+    contents an output reads (bundles, size limits, transforms, ...).
+    Bursts of events are collapsed until the project has been quiet for
+    *debounce* seconds.  A ``ValueError`` from the first render (e.g. a
+    scan limit was hit) is raised; later ones are only reported.
+    """
+    cfgs = _output_cfgs(cfg)
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan] = {}
+    for file_cfg in cfgs:
+        _write_outputs(
+            file_cfg, _render_outputs(file_cfg, scan=_scan_for(file_cfg, scans))
+        )
+    signatures = _content_signatures(cfgs, scans)
+
+    if watcher is None:
+        watcher = _make_watcher()
+    print(
+        f"Watching {cfg['project_root']} for changes (Ctrl+C to stop)",
+        file=sys.stderr,
+    )
+    try:
+        while True:
+            try:
+                watcher.arm(scans.values(), signatures)
+            except OSError as exc:
+                print(
+                    f"Warning: {exc}; falling back to polling.",
+                    file=sys.stderr,
+                )
+                watcher.close()
+                watcher = _PollingWatcher()
+                watcher.arm(scans.values(), signatures)
+            if not watcher.wait(None):
+                continue
+            while watcher.wait(debounce):
+                pass
+            scans, signatures = _regenerate(cfgs, scans, signatures)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+# ----------------------------------------------------------------------------
+# Sphinx extension
+# ----------------------------------------------------------------------------
+
+
+def _find_project_root(start: Path) -> Path:
+    """Return the nearest directory at or above *start* with a pyproject."""
+    for candidate in (start, *start.parents):
+        if (candidate / "pyproject.toml").is_file():
+            return candidate
+    return start
+
+
+def _on_config_inited(app: Any, config: Any) -> None:
+    """Resolve ``source_tree_project_root`` to an absolute path.
+
+    A relative setting is taken relative to ``conf.py``; when unset the
+    nearest directory at or above ``conf.py`` with a ``pyproject.toml``
+    is used.
+    """
+    confdir = Path(app.confdir).resolve()
+    root_setting = config.source_tree_project_root
+    config.source_tree_project_root = str(
+        (confdir / root_setting).resolve()
+        if root_setting
+        else _find_project_root(confdir)
+    )
+
+
+def _on_builder_inited(app: Any) -> None:
+    """Generate every configured output in-process before reading starts.
+
+    Outputs are only rewritten when their content changed, so Sphinx
+    does not consider an unchanged output outdated.  The files each
+    output includes are remembered so that :func:`_on_source_read` can
+    register them as dependencies of the generated document.
+    """
+    from sphinx.util import logging
+
+    if not app.config.source_tree_generate:
+        return
+    logger = logging.getLogger(__name__)
+    srcdir = Path(app.srcdir).resolve()
+    project_root = Path(app.config.source_tree_project_root)
+    cfg = resolve_config(
+        build_parser().parse_args(["--project-root", str(project_root)])
+    )
+
+    includes: dict[str, list[str]] = {}
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan] = {}
+    for file_cfg in _output_cfgs(cfg):
+        file_cfg = {
+            **file_cfg,
+            "output": str(project_root / file_cfg["output"]),
+            "format_outputs": {
+                fmt: str(project_root / path)
+                for fmt, path in (file_cfg.get("format_outputs") or {}).items()
+            },
+        }
+        scan = _scan_for(file_cfg, scans)
+        documents = _render_outputs(file_cfg, scan=scan)
+        for doc_path, content in documents.items():
+            if _atomic_write(content, doc_path):
+                logger.info("sphinx-source-tree: wrote %s", doc_path)
+        for stale in _stale_shards(file_cfg, documents):
+            stale.unlink()
+            logger.info("sphinx-source-tree: removed %s", stale)
+        for doc_path, files in _output_includes(file_cfg, scan=scan).items():
+            try:
+                docname = doc_path.relative_to(srcdir).with_suffix("")
+            except ValueError:
+                continue  # Not a document of this project
+            includes[docname.as_posix()] = [str(fp) for fp in files]
+    app.sphinx_source_tree_includes = includes
+
+
+def _on_source_read(app: Any, docname: str, source: list[str]) -> None:
+    """Register the files a generated document includes as dependencies."""
+    for path in getattr(app, "sphinx_source_tree_includes", {}).get(
+        docname, ()
+    ):
+        app.env.note_dependency(path)
+
+
+def _env_scan(env: Any, root: Path, ignore: list[str]) -> ProjectScan:
+    """Return the build-environment cached scan of *root*.
+
+    Every ``source-tree`` directive with the same root and ignore list
+    shares one scan per build.  Scans are pickled with the environment
+    and revalidated by :func:`_on_env_get_outdated` on incremental builds.
+    The current document is recorded as a user of the scan.
+    """
+    if not hasattr(env, "sphinx_source_tree_scans"):
+        env.sphinx_source_tree_scans = {}
+    if not hasattr(env, "sphinx_source_tree_docs"):
+        env.sphinx_source_tree_docs = {}
+    key = (str(root), tuple(ignore))
+    scan = env.sphinx_source_tree_scans.get(key)
+    if scan is None:
+        scan = env.sphinx_source_tree_scans[key] = scan_project(root, ignore)
+    env.sphinx_source_tree_docs.setdefault(env.docname, set()).add(key)
+    return scan
+
+
+def _on_env_get_outdated(
+    app: Any,
+    env: Any,
+    added: set[str],
+    changed: set[str],
+    removed: set[str],
+) -> list[str]:
+    """Re-scan stale cached scans and re-read documents that used them.
+
+    A scan is stale when the mtime of any walked directory moved (an
+    entry was added, removed or renamed).  Documents are only re-read
+    when the fresh scan actually differs.
+    """
+    scans = getattr(env, "sphinx_source_tree_scans", {})
+    refreshed: set[tuple[str, tuple[str, ...]]] = set()
+    for key, scan in list(scans.items()):
+        if not scan.is_stale():
+            continue
+        fresh = scan_project(scan.root, list(scan.ignore))
+        scans[key] = fresh
+        if fresh.entries != scan.entries:
+            refreshed.add(key)
+    docs = getattr(env, "sphinx_source_tree_docs", {})
+    return [
+        docname
+        for docname, keys in docs.items()
+        if keys & refreshed and docname not in removed
+    ]
+
+
+def _on_env_purge_doc(app: Any, env: Any, docname: str) -> None:
+    """Forget which scans *docname* used; re-reading records them again."""
+    getattr(env, "sphinx_source_tree_docs", {}).pop(docname, None)
+
+
+def _on_env_merge_info(
+    app: Any,
+    env: Any,
+    docnames: set[str],
+    other: Any,
+) -> None:
+    """Merge scans and scan users collected by a parallel reader."""
+    if not hasattr(env, "sphinx_source_tree_scans"):
+        env.sphinx_source_tree_scans = {}
+    if not hasattr(env, "sphinx_source_tree_docs"):
+        env.sphinx_source_tree_docs = {}
+    for key, scan in getattr(other, "sphinx_source_tree_scans", {}).items():
+        env.sphinx_source_tree_scans.setdefault(key, scan)
+    other_docs = getattr(other, "sphinx_source_tree_docs", {})
+    for docname in docnames:
+        if docname in other_docs:
+            env.sphinx_source_tree_docs[docname] = other_docs[docname]
+
+
+def _split_option(value: str) -> list[str]:
+    """Split a directive option given as whitespace/comma separated list."""
+    return value.replace(",", " ").split()
+
+
+def _make_source_tree_directive() -> type:
+    """Return the ``source-tree`` directive class (requires Sphinx)."""
+    from docutils.parsers.rst import directives
+    from sphinx.util.docutils import SphinxDirective
+
+    class SourceTreeDirective(SphinxDirective):
+        """Expand to the project tree and ``literalinclude`` directives.
+
+        The optional argument is the project root, relative to the
+        current document (or to the source directory when it starts with
+        ``/``).  Options default to ``[tool.sphinx-source-tree]`` and
+        mirror the ``generate()`` parameters.
+        """
+
+        optional_arguments = 1
+        final_argument_whitespace = True
+        option_spec = {
+            "depth": directives.nonnegative_int,
+            "extensions": _split_option,
+            "ignore": _split_option,
+            "whitelist": _split_option,
+            "order": _split_option,
+            "linenos": directives.flag,
+            "no-tree": directives.flag,
+            "max-file-size": directives.unchanged_required,
+            "max-file-lines": directives.nonnegative_int,
+            "oversize": lambda arg: directives.choice(arg, OVERSIZE_MODES),
+            "token-budget": directives.nonnegative_int,
+            "skip-generated": directives.flag,
+            "dedupe": directives.flag,
+            "chunk-lines": directives.positive_int,
+            "python-mode": lambda arg: directives.choice(arg, PYTHON_MODES),
+            "transforms": _split_option,
+        }
+
+        def run(self) -> list[Any]:
+            if self.arguments:
+                _, abs_root = self.env.relfn2path(
+                    self.arguments[0], self.env.docname
+                )
+                root = Path(abs_root).resolve()
+            else:
+                root = Path(self.config.source_tree_project_root)
+            cfg = resolve_config(
+                build_parser().parse_args(["--project-root", str(root)])
+            )
+            for key in (
+                "depth",
+                "extensions",
+                "ignore",
+                "order",
+                "max-file-size",
+                "max-file-lines",
+                "oversize",
+                "token-budget",
+                "chunk-lines",
+                "python-mode",
+                "transforms",
+            ):
+                if key in self.options:
+                    cfg[key.replace("-", "_")] = self.options[key]
+            if "whitelist" in self.options:
+                cfg["whitelist"] = self.options["whitelist"]
+                cfg["include_all"] = False
+            if "linenos" in self.options:
+                cfg["linenos"] = True
+            if "skip-generated" in self.options:
+                cfg["skip_generated"] = True
+            if "dedupe" in self.options:
+                cfg["dedupe"] = True
+            scan = _env_scan(self.env, root, cfg["ignore"])
+            try:
+                listing = _listing_from_cfg(cfg, scan=scan)
+            except ValueError as exc:
+                raise self.error(str(exc)) from exc
+
+            lines: list[str] = []
+            if "no-tree" not in self.options:
+                lines.extend(
+                    [
+                        ".. code-block:: text",
+                        "   :caption: Project directory layout",
+                        "",
+                        f"   {root.name}/",
+                        *textwrap.indent(listing.tree, "   ").splitlines(),
+                        "",
+                    ]
+                )
+            lines.extend(_notes_block(listing, "rst"))
+            doc_dir = Path(self.env.doc2path(self.env.docname)).parent
+            for fp in listing.files:
+                lines.extend(_rst_include(listing, fp, doc_dir, headings=False))
+            source, _ = self.get_source_info()
+            self.state_machine.insert_input(lines, source)
+            return []
+
+    return SourceTreeDirective
+
+
+def setup(app: Any) -> dict[str, Any]:
+    """Sphinx extension entry point.
+
+    Add ``"sphinx_source_tree"`` to ``extensions`` in ``conf.py`` to
+    generate the outputs configured in ``[tool.sphinx-source-tree]``
+    during ``builder-inited`` instead of running the CLI before every
+    build, and to use the ``source-tree`` directive.
+    """
+    app.add_config_value("source_tree_project_root", None, "env")
+    app.add_config_value("source_tree_generate", True, "env")
+    app.add_directive("source-tree", _make_source_tree_directive())
+    app.connect("config-inited", _on_config_inited)
+    app.connect("builder-inited", _on_builder_inited)
+    app.connect("source-read", _on_source_read)
+    app.connect("env-get-outdated", _on_env_get_outdated)
+    app.connect("env-purge-doc", _on_env_purge_doc)
+    app.connect("env-merge-info", _on_env_merge_info)
+    return {
+        "version": __version__,
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
+
+
+# ----------------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------------
+
+
+def _positive_int(value: str) -> int:
+    """Parse a command line argument that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid positive integer: {value!r}")
+    return number
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Create the argument parser (exposed for documentation / testing)."""
+    p = argparse.ArgumentParser(
+        prog="sphinx-source-tree",
+        description=(
+            "Generate a .rst file with an ASCII project tree "
+            "and literalinclude blocks for every source file."
+        ),
+    )
+    p.add_argument(
+        "-V",
+        "--version",
+        action="version",
+        version=f"%(prog)s {__version__}",
+    )
+    p.add_argument(
+        "-p",
+        "--project-root",
+        type=Path,
+        default=None,
         help="Project directory (default: .)",
     )
     p.add_argument(
@@ -790,12 +5105,318 @@ def build_parser() -> argparse.ArgumentParser:
             "Does not affect the directory tree."
         ),
     )
+    p.add_argument(
+        "-f",
+        "--format",
+        nargs="+",
+        choices=tuple(RENDERERS),
+        default=None,
+        metavar="FORMAT",
+        help=(
+            "Output format(s): rst (literalinclude directives, default), "
+            "myst (MyST Markdown literalincludes), or a text/markdown "
+            "bundle with the file contents inlined. Several formats are "
+            "rendered from one scan, each to the output path with the "
+            "format's suffix"
+        ),
+    )
+    p.add_argument(
+        "--shard-by",
+        choices=SHARD_MODES,
+        default=None,
+        help=(
+            "Split the listing into one document per directory or per "
+            "file, linked from the output via a toctree"
+        ),
+    )
+    p.add_argument(
+        "--max-file-size",
+        default=None,
+        metavar="SIZE",
+        help=(
+            "Treat files larger than SIZE (bytes, or with a K/M/G suffix) "
+            "as oversized"
+        ),
+    )
+    p.add_argument(
+        "--max-file-lines",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Treat files with more than N lines as oversized",
+    )
+    p.add_argument(
+        "--oversize",
+        choices=OVERSIZE_MODES,
+        default=None,
+        help=(
+            "Drop oversized files (skip, default) or include their head "
+            "via a :lines: range (truncate)"
+        ),
+    )
+    p.add_argument(
+        "--oversize-exempt",
+        nargs="+",
+        default=None,
+        metavar="PATTERN",
+        help="Files matching these patterns are never treated as oversized",
+    )
+    p.add_argument(
+        "--token-budget",
+        type=int,
+        default=None,
+        metavar="TOKENS",
+        help=(
+            "Keep the estimated token count of the included files under "
+            "TOKENS, dropping the lowest-priority files"
+        ),
+    )
+    p.add_argument(
+        "--token-counter",
+        default=None,
+        metavar="NAME",
+        help=(
+            "Token estimator for --token-budget: chars (default), words, "
+            "or a module:function import path"
+        ),
+    )
+    p.add_argument(
+        "--sniff",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Skip binary files and add :encoding: to non-UTF-8 files, "
+            "judged from the first few KB of each file (default: on)"
+        ),
+    )
+    p.add_argument(
+        "--skip-generated",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Skip lock files and files that look generated or minified, "
+            "judged from their name and head"
+        ),
+    )
+    p.add_argument(
+        "--generated-exempt",
+        nargs="+",
+        default=None,
+        metavar="PATTERN",
+        help="Files matching these patterns are never skipped as generated",
+    )
+    p.add_argument(
+        "--dedupe",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Include byte-identical files once and refer to the first "
+            "copy from the others"
+        ),
+    )
+    p.add_argument(
+        "--strict-file-options",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Fail when a file-options marker or lines range does not "
+            "match its file (default: warn)"
+        ),
+    )
+    p.add_argument(
+        "--resolve-lines",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Emit the numeric :lines: range that file-options markers "
+            "resolve to instead of the markers"
+        ),
+    )
+    p.add_argument(
+        "--chunk-lines",
+        type=_positive_int,
+        default=None,
+        metavar="N",
+        help=(
+            "Split files longer than N lines into several literalinclude "
+            "sections of at most N lines"
+        ),
+    )
+    p.add_argument(
+        "--chunk-snap",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "End chunks of Python files before a top-level definition "
+            "instead of at a fixed line"
+        ),
+    )
+    p.add_argument(
+        "--python-mode",
+        choices=PYTHON_MODES,
+        default=None,
+        help=(
+            "Include Python files in full (default) or as a skeleton of "
+            "signatures and docstrings"
+        ),
+    )
+    p.add_argument(
+        "--transforms",
+        nargs="+",
+        choices=tuple(TRANSFORMS),
+        default=None,
+        metavar="NAME",
+        help=(
+            "Content transforms applied to every included file, in "
+            f"order: {', '.join(TRANSFORMS)}"
+        ),
+    )
+    p.add_argument(
+        "--max-files",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Stop walking the project after more than N files",
+    )
+    p.add_argument(
+        "--max-entries-scanned",
+        type=int,
+        default=None,
+        metavar="N",
+        help=(
+            "Stop walking the project after more than N directory entries "
+            "(ignored ones included)"
+        ),
+    )
+    p.add_argument(
+        "--time-budget",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop walking the project after SECONDS",
+    )
+    p.add_argument(
+        "--on-scan-limit",
+        choices=SCAN_LIMIT_MODES,
+        default=None,
+        help=(
+            "When the walk stops at a limit: fail (error, default) or "
+            "render a partial output (partial)"
+        ),
+    )
+    p.add_argument(
+        "--cache-dir",
+        default=None,
+        metavar="PATH",
+        help="Directory of the persistent cache",
+    )
     p.add_argument(
         "--stdout",
         action="store_true",
         default=None,
         help="Print to stdout instead of writing to a file",
     )
+    p.add_argument(
+        "--manifest",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Write a JSON manifest of the files each output references "
+            "(size, language, options) and of the files left out"
+        ),
+    )
+    p.add_argument(
+        "--from-manifest",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Re-render the outputs recorded in a manifest without walking "
+            "the project"
+        ),
+    )
+    p.add_argument(
+        "--check",
+        action="store_true",
+        default=None,
+        help=(
+            "Write nothing; exit with status 1 and list the outputs that "
+            "are out of date"
+        ),
+    )
+    p.add_argument(
+        "--changed-since",
+        default=None,
+        metavar="REF",
+        help=(
+            "Only list the files changed since git REF (and their "
+            "directories in the tree)"
+        ),
+    )
+    p.add_argument(
+        "--pre-commit",
+        action="store_true",
+        default=None,
+        help=(
+            "Hook mode: only regenerate the outputs the given changed "
+            "files can affect"
+        ),
+    )
+    p.add_argument(
+        "changed",
+        nargs="*",
+        metavar="PATH",
+        help="Changed files, as passed by pre-commit (with --pre-commit)",
+    )
+    p.add_argument(
+        "--explain",
+        nargs="+",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Print which ignore pattern, whitelist entry, depth limit or "
+            "extension decides whether each PATH is shown, then exit"
+        ),
+    )
+    p.add_argument(
+        "--report-size",
+        type=int,
+        nargs="?",
+        const=10,
+        default=None,
+        metavar="N",
+        help=(
+            "Print the N (default: 10) files and directories that "
+            "contribute most to each output to stderr"
+        ),
+    )
+    p.add_argument(
+        "--timings",
+        action="store_true",
+        default=None,
+        help=(
+            "Print the wall time of each phase and counters (directories "
+            "listed, entries pruned, ...) to stderr"
+        ),
+    )
+    p.add_argument(
+        "--watch",
+        action="store_true",
+        default=None,
+        help=(
+            "Keep running and regenerate the output(s) whenever files "
+            "are added, removed or renamed"
+        ),
+    )
+    p.add_argument(
+        "--debounce",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help=(
+            "With --watch, wait until the project has been quiet for "
+            f"this long before regenerating (default: {WATCH_DEBOUNCE})"
+        ),
+    )
     return p
 
 
@@ -805,34 +5426,226 @@ def main(argv: list[str] | None = None) -> None:
     args = parser.parse_args(argv)
 
     stdout = args.stdout
+    watch = args.watch
+    debounce = args.debounce
+    timings = args.timings
+    from_manifest = args.from_manifest
+    check = args.check
+    pre_commit = args.pre_commit
+    changed_since = args.changed_since
+    report_size = args.report_size
+    explain = args.explain
+    changed = [Path(os.path.abspath(path)) for path in args.changed]
     delattr(args, "stdout")
+    delattr(args, "watch")
+    delattr(args, "debounce")
+    delattr(args, "timings")
+    delattr(args, "from_manifest")
+    delattr(args, "check")
+    delattr(args, "pre_commit")
+    delattr(args, "changed_since")
+    delattr(args, "report_size")
+    delattr(args, "explain")
+    delattr(args, "changed")
+    if watch and stdout:
+        parser.error("--watch cannot be combined with --stdout")
+    if watch and timings:
+        parser.error("--watch cannot be combined with --timings")
+    if watch and from_manifest:
+        parser.error("--watch cannot be combined with --from-manifest")
+    if changed and not pre_commit:
+        parser.error("changed files are only accepted with --pre-commit")
+    if pre_commit and (watch or from_manifest):
+        parser.error(
+            "--pre-commit cannot be combined with --watch or --from-manifest"
+        )
+    if changed_since and (watch or from_manifest or pre_commit):
+        parser.error(
+            "--changed-since cannot be combined with --watch, "
+            "--from-manifest or --pre-commit"
+        )
+    if changed_since and not (stdout or args.output):
+        parser.error(
+            "--changed-since needs --stdout or -o/--output; the configured "
+            "output keeps the full listing"
+        )
+    if explain and (watch or from_manifest):
+        parser.error(
+            "--explain cannot be combined with --watch or --from-manifest"
+        )
+    if check and watch:
+        parser.error("--check cannot be combined with --watch")
+    if check and stdout:
+        parser.error("--check cannot be combined with --stdout")
 
-    cfg = resolve_config(args)
-
-    per_file_cfgs: list[dict[str, Any]] = cfg.get("files", [])
-
-    if per_file_cfgs:
-        # Multi-file mode: generate one RST per [[files]] entry.
-        # --stdout emits all files concatenated to stdout.
-        for file_cfg in per_file_cfgs:
-            content = _generate_from_cfg(file_cfg)
-            if stdout:
-                sys.stdout.write(content)
+    with (
+        record_timings(_print_timings) if timings else contextlib.nullcontext(),
+        _checking() if check else contextlib.nullcontext() as pending,
+    ):
+        scans: dict[tuple[str, tuple[str, ...]], ProjectScan] = {}
+        listings: Iterable[tuple[dict[str, Any], SourceListing]]
+        cfgs: list[dict[str, Any]] = []
+        # Staged copies are only pruned after a run that rendered every
+        # output from a full walk; others may still include them.
+        complete = not (from_manifest or changed_since or check)
+        if from_manifest:
+            # Re-render what a previous run recorded; nothing is walked.
+            try:
+                listings = _load_manifest(
+                    Path(from_manifest), args.project_root
+                )
+            except ValueError as exc:
+                parser.error(str(exc))
+        else:
+            with _phase("config"):
+                cfg = resolve_config(args)
+            if explain:
+                paths = [Path(os.path.abspath(path)) for path in explain]
+                for file_cfg in _output_cfgs(cfg):
+                    print(_explain(file_cfg, paths))
+                return
+            if watch:
+                try:
+                    _watch(
+                        cfg,
+                        debounce=(
+                            WATCH_DEBOUNCE if debounce is None else debounce
+                        ),
+                    )
+                except ValueError as exc:
+                    # Only the first render raises; later ones are reported
+                    # and the watch goes on.
+                    parser.error(str(exc))
+                return
+            cfgs = _output_cfgs(cfg)
+            if pre_commit:
+                # Decided from the rules alone; the project is not walked
+                # for outputs none of the changed files can affect.
+                skipped = [c for c in cfgs if not _affected_by(c, changed)]
+                # A manifest is rewritten from the outputs rendered, so
+                # the outputs sharing one are regenerated together.
+                shared = {
+                    Path(c["manifest"]).resolve()
+                    for c in cfgs
+                    if c.get("manifest") and c not in skipped
+                }
+                skipped = [
+                    c
+                    for c in skipped
+                    if not (
+                        c.get("manifest")
+                        and Path(c["manifest"]).resolve() in shared
+                    )
+                ]
+                cfgs = [c for c in cfgs if c not in skipped]
+                complete = complete and not skipped
+                for file_cfg in skipped:
+                    for out_path in _format_outputs(file_cfg).values():
+                        print(f"Unaffected {out_path}")
+            if check and not changed_since:
+                # Outputs whose stored fingerprint still holds are current
+                # without walking or rendering anything.
+                fresh = [c for c in cfgs if _is_up_to_date(c)]
+                cfgs = [c for c in cfgs if c not in fresh]
+                for file_cfg in fresh:
+                    for out_path in _format_outputs(file_cfg).values():
+                        print(f"Up to date {out_path}")
+            if changed_since:
+                # Only the -o/--output paths are written: configured
+                # format-outputs and manifests describe the full listing.
+                cfgs = [
+                    {**c, "format_outputs": None, "manifest": None}
+                    for c in cfgs
+                ]
+                listings = _iter_changed_listings(cfgs, changed_since)
             else:
-                _write_output(
-                    content,
-                    Path(file_cfg.get("output", DEFAULTS["output"])),
+                listings = _iter_listings(cfgs, scans)
+
+        # One output per [[files]] entry (multi-file mode), or a single
+        # output from the top-level config.  --stdout emits all outputs
+        # concatenated.  Outputs sharing a project root and ignore list
+        # share one scan.
+        manifests: dict[Path, list[dict[str, Any]]] = {}
+        generated: list[
+            tuple[dict[str, Any], ProjectScan, SourceListing, dict[Path, str]]
+        ] = []
+        rendered: list[SourceListing] = []
+        try:
+            for file_cfg, listing in listings:
+                documents = _render_listing(file_cfg, listing)
+                rendered.append(listing)
+                if report_size is not None:
+                    print(
+                        _size_report(
+                            file_cfg,
+                            listing,
+                            scans.get(_scan_key(file_cfg)),
+                            top=report_size,
+                        ),
+                        file=sys.stderr,
+                    )
+                if file_cfg.get("manifest"):
+                    manifests.setdefault(
+                        Path(file_cfg["manifest"]).resolve(), []
+                    ).append(
+                        _manifest_entry(
+                            file_cfg, listing, scans.get(_scan_key(file_cfg))
+                        )
+                    )
+                if stdout:
+                    with _phase("write"):
+                        for content in documents.values():
+                            sys.stdout.write(content)
+                            _count(
+                                "bytes_written", len(content.encode("utf-8"))
+                            )
+                else:
+                    stale = len(pending) if pending is not None else 0
+                    _write_outputs(file_cfg, documents)
+                    if pending is not None and len(pending) == stale:
+                        for out_path in _format_outputs(file_cfg).values():
+                            print(f"Up to date {out_path}")
+                    scan = scans.get(_scan_key(file_cfg))
+                    # A partial walk is no basis for later checks.
+                    if scan is not None and not scan.truncated:
+                        generated.append((file_cfg, scan, listing, documents))
+        except ValueError as exc:
+            parser.error(str(exc))
+        if complete:
+            _prune_staged(rendered)
+        _write_manifests(manifests)
+        if pending is not None:
+            if pending:
+                for path in pending:
+                    print(f"Stale {path}")
+                print(
+                    f"{len(pending)} generated file(s) out of date; "
+                    f"run sphinx-source-tree to update them.",
+                    file=sys.stderr,
                 )
-    else:
-        # Single-file mode (original behaviour).
-        content = _generate_from_cfg(cfg)
-        if stdout:
-            sys.stdout.write(content)
+                raise SystemExit(1)
         else:
-            _write_output(
-                content,
-                Path(cfg.get("output", DEFAULTS["output"])),
-            )
+            _save_fingerprints(generated)
+
+
+def _iter_listings(
+    cfgs: list[dict[str, Any]],
+    scans: dict[tuple[str, tuple[str, ...]], ProjectScan],
+) -> Iterable[tuple[dict[str, Any], SourceListing]]:
+    """Yield ``(output config, listing)`` for every output config.
+
+    Scans are taken on first use and kept in *scans*.
+    """
+    for file_cfg in cfgs:
+        yield (
+            file_cfg,
+            _listing_from_cfg(file_cfg, scan=_scan_for(file_cfg, scans)),
+        )
+
+
+def _print_timings(timings: Timings) -> None:
+    """Print the report of ``--timings`` to stderr."""
+    print(f"Timings:\n{timings.format()}", file=sys.stderr)
 
 
 if __name__ == "__main__":
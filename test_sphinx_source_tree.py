@@ -1,19 +1,28 @@
 from __future__ import annotations
 
+import os
 import textwrap
 from pathlib import Path
 
 import pytest
 from sphinx_source_tree import (
+    BUNDLE_RULE,
     DEFAULTS,
+    RENDERERS,
     build_parser,
     build_tree,
     collect_files,
+    collect_listing,
     detect_language,
+    estimate_tokens,
     generate,
+    generate_bundle,
+    generate_shards,
     load_config,
     main,
+    record_timings,
     resolve_config,
+    scan_project,
 )
 
 __author__ = "Artur Barseghyan <artur.barseghyan@gmail.com>"
@@ -21,16 +30,40 @@ __copyright__ = "2026 Artur Barseghyan"
 __license__ = "MIT"
 __all__ = (
     "TestBuildTree",
+    "TestBundle",
+    "TestChangedSince",
+    "TestCheck",
+    "TestChunking",
     "TestCollectFiles",
+    "TestDedupe",
     "TestDetectLanguage",
+    "TestExplain",
     "TestFileOptions",
+    "TestGeneratedClassifier",
     "TestGenerate",
     "TestLoadConfig",
     "TestLoadConfig",
     "TestLoadConfig",
     "TestMain",
+    "TestManifest",
     "TestOrder",
+    "TestPreCommit",
+    "TestPythonSkeleton",
+    "TestRangeValidation",
+    "TestRenderers",
+    "TestReportSize",
     "TestResolveConfig",
+    "TestScanLimits",
+    "TestScanProject",
+    "TestShards",
+    "TestSizeLimits",
+    "TestSniffing",
+    "TestSourceTreeDirective",
+    "TestTokenBudget",
+    "TestTransforms",
+    "TestSphinxExtension",
+    "TestTimings",
+    "TestWatch",
 )
 
 
@@ -1507,3 +1540,3126 @@ class TestOrder:
         )
         captions = _literalinclude_order(content)
         assert captions[0] == "src/utils.py"
+
+
+# ----------------------------------------------------------------------------
+# scan_project
+# ----------------------------------------------------------------------------
+
+
+def _backdate(root: Path) -> None:
+    """Push every directory mtime into the past.
+
+    Filesystem timestamps are coarse, so a change made in the same tick
+    as a scan could otherwise go unnoticed by mtime comparisons.
+    """
+    for dirpath, _dirnames, _filenames in os.walk(root):
+        os.utime(dirpath, (1_000_000_000, 1_000_000_000))
+
+
+class TestScanProject:
+    """Tests for the single-walk project snapshot."""
+
+    def test_prunes_ignored_directories(self, sample_project):
+        (sample_project / "node_modules" / "pkg").mkdir(parents=True)
+        (sample_project / "node_modules" / "pkg" / "index.js").write_text(
+            "", encoding="utf-8"
+        )
+        scan = scan_project(sample_project, ["node_modules", "__pycache__"])
+        assert "node_modules" not in scan.entries
+        assert "node_modules/pkg" not in scan.entries
+        assert "src" in scan.entries
+        assert "src/app.py" in set(scan.iter_files())
+
+    def test_entries_sorted_dirs_first(self, sample_project):
+        scan = scan_project(sample_project, ["__pycache__"])
+        kinds = [entry.is_file for entry in scan.entries[""]]
+        assert kinds == sorted(kinds)
+
+    def test_max_depth_limits_walk(self, sample_project):
+        scan = scan_project(sample_project, [], max_depth=0)
+        assert list(scan.entries) == [""]
+
+    def test_collect_files_skips_files_under_ignored_path_pattern(
+        self, sample_project
+    ):
+        """A directory ignored by a path pattern hides its files too."""
+        (sample_project / "docs" / "_static").mkdir()
+        (sample_project / "docs" / "_static" / "custom.js").write_text(
+            "", encoding="utf-8"
+        )
+        files = collect_files(
+            sample_project,
+            extensions=[".js", ".rst"],
+            ignore=["docs/_static"],
+            whitelist=[],
+            include_all=True,
+        )
+        rels = [f.relative_to(sample_project).as_posix() for f in files]
+        assert "docs/index.rst" in rels
+        assert "docs/_static/custom.js" not in rels
+
+    def test_shared_scan_matches_fresh_walk(self, sample_project):
+        ignore = ["__pycache__", "*.pyc"]
+        scan = scan_project(sample_project.resolve(), ignore)
+        out = sample_project / "docs" / "out.rst"
+        assert generate(sample_project, out, ignore=ignore) == generate(
+            sample_project, out, ignore=ignore, scan=scan
+        )
+
+    def test_is_stale_on_structural_change_only(self, sample_project):
+        _backdate(sample_project)
+        scan = scan_project(sample_project, ["__pycache__"])
+        assert not scan.is_stale()
+
+        (sample_project / "src" / "app.py").write_text(
+            "print('edited')\n", encoding="utf-8"
+        )
+        assert not scan.is_stale()
+
+        (sample_project / "src" / "new.py").write_text("", encoding="utf-8")
+        assert scan.is_stale()
+
+    def test_rescan_lists_changed_directories_only(self, sample_project):
+        ignore = ["__pycache__"]
+        _backdate(sample_project)
+        scan = scan_project(sample_project, ignore)
+        (sample_project / "src" / "pkg").mkdir()
+        (sample_project / "src" / "pkg" / "mod.py").write_text(
+            "", encoding="utf-8"
+        )
+        with record_timings() as timings:
+            rescan = scan_project(sample_project, ignore, previous=scan)
+        # src changed and src/pkg is new; ".", docs and tests are reused
+        assert timings.counters["dirs_listed"] == 2
+        assert rescan.entries == scan_project(sample_project, ignore).entries
+
+    def test_rescan_relists_recently_modified_directories(self, sample_project):
+        ignore = ["__pycache__"]
+        scan = scan_project(sample_project, ignore)
+        with record_timings() as timings:
+            scan_project(sample_project, ignore, previous=scan)
+        assert timings.counters["dirs_listed"] == len(scan.entries)
+
+
+# ----------------------------------------------------------------------------
+# watch mode
+# ----------------------------------------------------------------------------
+
+
+class _ScriptedWatcher:
+    """Watcher double that runs one action per ``wait`` call."""
+
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self.closed = False
+
+    def arm(self, scans, files=()):
+        pass
+
+    def wait(self, timeout):
+        if not self.actions:
+            raise KeyboardInterrupt
+        action = self.actions.pop(0)
+        return action() if action else False
+
+    def close(self):
+        self.closed = True
+
+
+class TestWatch:
+    """Tests for ``--watch`` and the atomic output writer."""
+
+    def test_polling_watcher_detects_add_remove_rename(self, sample_project):
+        from sphinx_source_tree import _PollingWatcher
+
+        _backdate(sample_project)
+        watcher = _PollingWatcher(interval=0.01)
+        watcher.arm([scan_project(sample_project, ["__pycache__"])])
+        assert watcher.wait(0) is False
+
+        new = sample_project / "src" / "new.py"
+        new.write_text("", encoding="utf-8")
+        assert watcher.wait(0) is True
+        assert watcher.wait(0) is False
+
+        _backdate(sample_project)
+        watcher.arm([scan_project(sample_project, ["__pycache__"])])
+        new.rename(sample_project / "src" / "renamed.py")
+        assert watcher.wait(0) is True
+
+        _backdate(sample_project)
+        watcher.arm([scan_project(sample_project, ["__pycache__"])])
+        (sample_project / "src" / "renamed.py").unlink()
+        assert watcher.wait(0) is True
+
+    def test_polling_watcher_ignores_content_edits(self, sample_project):
+        from sphinx_source_tree import _PollingWatcher
+
+        _backdate(sample_project)
+        watcher = _PollingWatcher(interval=0.01)
+        watcher.arm([scan_project(sample_project, ["__pycache__"])])
+        (sample_project / "src" / "app.py").write_text(
+            "print('edited')\n", encoding="utf-8"
+        )
+        assert watcher.wait(0.05) is False
+
+    def test_inotify_watcher_detects_create(self, sample_project):
+        from sphinx_source_tree import _InotifyWatcher, _load_libc_inotify
+
+        libc = _load_libc_inotify()
+        if libc is None:
+            pytest.skip("inotify is not available")
+        watcher = _InotifyWatcher(libc)
+        try:
+            watcher.arm([scan_project(sample_project, ["__pycache__"])])
+            (sample_project / "src" / "app.py").write_text(
+                "print('edited')\n", encoding="utf-8"
+            )
+            assert watcher.wait(0.05) is False
+            (sample_project / "src" / "new.py").write_text("", encoding="utf-8")
+            assert watcher.wait(1) is True
+        finally:
+            watcher.close()
+
+    def test_inotify_watcher_detects_writes_of_given_files(
+        self, sample_project
+    ):
+        from sphinx_source_tree import _InotifyWatcher, _load_libc_inotify
+
+        libc = _load_libc_inotify()
+        if libc is None:
+            pytest.skip("inotify is not available")
+        app = sample_project / "src" / "app.py"
+        watcher = _InotifyWatcher(libc)
+        try:
+            watcher.arm([scan_project(sample_project, ["__pycache__"])], [app])
+            app.write_text("print('edited')\n", encoding="utf-8")
+            assert watcher.wait(1) is True
+        finally:
+            watcher.close()
+
+    def test_write_output_skips_unchanged_content(self, tmp_path, capsys):
+        from sphinx_source_tree import _write_output
+
+        out = tmp_path / "out.rst"
+        assert _write_output("content\n", out) is True
+        assert _write_output("content\n", out) is False
+        assert _write_output("changed\n", out) is True
+        assert out.read_text(encoding="utf-8") == "changed\n"
+        # No temporary files are left behind by the atomic replace
+        assert [p.name for p in tmp_path.iterdir()] == ["out.rst"]
+        assert "Unchanged" in capsys.readouterr().out
+
+    def test_watch_rewrites_only_on_structural_change(self, sample_project):
+        from sphinx_source_tree import _watch
+
+        out = sample_project / "docs" / "out.rst"
+        cfg = resolve_config(
+            build_parser().parse_args(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--output",
+                    str(out),
+                    "--ignore",
+                    "__pycache__",
+                    "docs",
+                ]
+            )
+        )
+        mtimes = []
+
+        def edit_contents():
+            mtimes.append(out.stat().st_mtime_ns)
+            (sample_project / "src" / "app.py").write_text(
+                "print('edited')\n", encoding="utf-8"
+            )
+            return True
+
+        def add_file():
+            mtimes.append(out.stat().st_mtime_ns)
+            (sample_project / "src" / "extra.py").write_text(
+                "", encoding="utf-8"
+            )
+            return True
+
+        watcher = _ScriptedWatcher([edit_contents, None, add_file, None])
+        _watch(cfg, debounce=0, watcher=watcher)
+
+        assert watcher.closed
+        content = out.read_text(encoding="utf-8")
+        assert "src/extra.py" in content
+        # The content edit did not rewrite the output
+        assert mtimes[0] == mtimes[1]
+
+    def test_watch_relists_changed_directories_only(self, sample_project):
+        from sphinx_source_tree import _watch
+
+        out = sample_project / "out.rst"
+        cfg = resolve_config(
+            build_parser().parse_args(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--output",
+                    str(out),
+                    "--ignore",
+                    "__pycache__",
+                ]
+            )
+        )
+        listed = []
+
+        def add_file():
+            listed.append(timings.counters["dirs_listed"])
+            (sample_project / "src" / "extra.py").write_text(
+                "", encoding="utf-8"
+            )
+            return True
+
+        _backdate(sample_project)
+        watcher = _ScriptedWatcher([None, add_file, None])
+        with record_timings() as timings:
+            _watch(cfg, debounce=0, watcher=watcher)
+
+        assert "src/extra.py" in out.read_text(encoding="utf-8")
+        # Writing the output touched "."; only it and src were re-listed
+        assert timings.counters["dirs_listed"] == listed[0] + 2
+
+    def test_watch_rerenders_bundle_on_content_edit(self, sample_project):
+        from sphinx_source_tree import _watch
+
+        out = sample_project / "docs" / "out.txt"
+        cfg = resolve_config(
+            build_parser().parse_args(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--output",
+                    str(out),
+                    "--format",
+                    "text",
+                    "--ignore",
+                    "__pycache__",
+                    "docs",
+                ]
+            )
+        )
+        armed = []
+
+        class _Recording(_ScriptedWatcher):
+            def arm(self, scans, files=()):
+                armed.append(set(files))
+
+        def edit_contents():
+            (sample_project / "src" / "app.py").write_text(
+                "print('edited')\n", encoding="utf-8"
+            )
+            return True
+
+        _watch(cfg, debounce=0, watcher=_Recording([edit_contents, None]))
+
+        assert "print('edited')" in out.read_text(encoding="utf-8")
+        assert sample_project / "src" / "app.py" in armed[0]
+
+    def test_polling_watcher_detects_edits_of_given_files(self, sample_project):
+        from sphinx_source_tree import _PollingWatcher
+
+        _backdate(sample_project)
+        app = sample_project / "src" / "app.py"
+        watcher = _PollingWatcher(interval=0.01)
+        watcher.arm([scan_project(sample_project, ["__pycache__"])], [app])
+        app.write_text("print('edited')\n", encoding="utf-8")
+        assert watcher.wait(0) is True
+
+    def test_watch_and_stdout_are_exclusive(self, sample_project):
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(sample_project), "--watch", "--stdout"])
+
+
+# ----------------------------------------------------------------------------
+# Sphinx extension
+# ----------------------------------------------------------------------------
+
+
+def _sphinx_project(tmp_path: Path, conf: str = "") -> Path:
+    """Create a project whose docs build uses the extension."""
+    (tmp_path / "pyproject.toml").write_text(
+        textwrap.dedent("""\
+            [tool.sphinx-source-tree]
+            extensions = [".py"]
+            ignore = ["__pycache__", "docs"]
+            output = "docs/source_tree.rst"
+        """),
+        encoding="utf-8",
+    )
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "app.py").write_text(
+        "print('hello')\n", encoding="utf-8"
+    )
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "conf.py").write_text(
+        'extensions = ["sphinx_source_tree"]\n' + conf, encoding="utf-8"
+    )
+    (docs / "index.rst").write_text(
+        "Index\n=====\n\n.. toctree::\n\n   source_tree\n",
+        encoding="utf-8",
+    )
+    return tmp_path
+
+
+def _sphinx_build(project: Path, builder: str = "text"):
+    from sphinx.application import Sphinx
+
+    docs = project / "docs"
+    app = Sphinx(
+        srcdir=str(docs),
+        confdir=str(docs),
+        outdir=str(docs / "_build" / builder),
+        doctreedir=str(docs / "_build" / "doctrees"),
+        buildername=builder,
+        status=None,
+        warning=None,
+        freshenv=False,
+    )
+    app.build()
+    return app
+
+
+class TestSphinxExtension:
+    """Tests for generating outputs in-process during a Sphinx build."""
+
+    def test_setup_declares_parallel_safety(self):
+        pytest.importorskip("sphinx")
+        from sphinx_source_tree import setup
+
+        class _App:
+            def __init__(self):
+                self.config_values = []
+                self.directives = []
+                self.events = []
+
+            def add_config_value(self, name, default, rebuild):
+                self.config_values.append(name)
+
+            def add_directive(self, name, cls):
+                self.directives.append(name)
+
+            def connect(self, event, callback):
+                self.events.append(event)
+
+        app = _App()
+        metadata = setup(app)
+        assert metadata["parallel_read_safe"] is True
+        assert metadata["parallel_write_safe"] is True
+        assert "source_tree_project_root" in app.config_values
+        assert "builder-inited" in app.events
+        assert "source-tree" in app.directives
+
+    def test_generates_output_during_build(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _sphinx_project(tmp_path)
+        app = _sphinx_build(project)
+
+        out = project / "docs" / "source_tree.rst"
+        assert ".. literalinclude:: ../src/app.py" in out.read_text(
+            encoding="utf-8"
+        )
+        deps = {str(dep) for dep in app.env.dependencies["source_tree"]}
+        assert any(dep.endswith("app.py") for dep in deps)
+
+    def test_unchanged_output_is_not_rewritten(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _sphinx_project(tmp_path)
+        _sphinx_build(project)
+        out = project / "docs" / "source_tree.rst"
+        os.utime(out, (1_000_000_000, 1_000_000_000))
+
+        _sphinx_build(project)
+        assert out.stat().st_mtime_ns == 1_000_000_000 * 10**9
+
+        (project / "src" / "new.py").write_text("", encoding="utf-8")
+        _sphinx_build(project)
+        assert "src/new.py" in out.read_text(encoding="utf-8")
+
+    def test_project_root_config_value(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _sphinx_project(
+            tmp_path, conf='source_tree_project_root = ".."\n'
+        )
+        _sphinx_build(project)
+        assert (project / "docs" / "source_tree.rst").exists()
+
+
+# ----------------------------------------------------------------------------
+# source-tree directive
+# ----------------------------------------------------------------------------
+
+
+def _directive_project(tmp_path: Path, pages: dict[str, str]) -> Path:
+    """Create a directive-only docs project with the given *pages*."""
+    project = _sphinx_project(tmp_path, conf="source_tree_generate = False\n")
+    (project / "src" / "utils.py").write_text(
+        "def helper(): pass\n", encoding="utf-8"
+    )
+    docs = project / "docs"
+    toctree = "".join(f"   {name}\n" for name in pages)
+    (docs / "index.rst").write_text(
+        f"Index\n=====\n\n.. toctree::\n\n{toctree}", encoding="utf-8"
+    )
+    for name, body in pages.items():
+        (docs / f"{name}.rst").write_text(
+            f"{name}\n{'=' * len(name)}\n\n{body}", encoding="utf-8"
+        )
+    return project
+
+
+class TestSourceTreeDirective:
+    """Tests for the ``.. source-tree::`` directive."""
+
+    @pytest.fixture(autouse=True)
+    def _require_sphinx(self):
+        pytest.importorskip("sphinx")
+
+    def test_expands_tree_and_includes(self, tmp_path):
+        project = _directive_project(
+            tmp_path, {"api": ".. source-tree::\n   :order: src/utils.py\n"}
+        )
+        _sphinx_build(project)
+        text = (project / "docs" / "_build" / "text" / "api.txt").read_text(
+            encoding="utf-8"
+        )
+        assert "src/" in text
+        assert "print('hello')" in text
+        assert text.index("def helper") < text.index("print('hello')")
+        assert not (project / "docs" / "source_tree.rst").exists()
+
+    def test_options_shape_the_view(self, tmp_path):
+        project = _directive_project(
+            tmp_path,
+            {
+                "api": (
+                    ".. source-tree::\n"
+                    "   :whitelist: src/utils.py\n"
+                    "   :linenos:\n"
+                    "   :no-tree:\n"
+                ),
+            },
+        )
+        _sphinx_build(project)
+        text = (project / "docs" / "_build" / "text" / "api.txt").read_text(
+            encoding="utf-8"
+        )
+        assert "def helper" in text
+        assert "print('hello')" not in text
+        assert "Project directory layout" not in text
+
+    def test_directives_share_one_scan(self, tmp_path, monkeypatch):
+        import sphinx_source_tree
+
+        project = _directive_project(
+            tmp_path,
+            {
+                "one": ".. source-tree::\n",
+                "two": ".. source-tree::\n   :depth: 1\n",
+                "three": ".. source-tree::\n   :extensions: .py\n",
+            },
+        )
+        calls = []
+        real_scan = sphinx_source_tree.scan_project
+
+        def counting_scan(*args, **kwargs):
+            calls.append(args)
+            return real_scan(*args, **kwargs)
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", counting_scan)
+        _sphinx_build(project)
+        assert len(calls) == 1
+
+        # Nothing changed: the pickled scan is revalidated, not redone
+        calls.clear()
+        _sphinx_build(project)
+        assert calls == []
+
+    def test_structural_change_rereads_documents(self, tmp_path):
+        project = _directive_project(tmp_path, {"api": ".. source-tree::\n"})
+        _sphinx_build(project)
+        (project / "src" / "extra.py").write_text(
+            "EXTRA = 1\n", encoding="utf-8"
+        )
+        app = _sphinx_build(project)
+        text = (project / "docs" / "_build" / "text" / "api.txt").read_text(
+            encoding="utf-8"
+        )
+        assert "EXTRA = 1" in text
+        assert app.env.sphinx_source_tree_docs["api"]
+
+
+# ----------------------------------------------------------------------------
+# sharded output
+# ----------------------------------------------------------------------------
+
+
+class TestShards:
+    """Tests for ``shard-by`` output."""
+
+    def test_directory_shards(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        docs = generate_shards(
+            sample_project,
+            out,
+            ignore=["__pycache__"],
+            extensions=[".py", ".md"],
+        )
+        shard_root = out.resolve().with_suffix("")
+        assert set(docs) == {
+            out.resolve(),
+            shard_root / "index.rst",
+            shard_root / "src" / "index.rst",
+            shard_root / "tests" / "index.rst",
+        }
+        src_shard = docs[shard_root / "src" / "index.rst"]
+        assert src_shard.startswith("src/\n====\n")
+        assert ".. literalinclude:: ../../../src/app.py" in src_shard
+        assert "test_app.py" not in src_shard
+        assert docs[shard_root / "index.rst"].startswith(
+            f"{sample_project.name}/\n"
+        )
+
+    def test_index_holds_tree_and_toctree(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        index = generate_shards(
+            sample_project,
+            out,
+            ignore=["__pycache__"],
+            extensions=[".py"],
+            order=["tests/test_app.py"],
+        )[out.resolve()]
+        assert "Project directory layout" in index
+        assert ".. literalinclude::" not in index
+        toctree = index[index.index(".. toctree::") :].splitlines()
+        entries = [line.strip() for line in toctree if line.startswith("   ")]
+        assert entries == [
+            ":maxdepth: 1",
+            "source_tree/tests/index",
+            "source_tree/src/index",
+        ]
+
+    def test_file_shards(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        docs = generate_shards(
+            sample_project,
+            out,
+            shard_by="file",
+            ignore=["__pycache__"],
+            extensions=[".py"],
+            file_options={"src/app.py": {"lines": "1"}},
+        )
+        shard = docs[out.resolve().with_suffix("") / "src" / "app.py.rst"]
+        assert shard.startswith("src/app.py\n==========\n")
+        assert ":lines: 1" in shard
+        assert "source_tree/src/app.py" in docs[out.resolve()]
+
+    def test_file_shards_of_source_suffixes(self, sample_project):
+        out = sample_project / "source_tree.rst"
+        docs = generate_shards(
+            sample_project,
+            out,
+            shard_by="file",
+            ignore=["__pycache__", "src", "tests"],
+            extensions=[".rst", ".md"],
+        )
+        shard_root = out.resolve().with_suffix("")
+        assert shard_root / "docs" / "index.rst_.rst" in docs
+        assert shard_root / "README.md_.rst" in docs
+        index = docs[out.resolve()]
+        assert "   source_tree/docs/index.rst_\n" in index
+        assert "   source_tree/README.md_\n" in index
+
+    def test_sphinx_build_with_rst_file_shards(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _sphinx_project(tmp_path)
+        (project / "src" / "notes.rst").write_text(
+            "Notes\n=====\n", encoding="utf-8"
+        )
+        pyproject = project / "pyproject.toml"
+        pyproject.write_text(
+            pyproject.read_text(encoding="utf-8").replace(
+                'extensions = [".py"]',
+                'extensions = [".py", ".rst"]\nshard-by = "file"',
+            ),
+            encoding="utf-8",
+        )
+        app = _sphinx_build(project)
+        assert "source_tree/src/notes.rst_" in app.env.all_docs
+        assert "source_tree/src/app.py" in app.env.all_docs
+
+    def test_invalid_mode_rejected(self, sample_project):
+        with pytest.raises(ValueError, match="shard-by"):
+            generate_shards(sample_project, shard_by="package")
+
+    def test_main_writes_shards_and_removes_stale(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        args = [
+            "--project-root",
+            str(sample_project),
+            "--output",
+            str(out),
+            "--ignore",
+            "__pycache__",
+            "docs",
+            "--extensions",
+            ".py",
+            "--shard-by",
+            "directory",
+        ]
+        main(args)
+        tests_shard = sample_project / "docs" / "source_tree" / "tests"
+        assert (tests_shard / "index.rst").exists()
+        assert "toctree" in out.read_text(encoding="utf-8")
+
+        (sample_project / "tests" / "test_app.py").unlink()
+        main(args)
+        assert not (tests_shard / "index.rst").exists()
+        assert (sample_project / "docs" / "source_tree" / "src").is_dir()
+
+    def test_outputs_are_not_collected(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        args = [
+            "--project-root",
+            str(sample_project),
+            "--output",
+            str(out),
+            "--ignore",
+            "__pycache__",
+            "--shard-by",
+            "directory",
+        ]
+        main(args)
+        first = {
+            path: path.read_text(encoding="utf-8")
+            for path in (sample_project / "docs").rglob("*.rst")
+        }
+        main(args)
+        second = {
+            path: path.read_text(encoding="utf-8")
+            for path in (sample_project / "docs").rglob("*.rst")
+        }
+        assert second == first
+        assert "source_tree.rst" not in first[out]
+        shard = out.with_suffix("") / "docs" / "index.rst"
+        assert "index.rst" in first[shard]
+        assert not (out.with_suffix("") / "docs" / "source_tree").exists()
+
+    def test_shard_by_from_pyproject(self, sample_project):
+        (sample_project / "pyproject.toml").write_text(
+            textwrap.dedent(f"""\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__", "docs"]
+                extensions = [".py"]
+                shard-by = "file"
+                output = "{sample_project}/docs/tree.rst"
+            """),
+            encoding="utf-8",
+        )
+        main(["--project-root", str(sample_project)])
+        assert (
+            sample_project / "docs" / "tree" / "src" / "utils.py.rst"
+        ).exists()
+
+    def test_sphinx_build_with_shards(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _sphinx_project(tmp_path)
+        with (project / "pyproject.toml").open("a", encoding="utf-8") as fh:
+            fh.write('shard-by = "directory"\n')
+        app = _sphinx_build(project)
+        assert "source_tree/src/index" in app.env.all_docs
+        deps = {
+            str(dep) for dep in app.env.dependencies["source_tree/src/index"]
+        }
+        assert any(dep.endswith("app.py") for dep in deps)
+
+
+# ----------------------------------------------------------------------------
+# text / markdown bundles
+# ----------------------------------------------------------------------------
+
+
+class TestBundle:
+    """Tests for the Sphinx-free ``text`` and ``markdown`` bundles."""
+
+    LINES = ["one\n", "# begin\n", "two\n", "# end\n", "three\n"]
+
+    def test_select_lines_markers(self):
+        from sphinx_source_tree import _select_lines
+
+        assert _select_lines(self.LINES, {"start-after": "# begin"}) == [
+            "two\n",
+            "# end\n",
+            "three\n",
+        ]
+        assert _select_lines(self.LINES, {"start-at": "# begin"})[0] == (
+            "# begin\n"
+        )
+        assert _select_lines(self.LINES, {"end-before": "# end"}) == [
+            "one\n",
+            "# begin\n",
+            "two\n",
+        ]
+        assert _select_lines(self.LINES, {"end-at": "two"})[-1] == "two\n"
+        assert _select_lines(
+            self.LINES, {"start-after": "# begin", "end-before": "# end"}
+        ) == ["two\n"]
+
+    def test_select_lines_end_before_ignores_first_line(self):
+        from sphinx_source_tree import _select_lines
+
+        lines = ["# end\n", "a\n", "# end\n"]
+        assert _select_lines(lines, {"end-before": "# end"}) == [
+            "# end\n",
+            "a\n",
+        ]
+
+    def test_select_lines_line_spec(self):
+        from sphinx_source_tree import _select_lines
+
+        assert _select_lines(self.LINES, {"lines": "1, 3-4"}) == [
+            "one\n",
+            "two\n",
+            "# end\n",
+        ]
+        assert _select_lines(self.LINES, {"lines": "4-"}) == [
+            "# end\n",
+            "three\n",
+        ]
+        assert _select_lines(self.LINES, {"lines": "-2"}) == [
+            "one\n",
+            "# begin\n",
+        ]
+
+    def test_select_lines_errors(self):
+        from sphinx_source_tree import _select_lines
+
+        with pytest.raises(ValueError, match="start-after"):
+            _select_lines(self.LINES, {"start-after": "missing"})
+        with pytest.raises(ValueError, match="invalid line number spec"):
+            _select_lines(self.LINES, {"lines": "3-1"})
+        with pytest.raises(ValueError, match="no lines"):
+            _select_lines(self.LINES, {"lines": "10-12"})
+
+    def test_text_bundle_inlines_contents(self, sample_project):
+        bundle = generate_bundle(
+            sample_project, ignore=["__pycache__"], extensions=[".py"]
+        )
+        assert bundle.startswith("Project source-tree\n")
+        assert "\u251c\u2500\u2500 src" in bundle
+        assert "File: src/app.py\n" in bundle
+        assert "print('hello')\n" in bundle
+        assert "literalinclude" not in bundle
+
+    def test_bundle_output_is_not_collected(self, sample_project):
+        out = sample_project / "llms.txt"
+        for _ in range(2):
+            bundle = generate_bundle(
+                sample_project,
+                output=out,
+                ignore=["__pycache__"],
+                extensions=[".py", ".txt"],
+            )
+            out.write_text(bundle, encoding="utf-8")
+        assert "llms.txt" not in bundle
+        assert "File: src/app.py\n" in bundle
+
+    def test_cli_bundle_output_is_not_collected(self, sample_project):
+        out = sample_project / "llms.txt"
+        args = [
+            "--project-root",
+            str(sample_project),
+            "--output",
+            str(out),
+            "--format",
+            "text",
+            "--extensions",
+            ".py",
+            ".txt",
+        ]
+        main(args)
+        main(args)
+        assert "llms.txt" not in out.read_text(encoding="utf-8")
+
+    def test_markdown_bundle_fences_contents(self, sample_project):
+        (sample_project / "src" / "fence.md").write_text(
+            "```py\nx = 1\n```", encoding="utf-8"
+        )
+        bundle = generate_bundle(
+            sample_project,
+            fmt="markdown",
+            ignore=["__pycache__"],
+            extensions=[".py", ".md"],
+        )
+        assert "## src/app.py\n\n```python\nprint('hello')\n```\n" in bundle
+        assert "````markdown\n```py\nx = 1\n```\n````" in bundle
+
+    def test_bundle_honours_file_options(self, sample_project):
+        (sample_project / "src" / "app.py").write_text(
+            "keep = 1\n# *** Tests ***\ndrop = 2\n", encoding="utf-8"
+        )
+        bundle = generate_bundle(
+            sample_project,
+            ignore=["__pycache__"],
+            extensions=[".py"],
+            file_options={"src/app.py": {"end-before": "# *** Tests ***"}},
+        )
+        assert "File: src/app.py [end-before: # *** Tests ***]" in bundle
+        assert "keep = 1" in bundle
+        assert "drop = 2" not in bundle
+
+    def test_missing_marker_warns_and_includes_file(
+        self, sample_project, capsys
+    ):
+        bundle = generate_bundle(
+            sample_project,
+            ignore=["__pycache__"],
+            extensions=[".py"],
+            file_options={"src/app.py": {"start-after": "# nowhere"}},
+        )
+        assert "print('hello')" in bundle
+        assert "start-after pattern not found" in capsys.readouterr().err
+
+    def test_main_writes_bundle(self, sample_project):
+        out = sample_project / "llms-full.txt"
+        main(
+            [
+                "--project-root",
+                str(sample_project),
+                "--output",
+                str(out),
+                "--format",
+                "text",
+                "--ignore",
+                "__pycache__",
+            ]
+        )
+        content = out.read_text(encoding="utf-8")
+        assert "File: docs/index.rst" in content
+        assert "Title\n=====" in content
+
+    def test_invalid_format_in_pyproject_errors(self, sample_project):
+        (sample_project / "pyproject.toml").write_text(
+            '[tool.sphinx-source-tree]\nformat = "pdf"\n', encoding="utf-8"
+        )
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(sample_project), "--stdout"])
+
+
+# ----------------------------------------------------------------------------
+# Renderers
+# ----------------------------------------------------------------------------
+
+
+class TestRenderers:
+    """Tests for ``collect_listing()`` and the renderer registry."""
+
+    def test_rst_renderer_matches_generate(self, sample_project):
+        out = sample_project / "docs" / "source_tree.rst"
+        listing = collect_listing(sample_project, ignore=["__pycache__"])
+        assert RENDERERS["rst"](listing, out) == generate(
+            sample_project, out, ignore=["__pycache__"]
+        )
+
+    def test_myst_renderer(self, sample_project):
+        out = sample_project / "docs" / "source_tree.md"
+        listing = collect_listing(
+            sample_project,
+            ignore=["__pycache__"],
+            extensions=[".py"],
+            linenos=True,
+            file_options={"src/app.py": {"lines": "1"}},
+        )
+        myst = RENDERERS["myst"](listing, out)
+        assert myst.startswith("# Project source-tree\n")
+        assert "```{code-block} text\n" in myst
+        assert (
+            "## src/app.py\n\n```{literalinclude} ../src/app.py\n"
+            ":language: python\n:caption: src/app.py\n:linenos:\n"
+            ":lines: 1\n```\n"
+        ) in myst
+        assert ".. literalinclude::" not in myst
+
+    def test_register_renderer(self, sample_project, monkeypatch):
+        import sphinx_source_tree
+
+        monkeypatch.setattr(sphinx_source_tree, "RENDERERS", dict(RENDERERS))
+        monkeypatch.setattr(
+            sphinx_source_tree,
+            "RENDERER_SUFFIXES",
+            dict(sphinx_source_tree.RENDERER_SUFFIXES),
+        )
+        sphinx_source_tree.register_renderer(
+            "count",
+            lambda listing, output: f"{len(listing.files)} files\n",
+            ".count",
+        )
+        out = sample_project / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(sample_project),
+                "--output",
+                str(out),
+                "--format",
+                "rst",
+                "count",
+                "--ignore",
+                "__pycache__",
+            ]
+        )
+        assert out.read_text(encoding="utf-8").startswith("Project")
+        assert (sample_project / "tree.count").read_text(
+            encoding="utf-8"
+        ) == "6 files\n"
+
+    def test_multiple_formats_share_one_scan(self, sample_project, monkeypatch):
+        import sphinx_source_tree
+
+        calls = []
+        real_scan = sphinx_source_tree.scan_project
+
+        def counting_scan(*args, **kwargs):
+            calls.append(args)
+            return real_scan(*args, **kwargs)
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", counting_scan)
+        out = sample_project / "docs" / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(sample_project),
+                "--output",
+                str(out),
+                "--format",
+                "rst",
+                "myst",
+                "text",
+                "--ignore",
+                "__pycache__",
+            ]
+        )
+        assert len(calls) == 1
+        assert "literalinclude::" in out.read_text(encoding="utf-8")
+        assert "{literalinclude}" in (
+            sample_project / "docs" / "tree.md"
+        ).read_text(encoding="utf-8")
+        assert "print('hello')" in (
+            sample_project / "docs" / "tree.txt"
+        ).read_text(encoding="utf-8")
+
+    def test_format_outputs_override_paths(self, sample_project):
+        (sample_project / "pyproject.toml").write_text(
+            textwrap.dedent(
+                """\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__"]
+                output = "docs/tree.rst"
+                format = ["myst", "markdown"]
+
+                [tool.sphinx-source-tree.format-outputs]
+                markdown = "llms-full.md"
+                """
+            ),
+            encoding="utf-8",
+        )
+        cwd = os.getcwd()
+        os.chdir(sample_project)
+        try:
+            main([])
+        finally:
+            os.chdir(cwd)
+        assert (sample_project / "docs" / "tree.md").exists()
+        assert "```python\nprint('hello')" in (
+            sample_project / "llms-full.md"
+        ).read_text(encoding="utf-8")
+
+    def test_colliding_format_paths_error(self, sample_project):
+        with pytest.raises(SystemExit):
+            main(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--format",
+                    "myst",
+                    "markdown",
+                    "--stdout",
+                ]
+            )
+
+
+# ----------------------------------------------------------------------------
+# Size limits
+# ----------------------------------------------------------------------------
+
+
+class TestSizeLimits:
+    """Tests for ``max-file-size`` / ``max-file-lines`` and ``oversize``."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        (sample_project / "fixtures.json").write_text(
+            "".join(f'{{"row": {i}}}\n' for i in range(1000)),
+            encoding="utf-8",
+        )
+        return sample_project
+
+    def test_parse_size(self):
+        from sphinx_source_tree import _parse_size
+
+        assert _parse_size(None) is None
+        assert _parse_size(123) == 123
+        assert _parse_size("500") == 500
+        assert _parse_size("2K") == 2048
+        assert _parse_size("1 MB") == 1024**2
+        with pytest.raises(ValueError, match="Invalid size"):
+            _parse_size("big")
+
+    def test_skip_by_size_adds_note(self, project):
+        rst = generate(
+            project,
+            project / "docs" / "source_tree.rst",
+            ignore=["__pycache__"],
+            max_file_size=1024,
+        )
+        assert "literalinclude:: ../fixtures.json" not in rst
+        assert "literalinclude:: ../src/app.py" in rst
+        assert ".. note::" in rst
+        assert "- ``fixtures.json``: skipped, 12.6 KB exceeds" in rst
+
+    def test_skip_by_lines(self, project):
+        listing = collect_listing(
+            project, ignore=["__pycache__"], max_file_lines=100
+        )
+        assert project / "fixtures.json" not in listing.files
+        assert listing.notes == [
+            ("fixtures.json", "skipped, more than 100 lines (max-file-lines)")
+        ]
+
+    def test_truncate_emits_lines_range(self, project):
+        rst = generate(
+            project,
+            project / "docs" / "source_tree.rst",
+            ignore=["__pycache__"],
+            max_file_size="1K",
+            max_file_lines=20,
+            oversize="truncate",
+        )
+        block = rst[rst.index("literalinclude:: ../fixtures.json") :]
+        assert "   :lines: 1-20\n" in block
+        assert "``fixtures.json``: truncated to 20 lines" in rst
+
+    def test_truncate_by_size_counts_whole_lines(self, project):
+        listing = collect_listing(
+            project,
+            ignore=["__pycache__"],
+            max_file_size=100,
+            oversize="truncate",
+        )
+        # The first rows are 11 bytes, so 9 complete lines fit in 100 bytes.
+        assert listing.options(project / "fixtures.json") == {"lines": "1-9"}
+
+    def test_truncate_skips_file_whose_first_line_is_too_big(self, project):
+        (project / "app.min.js").write_text("var a=1;" * 500, encoding="utf-8")
+        listing = collect_listing(
+            project,
+            ignore=["__pycache__"],
+            max_file_size=100,
+            oversize="truncate",
+        )
+        assert project / "app.min.js" not in listing.files
+        note = dict(listing.notes)["app.min.js"]
+        assert note.startswith("skipped, 3.9 KB exceeds max-file-size")
+        assert note.endswith("(even its first line)")
+
+    def test_exempt_and_explicit_lines_are_kept_in_full(self, project):
+        (project / "big.md").write_text("x\n" * 500, encoding="utf-8")
+        listing = collect_listing(
+            project,
+            ignore=["__pycache__"],
+            max_file_lines=10,
+            oversize_exempt=["*.json"],
+            file_options={"big.md": {"lines": "1-3"}},
+        )
+        assert project / "fixtures.json" in listing.files
+        assert project / "big.md" in listing.files
+        assert listing.notes == []
+
+    def test_bundle_respects_truncation(self, project):
+        bundle = generate_bundle(
+            project,
+            ignore=["__pycache__"],
+            max_file_lines=2,
+            oversize="truncate",
+        )
+        assert '{"row": 1}\n' in bundle
+        assert '{"row": 2}' not in bundle
+        assert "Note: Some files were left out" in bundle
+
+    def test_sizes_come_from_the_scan(self, project):
+        scan = scan_project(project, ["__pycache__"])
+        collect_listing(project, ignore=["__pycache__"], scan=scan)
+        assert scan.sizes == {}
+        collect_listing(
+            project, ignore=["__pycache__"], max_file_size=1024, scan=scan
+        )
+        assert scan.sizes["fixtures.json"] == (
+            (project / "fixtures.json").stat().st_size
+        )
+
+    def test_config_and_cli(self, project):
+        (project / "pyproject.toml").write_text(
+            textwrap.dedent(
+                """\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__"]
+                max-file-size = "4K"
+                """
+            ),
+            encoding="utf-8",
+        )
+        out = project / "docs" / "source_tree.rst"
+        main(["--project-root", str(project), "--output", str(out)])
+        assert "fixtures.json``: skipped" in out.read_text(encoding="utf-8")
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--oversize-exempt",
+                "fixtures.json",
+            ]
+        )
+        assert "../fixtures.json" in out.read_text(encoding="utf-8")
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "--max-file-size", "x"])
+
+    def test_directive_options(self, tmp_path):
+        pytest.importorskip("sphinx")
+        project = _directive_project(
+            tmp_path,
+            {
+                "api": (
+                    ".. source-tree::\n"
+                    "   :max-file-lines: 0\n"
+                    "   :extensions: .py\n"
+                ),
+            },
+        )
+        _sphinx_build(project)
+        text = (project / "docs" / "_build" / "text" / "api.txt").read_text(
+            encoding="utf-8"
+        )
+        assert "Some files were left out" in text
+        assert "print('hello')" not in text
+
+
+# ----------------------------------------------------------------------------
+# Token budget
+# ----------------------------------------------------------------------------
+
+
+def _count_lines_as_tokens(text: str) -> int:
+    """Token counter used by the ``module:function`` tests."""
+    return len(text.splitlines())
+
+
+class TestTokenBudget:
+    """Tests for ``token-budget`` selection."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / "a.py").write_text("a" * 400, encoding="utf-8")
+        (tmp_path / "b.py").write_text("b" * 400, encoding="utf-8")
+        (tmp_path / "c.py").write_text("c" * 40, encoding="utf-8")
+        return tmp_path
+
+    def test_estimate_tokens(self):
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("abcd") == 1
+        assert estimate_tokens("abcde") == 2
+
+    def test_greedy_selection_in_listing_order(self, project, capsys):
+        listing = collect_listing(project, token_budget=150)
+        assert [fp.name for fp in listing.files] == ["a.py", "c.py"]
+        assert listing.notes == [
+            ("b.py", "dropped, ~100 tokens do not fit token-budget (150)")
+        ]
+        assert "110 of 150 tokens used by 2 files" in capsys.readouterr().err
+
+    def test_order_and_weights_set_priority(self, project):
+        listing = collect_listing(project, token_budget=150, order=["b.py"])
+        assert [fp.name for fp in listing.files] == ["b.py", "c.py"]
+        listing = collect_listing(
+            project, token_budget=105, token_weights={"b.*": 2, "c.py": 0}
+        )
+        assert [fp.name for fp in listing.files] == ["b.py"]
+        assert [rel for rel, _ in listing.notes] == ["a.py", "c.py"]
+
+    def test_estimates_honour_file_options(self, project):
+        (project / "a.py").write_text("x = 1\n" * 100, encoding="utf-8")
+        listing = collect_listing(
+            project,
+            token_budget=120,
+            file_options={"a.py": {"lines": "1-2"}},
+        )
+        assert project / "a.py" in listing.files
+
+    def test_pluggable_counter(self, project):
+        listing = collect_listing(
+            project,
+            token_budget=2,
+            token_counter=lambda text: 1,
+        )
+        assert len(listing.files) == 2
+        listing = collect_listing(
+            project,
+            token_budget=2,
+            token_counter="test_sphinx_source_tree:_count_lines_as_tokens",
+        )
+        assert len(listing.files) == 2
+        with pytest.raises(ValueError, match="Invalid token-counter"):
+            collect_listing(project, token_budget=2, token_counter="nope")
+        with pytest.raises(ValueError, match="Cannot load"):
+            collect_listing(project, token_budget=2, token_counter="os:nope")
+
+    def test_estimates_are_cached(self, project, tmp_path_factory):
+        cache_dir = tmp_path_factory.mktemp("tokens")
+        calls = []
+
+        def counter(text):
+            calls.append(text)
+            return len(text)
+
+        collect_listing(
+            project, token_budget=10, token_counter=counter, cache_dir=cache_dir
+        )
+        assert len(calls) == 3
+        assert (cache_dir / "tokens.json").exists()
+        collect_listing(
+            project, token_budget=10, token_counter=counter, cache_dir=cache_dir
+        )
+        assert len(calls) == 3
+        (project / "c.py").write_text("changed", encoding="utf-8")
+        collect_listing(
+            project, token_budget=10, token_counter=counter, cache_dir=cache_dir
+        )
+        assert calls[-1] == "changed"
+        assert len(calls) == 4
+        # Estimates follow the content, not the path or mtime.
+        os.utime(project / "c.py", (1_000_000_000, 1_000_000_000))
+        (project / "d.py").write_text("changed", encoding="utf-8")
+        collect_listing(
+            project, token_budget=10, token_counter=counter, cache_dir=cache_dir
+        )
+        assert len(calls) == 4
+
+    def test_caches_drop_deleted_files(self, project, tmp_path_factory):
+        import json
+
+        cache_dir = tmp_path_factory.mktemp("caches")
+        (project / "d.py").write_text("", encoding="utf-8")
+        (project / "e.py").write_text("", encoding="utf-8")
+        kwargs = {
+            "token_budget": 10,
+            "dedupe": True,
+            "skip_generated": True,
+            "cache_dir": cache_dir,
+        }
+        collect_listing(project, **kwargs)
+        (project / "d.py").unlink()
+        collect_listing(project, **kwargs)
+        gone = str(project / "d.py")
+        for name in ("tokens", "sniff", "classify", "hashes"):
+            data = json.loads((cache_dir / f"{name}.json").read_text("utf-8"))
+            assert data, name
+            assert not any(key.startswith(gone) for key in data), name
+
+    def test_cli(self, project):
+        out = project / "llms.txt"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--format",
+                "text",
+                "--token-budget",
+                "120",
+            ]
+        )
+        content = out.read_text(encoding="utf-8")
+        assert "File: a.py" in content
+        assert "File: b.py" not in content
+        assert "  - b.py: dropped" in content
+
+
+# ----------------------------------------------------------------------------
+# Sniffing
+# ----------------------------------------------------------------------------
+
+
+class TestSniffing:
+    """Tests for binary and encoding detection."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        import gzip
+
+        (tmp_path / "data.json").write_bytes(gzip.compress(b'{"a": 1}'))
+        (tmp_path / "legacy.rst").write_bytes("Caf\xe9\n".encode("latin-1"))
+        (tmp_path / "wide.md").write_bytes("hi\n".encode("utf-16"))
+        (tmp_path / "bom.py").write_bytes(b"\xef\xbb\xbfx = 1\n")
+        (tmp_path / "plain.py").write_text("y = '\u00e9'\n", encoding="utf-8")
+        return tmp_path
+
+    def test_sniff_file(self, project):
+        from sphinx_source_tree import _sniff_file
+
+        assert _sniff_file(project / "data.json") == "binary"
+        assert _sniff_file(project / "legacy.rst") == "latin-1"
+        assert _sniff_file(project / "wide.md") == "utf-16"
+        assert _sniff_file(project / "bom.py") == ""
+        assert _sniff_file(project / "plain.py") == ""
+
+    def test_multibyte_char_cut_at_head_boundary(self, tmp_path, monkeypatch):
+        import sphinx_source_tree
+        from sphinx_source_tree import _sniff_file
+
+        monkeypatch.setattr(sphinx_source_tree, "SNIFF_BYTES", 4)
+        (tmp_path / "cut.py").write_text("abc\u00e9", encoding="utf-8")
+        assert _sniff_file(tmp_path / "cut.py") == ""
+
+    def test_generate_skips_binary_and_sets_encoding(self, project):
+        rst = generate(project, project / "docs" / "tree.rst")
+        assert "../data.json" not in rst
+        assert "``data.json``: skipped, binary content" in rst
+        block = rst[rst.index("literalinclude:: ../legacy.rst") :]
+        assert block.splitlines()[3] == "   :encoding: latin-1"
+        assert ":encoding: utf-16" in rst
+        assert rst.count(":encoding:") == 2
+
+    def test_bundle_decodes_with_sniffed_encoding(self, project):
+        bundle = generate_bundle(project)
+        assert "Caf\u00e9" in bundle
+        assert "File: legacy.rst [encoding: latin-1]" in bundle
+
+    def test_explicit_encoding_wins(self, project):
+        listing = collect_listing(
+            project, file_options={"legacy.rst": {"encoding": "cp1252"}}
+        )
+        assert listing.options(project / "legacy.rst") == {"encoding": "cp1252"}
+
+    def test_sniff_disabled(self, project):
+        listing = collect_listing(project, sniff=False)
+        assert project / "data.json" in listing.files
+        assert listing.options(project / "legacy.rst") == {}
+
+    def test_results_are_cached(self, project, monkeypatch):
+        import sphinx_source_tree
+
+        collect_listing(project)
+        calls = []
+        real_sniff = sphinx_source_tree._sniff_file
+
+        def counting_sniff(fp):
+            calls.append(fp)
+            return real_sniff(fp)
+
+        monkeypatch.setattr(sphinx_source_tree, "_sniff_file", counting_sniff)
+        collect_listing(project)
+        assert calls == []
+        (project / "plain.py").write_text("changed = 1\n", encoding="utf-8")
+        collect_listing(project)
+        assert calls == [project / "plain.py"]
+
+    def test_cli_no_sniff(self, project):
+        out = project / "docs" / "tree.rst"
+        main(["--project-root", str(project), "--output", str(out)])
+        assert "../data.json" not in out.read_text(encoding="utf-8")
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--no-sniff",
+            ]
+        )
+        assert "../data.json" in out.read_text(encoding="utf-8")
+
+
+# ----------------------------------------------------------------------------
+# Generated-content classifier
+# ----------------------------------------------------------------------------
+
+
+class TestGeneratedClassifier:
+    """Tests for ``skip-generated``."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / "package-lock.json").write_text("{}\n", encoding="utf-8")
+        (tmp_path / "api_pb2.py").write_text("x = 1\n", encoding="utf-8")
+        (tmp_path / "app.min.js").write_text("a()\n", encoding="utf-8")
+        (tmp_path / "bundle.js").write_text(
+            "var a=1;" * 200 + "\n", encoding="utf-8"
+        )
+        (tmp_path / "schema.py").write_text(
+            "# Code generated by sqlc. DO NOT EDIT.\nx = 1\n",
+            encoding="utf-8",
+        )
+        (tmp_path / "app.py").write_text(
+            "def main():\n    return 1\n" * 50, encoding="utf-8"
+        )
+        return tmp_path
+
+    def test_classify_file(self, project):
+        from sphinx_source_tree import _classify_file
+
+        assert _classify_file(project / "package-lock.json") == "lock file"
+        assert _classify_file(project / "api_pb2.py") == "generated file"
+        assert _classify_file(project / "app.min.js") == "minified file"
+        assert _classify_file(project / "bundle.js").startswith(
+            "minified content"
+        )
+        assert _classify_file(project / "schema.py").startswith("generated")
+        assert _classify_file(project / "app.py") == ""
+
+    def test_opt_in_and_logged(self, project, capsys):
+        assert len(collect_listing(project).files) == 6
+        listing = collect_listing(project, skip_generated=True)
+        assert [fp.name for fp in listing.files] == ["app.py"]
+        assert ("package-lock.json", "skipped, lock file") in listing.notes
+        assert "Skipping bundle.js: minified content" in (
+            capsys.readouterr().err
+        )
+
+    def test_exempt(self, project):
+        listing = collect_listing(
+            project,
+            skip_generated=True,
+            generated_exempt=["*.min.js", "bundle.js"],
+        )
+        assert {fp.name for fp in listing.files} == {
+            "app.py",
+            "app.min.js",
+            "bundle.js",
+        }
+
+    def test_classification_is_cached(self, project, monkeypatch):
+        import sphinx_source_tree
+
+        collect_listing(project, skip_generated=True)
+        monkeypatch.setattr(
+            sphinx_source_tree,
+            "_classify_file",
+            lambda fp: pytest.fail(f"re-classified {fp}"),
+        )
+        listing = collect_listing(project, skip_generated=True)
+        assert [fp.name for fp in listing.files] == ["app.py"]
+
+    def test_cli(self, project):
+        out = project / "docs" / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--skip-generated",
+            ]
+        )
+        rst = out.read_text(encoding="utf-8")
+        assert "../app.py" in rst
+        assert "../schema.py" not in rst
+
+
+# ----------------------------------------------------------------------------
+# Deduplication
+# ----------------------------------------------------------------------------
+
+
+class TestDedupe:
+    """Tests for ``dedupe``."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        for pkg in ("a", "b", "c"):
+            (tmp_path / pkg).mkdir()
+            (tmp_path / pkg / "__init__.py").write_text(
+                "# boilerplate\n", encoding="utf-8"
+            )
+        (tmp_path / "c" / "__init__.py").write_text(
+            "# different!!\n", encoding="utf-8"
+        )
+        (tmp_path / "a" / "core.py").write_text("x = 1\n", encoding="utf-8")
+        return tmp_path
+
+    def test_hash_file_uses_mmap_for_large_files(self, tmp_path, monkeypatch):
+        import sphinx_source_tree
+        from sphinx_source_tree import _hash_file
+
+        (tmp_path / "big").write_bytes(b"x" * 100)
+        (tmp_path / "empty").write_bytes(b"")
+        small = _hash_file(tmp_path / "big")
+        monkeypatch.setattr(sphinx_source_tree, "HASH_MMAP_THRESHOLD", 10)
+        assert _hash_file(tmp_path / "big") == small
+        assert _hash_file(tmp_path / "empty") != small
+
+    def test_duplicates_reference_the_first_copy(self, project):
+        listing = collect_listing(project, dedupe=True)
+        assert listing.duplicates == {
+            project / "b" / "__init__.py": project / "a" / "__init__.py"
+        }
+        rst = RENDERERS["rst"](listing, project / "docs" / "tree.rst")
+        assert rst.count("literalinclude::") == 3
+        assert (
+            "b/__init__.py\n-------------\n\nIdentical to ``a/__init__.py``."
+            in (rst)
+        )
+        myst = RENDERERS["myst"](listing, project / "docs" / "tree.md")
+        assert "Identical to `a/__init__.py`." in myst
+        text = RENDERERS["text"](listing, project / "tree.txt")
+        assert text.count("# boilerplate") == 1
+        assert "(identical to a/__init__.py)" in text
+
+    def test_different_file_options_are_not_merged(self, project):
+        listing = collect_listing(
+            project,
+            dedupe=True,
+            file_options={"b/__init__.py": {"lines": "1"}},
+        )
+        assert listing.duplicates == {}
+
+    def test_off_by_default_and_only_same_size_hashed(
+        self, project, monkeypatch
+    ):
+        import sphinx_source_tree
+
+        assert collect_listing(project).duplicates == {}
+        hashed = []
+        real_hash = sphinx_source_tree._hash_file
+
+        def counting_hash(fp):
+            hashed.append(fp.relative_to(project).as_posix())
+            return real_hash(fp)
+
+        monkeypatch.setattr(sphinx_source_tree, "_hash_file", counting_hash)
+        collect_listing(project, dedupe=True)
+        assert sorted(hashed) == [
+            "a/__init__.py",
+            "b/__init__.py",
+            "c/__init__.py",
+        ]
+        hashed.clear()
+        collect_listing(project, dedupe=True)
+        assert hashed == []
+
+    def test_token_budget_keeps_duplicates_with_original(self, project):
+        listing = collect_listing(
+            project, dedupe=True, token_budget=8, order=["a/core.py"]
+        )
+        assert [listing.rel(fp) for fp in listing.files] == [
+            "a/core.py",
+            "a/__init__.py",
+            "b/__init__.py",
+        ]
+        listing = collect_listing(
+            project, dedupe=True, token_budget=2, order=["a/core.py"]
+        )
+        assert (
+            "b/__init__.py",
+            "dropped along with identical a/__init__.py",
+        ) in (listing.notes)
+
+    def test_cli(self, project):
+        out = project / "docs" / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--dedupe",
+            ]
+        )
+        assert "Identical to ``a/__init__.py``" in out.read_text(
+            encoding="utf-8"
+        )
+
+
+# ----------------------------------------------------------------------------
+# Range validation
+# ----------------------------------------------------------------------------
+
+
+class TestRangeValidation:
+    """Tests for early ``file-options`` marker and range checks."""
+
+    TEXTS = [
+        "a\n# begin\nb\n# end\nc\n",
+        "# end\na\n# end\n",
+        "no newline",
+        "",
+        "a\nb\n# begin # end\nc\n# end\n",
+    ]
+    OPTIONS = [
+        {"start-after": "# begin"},
+        {"start-at": "# begin"},
+        {"end-before": "# end"},
+        {"end-at": "# end"},
+        {"start-after": "# begin", "end-before": "# end"},
+        {"start-at": "# begin", "end-at": "# end"},
+        {"lines": "2-3"},
+        {"start-after": "# begin", "lines": "1"},
+        {"lines": "5-"},
+    ]
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / "app.py").write_text(
+            "import os\n# begin\nx = 1\n# end\n", encoding="utf-8"
+        )
+        (tmp_path / "utils.py").write_text("y = 2\n", encoding="utf-8")
+        return tmp_path
+
+    def test_mmap_search_matches_text_semantics(self, tmp_path):
+        from sphinx_source_tree import _resolve_range, _select_indices
+
+        def outcome(func, *args):
+            try:
+                return func(*args)
+            except ValueError as exc:
+                return str(exc)
+
+        for index, text in enumerate(self.TEXTS):
+            fp = tmp_path / f"f{index}.txt"
+            fp.write_text(text, encoding="utf-8")
+            lines = text.splitlines(keepends=True)
+            for options in self.OPTIONS:
+                assert outcome(_resolve_range, fp, options) == outcome(
+                    _select_indices, lines, options
+                ), (text, options)
+
+    def test_format_line_spec(self):
+        from sphinx_source_tree import _format_line_spec
+
+        assert _format_line_spec([0, 1, 2, 5, 7, 8]) == "1-3,6,8-9"
+        assert _format_line_spec([3]) == "4"
+
+    def test_all_problems_reported_at_once(self, project, capsys):
+        file_options = {
+            "app.py": {"start-after": "# nowhere"},
+            "utils.py": {"lines": "4-5"},
+        }
+        rst = generate(project, project / "tree.rst", file_options=file_options)
+        assert ":start-after: # nowhere" in rst
+        err = capsys.readouterr().err
+        assert "file-options do not match 2 file(s)" in err
+        assert "app.py: start-after pattern not found: # nowhere" in err
+        assert "utils.py: line spec '4-5': no lines pulled" in err
+
+        with pytest.raises(ValueError, match="2 file") as exc_info:
+            collect_listing(
+                project,
+                file_options=file_options,
+                strict_file_options=True,
+            )
+        assert "utils.py" in str(exc_info.value)
+
+    def test_resolve_lines(self, project):
+        listing = collect_listing(
+            project,
+            file_options={
+                "app.py": {"start-after": "# begin", "end-before": "# end"},
+                "utils.py": {"lines": "1"},
+            },
+            resolve_lines=True,
+        )
+        assert listing.options(project / "app.py") == {"lines": "3"}
+        assert listing.options(project / "utils.py") == {"lines": "1"}
+
+    def test_cli_strict_errors(self, project):
+        (project / "pyproject.toml").write_text(
+            textwrap.dedent(
+                """\
+                [tool.sphinx-source-tree.file-options]
+                "app.py" = {"end-before" = "# gone"}
+                """
+            ),
+            encoding="utf-8",
+        )
+        with pytest.raises(SystemExit):
+            main(
+                [
+                    "--project-root",
+                    str(project),
+                    "--stdout",
+                    "--strict-file-options",
+                ]
+            )
+
+
+# ----------------------------------------------------------------------------
+# Chunking
+# ----------------------------------------------------------------------------
+
+
+class TestChunking:
+    """Tests for ``chunk-lines``."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        source = "import os\n\n"
+        for n in range(4):
+            source += f"@decorator\ndef func_{n}():\n    return {n}\n\n"
+        # 18 lines: import at 1, decorators at 3, 7, 11, 15
+        (tmp_path / "mod.py").write_text(source, encoding="utf-8")
+        (tmp_path / "notes.md").write_text(
+            "".join(f"line {n}\n" for n in range(1, 13)), encoding="utf-8"
+        )
+        (tmp_path / "short.md").write_text("hi\n", encoding="utf-8")
+        return tmp_path
+
+    def test_chunk_ranges(self):
+        from sphinx_source_tree import _chunk_ranges
+
+        assert _chunk_ranges(12, 5, []) == [(1, 5), (6, 10), (11, 12)]
+        assert _chunk_ranges(10, 5, []) == [(1, 5), (6, 10)]
+        assert _chunk_ranges(12, 5, [1, 4, 9]) == [(1, 3), (4, 8), (9, 12)]
+        assert _chunk_ranges(12, 5, [1, 6]) == [(1, 5), (6, 10), (11, 12)]
+
+    @pytest.mark.parametrize("chunk_lines", [0, -1])
+    def test_chunk_lines_below_one_rejected(self, project, chunk_lines):
+        with pytest.raises(ValueError, match="chunk-lines"):
+            collect_listing(project, chunk_lines=chunk_lines)
+        with pytest.raises(SystemExit):
+            main(
+                [
+                    "--project-root",
+                    str(project),
+                    "--stdout",
+                    "--chunk-lines",
+                    str(chunk_lines),
+                ]
+            )
+
+    def test_top_level_starts_include_decorators(self, project):
+        from sphinx_source_tree import _top_level_starts
+
+        assert _top_level_starts(project / "mod.py", {}) == [1, 3, 7, 11, 15]
+        (project / "broken.py").write_text("def (:\n", encoding="utf-8")
+        assert _top_level_starts(project / "broken.py", {}) == []
+
+    def test_rst_chunks_get_subheadings(self, project):
+        rst = generate(project, project / "tree.rst", chunk_lines=5)
+        assert (
+            "notes.md (lines 6-10)\n~~~~~~~~~~~~~~~~~~~~~\n\n"
+            ".. literalinclude:: notes.md\n"
+            "   :language: markdown\n"
+            "   :caption: notes.md (lines 6-10)\n"
+            "   :lines: 6-10\n"
+        ) in rst
+        assert "notes.md (lines 11-12)" in rst
+        assert "short.md (lines" not in rst
+
+    def test_snap_to_python_definitions(self, project):
+        listing = collect_listing(project, chunk_lines=6, chunk_snap=True)
+        assert listing.chunks[project / "mod.py"] == [
+            (1, 6),
+            (7, 10),
+            (11, 14),
+            (15, 18),
+        ]
+        listing = collect_listing(project, chunk_lines=6)
+        assert listing.chunks[project / "mod.py"] == [
+            (1, 6),
+            (7, 12),
+            (13, 18),
+        ]
+
+    def test_files_with_ranges_are_not_chunked(self, project):
+        listing = collect_listing(
+            project,
+            chunk_lines=5,
+            file_options={"notes.md": {"start-after": "line 2"}},
+        )
+        assert project / "notes.md" not in listing.chunks
+
+    def test_bundles_and_myst(self, project):
+        bundle = generate_bundle(project, chunk_lines=5)
+        assert "File: notes.md (lines 11-12)\n" in bundle
+        section = bundle[bundle.index("File: notes.md (lines 6-10)") :]
+        assert section.split(BUNDLE_RULE)[1] == (
+            "\nline 6\nline 7\nline 8\nline 9\nline 10\n\n"
+        )
+        listing = collect_listing(project, chunk_lines=5)
+        myst = RENDERERS["myst"](listing, project / "tree.md")
+        assert "### notes.md (lines 1-5)\n\n```{literalinclude} notes.md" in (
+            myst
+        )
+
+    def test_cli(self, project):
+        out = project / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--chunk-lines",
+                "6",
+                "--chunk-snap",
+            ]
+        )
+        assert ":lines: 7-10" in out.read_text(encoding="utf-8")
+
+
+# ----------------------------------------------------------------------------
+# Python skeletons
+# ----------------------------------------------------------------------------
+
+
+class TestPythonSkeleton:
+    """Tests for ``python-mode = "skeleton"``."""
+
+    SOURCE = textwrap.dedent(
+        '''\
+        """Module docstring."""
+
+        import os
+        from pathlib import Path
+
+        __all__ = ["Greeter", "greet"]
+
+        CONSTANT = os.sep
+
+
+        @dataclass
+        class Greeter(Base):
+            """Say hello."""
+
+            name: str = "world"
+
+            def greet(self, loud: bool = False) -> str:
+                """Return the greeting."""
+                message = f"hello {self.name}"
+                return message.upper() if loud else message
+
+
+        async def greet(name: str, *args, **kwargs) -> None:
+            print(name)
+        '''
+    )
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / "pkg").mkdir()
+        (tmp_path / "pkg" / "mod.py").write_text(self.SOURCE, encoding="utf-8")
+        (tmp_path / "broken.py").write_text("def (:\n", encoding="utf-8")
+        (tmp_path / "notes.md").write_text("# Notes\n", encoding="utf-8")
+        return tmp_path
+
+    def test_skeleton(self):
+        from sphinx_source_tree import _python_skeleton
+
+        assert _python_skeleton(self.SOURCE.encode()) == textwrap.dedent(
+            '''\
+            """Module docstring."""
+            import os
+            from pathlib import Path
+            __all__ = ['Greeter', 'greet']
+
+            @dataclass
+            class Greeter(Base):
+                """Say hello."""
+                name: str = 'world'
+
+                def greet(self, loud: bool=False) -> str:
+                    """Return the greeting."""
+                    ...
+
+            async def greet(name: str, *args, **kwargs) -> None:
+                ...
+            '''
+        )
+        assert _python_skeleton(b"def (:\n") is None
+        assert _python_skeleton(b"class Empty:\n    x = 1\n") == (
+            "class Empty:\n    ...\n"
+        )
+
+    def test_includes_point_to_staged_skeletons(self, project, capsys):
+        rst = generate(
+            project, project / "docs" / "tree.rst", python_mode="skeleton"
+        )
+        staged = project / ".sphinx-source-tree" / "skeleton" / "pkg" / "mod.py"
+        assert "def greet(self, loud: bool=False) -> str:" in (
+            staged.read_text(encoding="utf-8")
+        )
+        assert (
+            ".. literalinclude:: ../.sphinx-source-tree/skeleton/pkg/mod.py\n"
+            "   :language: python\n"
+            "   :caption: pkg/mod.py\n"
+        ) in rst
+        # Unparsable files and other languages are included as they are.
+        assert ".. literalinclude:: ../broken.py\n" in rst
+        assert ".. literalinclude:: ../notes.md\n" in rst
+        assert "cannot parse broken.py" in capsys.readouterr().err
+        # The staging directory is never listed.
+        assert ".sphinx-source-tree" not in collect_listing(project).tree
+
+    def test_bundle_and_token_budget(self, project):
+        bundle = generate_bundle(project, python_mode="skeleton")
+        assert "message.upper()" not in bundle
+        assert "async def greet(name: str, *args, **kwargs) -> None:" in bundle
+        full = collect_listing(project, token_budget=10_000)
+        skeleton = collect_listing(
+            project, token_budget=10_000, python_mode="skeleton"
+        )
+        assert skeleton.files == full.files
+        assert len(generate_bundle(project, python_mode="skeleton")) < len(
+            generate_bundle(project)
+        )
+
+    def test_ranges_keep_full_source(self, project):
+        listing = collect_listing(
+            project,
+            python_mode="skeleton",
+            file_options={"pkg/mod.py": {"start-after": "import os"}},
+        )
+        assert listing.source(project / "pkg" / "mod.py") == (
+            project / "pkg" / "mod.py"
+        )
+
+    def test_skeletons_are_cached_by_content(self, project, monkeypatch):
+        import sphinx_source_tree
+
+        collect_listing(project, python_mode="skeleton")
+        (project / "copy.py").write_text(self.SOURCE, encoding="utf-8")
+
+        def fail(func, sources):
+            raise AssertionError(f"parsed {len(sources)} files again")
+
+        monkeypatch.setattr(sphinx_source_tree, "_process_map", fail)
+        # Same content under a new path, and broken.py cached as invalid.
+        listing = collect_listing(project, python_mode="skeleton")
+        assert project / "copy.py" in listing.staged
+        assert project / "broken.py" not in listing.staged
+        (project / "new.py").write_text("x = 1\n", encoding="utf-8")
+        with pytest.raises(AssertionError, match="parsed 1 files"):
+            collect_listing(project, python_mode="skeleton")
+
+    def test_skeleton_cache_keeps_one_entry_per_file(self, project, tmp_path):
+        import json
+
+        cache_dir = tmp_path / "cache"
+        mod = project / "pkg" / "mod.py"
+        collect_listing(project, python_mode="skeleton", cache_dir=cache_dir)
+        mod.write_text(self.SOURCE + "X = 1\n", encoding="utf-8")
+        collect_listing(project, python_mode="skeleton", cache_dir=cache_dir)
+        data = json.loads((cache_dir / "skeletons.json").read_text("utf-8"))
+        assert sorted(data) == sorted(
+            str(project / name) for name in ("pkg/mod.py", "broken.py")
+        )
+        (project / "broken.py").unlink()
+        collect_listing(project, python_mode="skeleton", cache_dir=cache_dir)
+        data = json.loads((cache_dir / "skeletons.json").read_text("utf-8"))
+        assert list(data) == [str(mod)]
+
+    def test_orphaned_staged_copies_are_removed(self, project):
+        (project / "pkg" / "other.py").write_text("x = 1\n", encoding="utf-8")
+        args = [
+            "--project-root",
+            str(project),
+            "--output",
+            str(project / "t.rst"),
+        ]
+        staging = project / ".sphinx-source-tree" / "skeleton"
+        main([*args, "--python-mode", "skeleton"])
+        assert (staging / "pkg" / "other.py").is_file()
+
+        (project / "pkg" / "other.py").unlink()
+        main([*args, "--python-mode", "skeleton"])
+        assert not (staging / "pkg" / "other.py").exists()
+        assert (staging / "pkg" / "mod.py").is_file()
+
+        main(args)
+        assert not (project / ".sphinx-source-tree").exists()
+
+    def test_process_pool(self, tmp_path, monkeypatch):
+        import sphinx_source_tree
+
+        monkeypatch.setattr(sphinx_source_tree, "PROCESS_POOL_MIN", 2)
+        for n in range(3):
+            (tmp_path / f"mod_{n}.py").write_text(
+                f"def f_{n}():\n    return {n}\n", encoding="utf-8"
+            )
+        listing = collect_listing(tmp_path, python_mode="skeleton")
+        assert (
+            listing.source(tmp_path / "mod_2.py").read_text(encoding="utf-8")
+            == "def f_2():\n    ...\n"
+        )
+
+    def test_invalid_mode_and_cli(self, project):
+        with pytest.raises(ValueError, match="Invalid python-mode"):
+            collect_listing(project, python_mode="bodies")
+        out = project / "tree.rst"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--python-mode",
+                "skeleton",
+            ]
+        )
+        assert ".sphinx-source-tree/skeleton/pkg/mod.py" in out.read_text(
+            encoding="utf-8"
+        )
+
+
+# ----------------------------------------------------------------------------
+# Content transforms
+# ----------------------------------------------------------------------------
+
+
+class TestTransforms:
+    """Tests for ``transforms``."""
+
+    @pytest.fixture
+    def project(self, tmp_path):
+        (tmp_path / "app.py").write_text(
+            "#!/usr/bin/env python\n"
+            "# Copyright (c) 2026 Example.\n"
+            "# All rights reserved.\n"
+            "\n"
+            "\n"
+            "\n"
+            "import os  # needed\n"
+            'URL = "http://example.com/#anchor"\n',
+            encoding="utf-8",
+        )
+        (tmp_path / "app.js").write_text(
+            "/*\n * License header.\n */\n"
+            'const url = "http://example.com"; // the url\n'
+            "const tpl = `a\n// kept`;\n",
+            encoding="utf-8",
+        )
+        (tmp_path / "conf.yaml").write_text(
+            "# comment\nkey: value # trailing\nurl: http://x#frag\n",
+            encoding="utf-8",
+        )
+        (tmp_path / "notes.md").write_text("# Title\n", encoding="utf-8")
+        return tmp_path
+
+    def test_strip_comments(self):
+        from sphinx_source_tree import _strip_comments
+
+        assert _strip_comments("x = 1  # one\n# two\ny = '#'\n", "python") == (
+            "x = 1\ny = '#'\n"
+        )
+        assert _strip_comments("def (:\n  # c\n", "python") == (
+            "def (:\n  # c\n"
+        )
+        assert _strip_comments("f(); /* a */ g(); // b\n", "c") == (
+            "f();  g();\n"
+        )
+        assert _strip_comments("; c\nx = 1 ; v\n", "ini") == "x = 1 ; v\n"
+        assert _strip_comments("-- a\nx = '--' -- b\n", "sql") == ("x = '--'\n")
+        assert _strip_comments("<!-- a -->\n<b/>\n", "xml") == "<b/>\n"
+        assert _strip_comments("# Title\n", "markdown") == "# Title\n"
+
+    def test_strip_comments_keeps_look_alikes(self):
+        from sphinx_source_tree import _strip_comments
+
+        css = "a { background: url(http://x.com/a.png); } // c\n// d\n"
+        for language in ("scss", "less"):
+            assert _strip_comments(css, language) == (
+                "a { background: url(http://x.com/a.png); }\n"
+            )
+        js = (
+            's.replace(/\\/\\//g, "/"); // c\n'
+            "if (/[/]/.test(x)) return /#a/.exec(x)\n"
+            "y = a / b / c; // d\n"
+        )
+        assert _strip_comments(js, "typescript") == (
+            's.replace(/\\/\\//g, "/");\n'
+            "if (/[/]/.test(x)) return /#a/.exec(x)\n"
+            "y = a / b / c;\n"
+        )
+        bash = (
+            "cat <<EOF\n# kept\nEOF\n# gone\n"
+            "cat <<-'END' # opener\n\t# kept\n\tEND\n"
+        )
+        assert _strip_comments(bash, "bash") == (
+            "cat <<EOF\n# kept\nEOF\ncat <<-'END' # opener\n\t# kept\n\tEND\n"
+        )
+
+    def test_collapse_blank_lines(self):
+        from sphinx_source_tree import _collapse_blank_lines
+
+        assert _collapse_blank_lines("\n\na\n\n\n \nb\n", "") == "a\n\nb\n"
+
+    def test_staged_and_reported(self, project, capsys):
+        listing = collect_listing(
+            project, transforms=["strip-comments", "collapse-blank-lines"]
+        )
+        assert listing.source(project / "app.py").read_text(
+            encoding="utf-8"
+        ) == (
+            '#!/usr/bin/env python\n\nimport os\nURL = "http://example.com/#anchor"\n'
+        )
+        assert listing.source(project / "app.js").read_text(
+            encoding="utf-8"
+        ) == ('const url = "http://example.com";\nconst tpl = `a\n// kept`;\n')
+        assert (
+            listing.source(project / "conf.yaml").read_text(encoding="utf-8")
+            == "key: value\nurl: http://x#frag\n"
+        )
+        # Unchanged files are included from where they are.
+        assert listing.source(project / "notes.md") == project / "notes.md"
+        err = capsys.readouterr().err
+        assert "Transforms saved " in err
+        assert "python " in err and "javascript " in err
+
+    def test_bundle_and_rst(self, project):
+        bundle = generate_bundle(project, transforms=["strip-comments"])
+        assert "Copyright" not in bundle
+        assert "License header" not in bundle
+        rst = generate(
+            project,
+            project / "docs" / "tree.rst",
+            transforms=["strip-comments"],
+        )
+        assert (
+            ".. literalinclude:: ../.sphinx-source-tree/transformed/app.py\n"
+            "   :language: python\n"
+            "   :caption: app.py\n"
+        ) in rst
+
+    def test_combines_with_skeleton_and_skips_ranges(self, project):
+        listing = collect_listing(
+            project,
+            python_mode="skeleton",
+            transforms=["strip-comments"],
+            file_options={"app.js": {"lines": "4-5"}},
+        )
+        assert listing.source(project / "app.py") == (
+            project / ".sphinx-source-tree" / "skeleton" / "app.py"
+        )
+        assert listing.source(project / "app.js") == project / "app.js"
+
+    def test_results_are_cached(self, project, monkeypatch):
+        import sphinx_source_tree
+
+        collect_listing(project, transforms=["strip-comments"])
+
+        def fail(func, items):
+            raise AssertionError(f"transformed {len(items)} files again")
+
+        monkeypatch.setattr(sphinx_source_tree, "_process_map", fail)
+        listing = collect_listing(project, transforms=["strip-comments"])
+        assert project / "app.py" in listing.staged
+        with pytest.raises(AssertionError, match="transformed 4 files"):
+            collect_listing(project, transforms=["collapse-blank-lines"])
+
+    def test_cache_keeps_one_entry_per_file(self, project, tmp_path_factory):
+        import json
+
+        cache_dir = tmp_path_factory.mktemp("cache")
+        for source in ("x = 1  # a\n", "x = 2  # b\n"):
+            (project / "app.py").write_text(source, encoding="utf-8")
+            collect_listing(
+                project, transforms=["strip-comments"], cache_dir=cache_dir
+            )
+        data = json.loads((cache_dir / "transforms.json").read_text("utf-8"))
+        assert len(data) == 4
+        assert data[f"{project / 'app.py'}\0strip-comments"][1][1] == "x = 2\n"
+        (project / "app.js").unlink()
+        collect_listing(
+            project, transforms=["strip-comments"], cache_dir=cache_dir
+        )
+        data = json.loads((cache_dir / "transforms.json").read_text("utf-8"))
+        assert len(data) == 3
+
+    def test_invalid_transform_and_cli(self, project):
+        with pytest.raises(ValueError, match="Invalid transform"):
+            collect_listing(project, transforms=["minify"])
+        out = project / "tree.md"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--output",
+                str(out),
+                "--format",
+                "text",
+                "--transforms",
+                "strip-comments",
+                "collapse-blank-lines",
+            ]
+        )
+        assert "All rights reserved" not in out.read_text(encoding="utf-8")
+
+
+# ----------------------------------------------------------------------------
+# Timings
+# ----------------------------------------------------------------------------
+
+
+class TestTimings:
+    """Tests for ``--timings`` and ``record_timings()``."""
+
+    def test_phases_and_counters(self, sample_project):
+        received = []
+        with record_timings(received.append) as timings:
+            main(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--output",
+                    str(sample_project / "docs" / "tree.rst"),
+                ]
+            )
+        assert received == [timings]
+        assert {
+            "config",
+            "scan",
+            "ignore",
+            "tree",
+            "collect",
+            "order",
+            "filters",
+            "render",
+            "write",
+        } <= set(timings.phases)
+        counters = timings.counters
+        # root, src, docs, tests
+        assert counters["dirs_listed"] == 4
+        assert counters["files_selected"] == 6
+        assert counters["files_written"] == 1
+        assert counters["bytes_written"] == len(
+            (sample_project / "docs" / "tree.rst").read_bytes()
+        )
+        assert counters["pattern_evals"] >= counters["entries_pruned"]
+        assert timings.as_dict()["counters"] == counters
+
+    def test_nothing_recorded_outside(self, sample_project):
+        with record_timings() as outer:
+            with record_timings() as inner:
+                collect_listing(sample_project)
+            assert outer.counters == {}
+            collect_listing(sample_project)
+        assert (
+            inner.counters["files_selected"] == outer.counters["files_selected"]
+        )
+        from sphinx_source_tree import _timings
+
+        assert _timings is None
+
+    def test_pruned_entries(self, tmp_path):
+        (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+        (tmp_path / "a.py").write_text("", encoding="utf-8")
+        (tmp_path / "b.pyc").write_text("", encoding="utf-8")
+        with record_timings() as timings:
+            scan_project(tmp_path, list(DEFAULTS["ignore"]))
+        assert timings.counters["entries_pruned"] == 2
+        assert timings.counters["dirs_listed"] == 1
+
+    def test_cli(self, sample_project, capsys):
+        main(
+            [
+                "--project-root",
+                str(sample_project),
+                "--stdout",
+                "--timings",
+            ]
+        )
+        err = capsys.readouterr().err
+        assert err.startswith("Timings:\nphase")
+        assert "bytes_written" in err
+        with pytest.raises(SystemExit):
+            main(
+                ["--project-root", str(sample_project), "--watch", "--timings"]
+            )
+
+
+# ----------------------------------------------------------------------------
+# Manifests
+# ----------------------------------------------------------------------------
+
+
+class TestManifest:
+    """Tests for ``--manifest`` and ``--from-manifest``."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        (sample_project / "src" / "copy.py").write_text(
+            "print('hello')\n", encoding="utf-8"
+        )
+        (sample_project / "src" / "blob.json").write_bytes(b"\x00\x01")
+        (sample_project / "pyproject.toml").write_text(
+            textwrap.dedent(f"""\
+                [tool.sphinx-source-tree]
+                dedupe = true
+                manifest = "{sample_project / "manifest.json"}"
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "tree.rst"}"
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "src.md"}"
+                format = "markdown"
+                whitelist = ["src"]
+                include-all = false
+                chunk-lines = 1
+            """),
+            encoding="utf-8",
+        )
+        return sample_project
+
+    def test_manifest(self, project):
+        import json
+
+        main(["--project-root", str(project)])
+        manifest = json.loads(
+            (project / "manifest.json").read_text(encoding="utf-8")
+        )
+        assert manifest["version"] == 1
+        rst, markdown = manifest["outputs"]
+        assert rst["outputs"] == {"rst": "docs/tree.rst"}
+        assert markdown["outputs"] == {"markdown": "docs/src.md"}
+        assert rst["tree"].startswith("├── docs")
+        files = {item["path"]: item for item in rst["files"]}
+        assert files["src/app.py"] == {
+            "path": "src/app.py",
+            "size": 15,
+            "language": "python",
+            "options": {},
+        }
+        assert files["src/copy.py"]["duplicate_of"] == "src/app.py"
+        assert rst["notes"] == [
+            {"path": "src/blob.json", "reason": "skipped, binary content"}
+        ]
+        assert {item["path"] for item in markdown["files"]} == {
+            "src/__init__.py",
+            "src/app.py",
+            "src/copy.py",
+            "src/utils.py",
+        }
+
+    def test_from_manifest_renders_without_walking(self, project, monkeypatch):
+        import sphinx_source_tree
+
+        main(["--project-root", str(project)])
+        expected = {
+            name: (project / "docs" / name).read_text(encoding="utf-8")
+            for name in ("tree.rst", "src.md")
+        }
+        for name in expected:
+            (project / "docs" / name).unlink()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("walked the project")
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", fail)
+        main(["--from-manifest", str(project / "manifest.json")])
+        for name, content in expected.items():
+            assert (project / "docs" / name).read_text(
+                encoding="utf-8"
+            ) == content
+
+    def test_from_manifest_with_another_root(self, project, tmp_path_factory):
+        import shutil
+
+        main(["--project-root", str(project)])
+        moved = tmp_path_factory.mktemp("moved") / "project"
+        shutil.copytree(project, moved)
+        main(
+            [
+                "--from-manifest",
+                str(moved / "manifest.json"),
+                "--project-root",
+                str(moved),
+            ]
+        )
+        # The bundle's tree starts with the name of the new root.
+        assert "```text\nproject/\n" in (moved / "docs" / "src.md").read_text(
+            encoding="utf-8"
+        )
+
+    def test_invalid_manifests(self, tmp_path):
+        bad = tmp_path / "bad.json"
+        for content in ("not json", '{"version": 99}', '{"version": 1}'):
+            bad.write_text(content, encoding="utf-8")
+            with pytest.raises(SystemExit):
+                main(["--from-manifest", str(bad)])
+        with pytest.raises(SystemExit):
+            main(["--from-manifest", str(bad), "--watch"])
+
+
+# ----------------------------------------------------------------------------
+# --check
+# ----------------------------------------------------------------------------
+
+
+class TestCheck:
+    """Tests for ``--check``: compare the outputs, never write them."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        (sample_project / "pyproject.toml").write_text(
+            textwrap.dedent(f"""\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__", "*.pyc", "pyproject.toml"]
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "tree.rst"}"
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "src.md"}"
+                format = "markdown"
+                whitelist = ["src"]
+                include-all = false
+                transforms = ["strip-comments"]
+            """),
+            encoding="utf-8",
+        )
+        (sample_project / "src" / "app.py").write_text(
+            "# greet\nprint('hello')\n", encoding="utf-8"
+        )
+        _backdate(sample_project)
+        return sample_project
+
+    def _generate(self, project, capsys):
+        # The second run lists the outputs the first one created.
+        main(["--project-root", str(project)])
+        main(["--project-root", str(project)])
+        capsys.readouterr()
+
+    def _check(self, project, capsys):
+        with pytest.raises(SystemExit) as exc:
+            main(["--project-root", str(project), "--check"])
+        return exc.value.code, capsys.readouterr().out
+
+    def test_missing_outputs_are_stale_and_nothing_is_written(
+        self, project, capsys
+    ):
+        code, out = self._check(project, capsys)
+        assert code == 1
+        assert f"Stale {project / 'docs' / 'tree.rst'}" in out
+        assert f"Stale {project / 'docs' / 'src.md'}" in out
+        assert not (project / "docs" / "tree.rst").exists()
+        assert not (project / "docs" / "src.md").exists()
+        assert not (project / ".sphinx-source-tree").exists()
+
+    def test_up_to_date_without_rendering(self, project, capsys, monkeypatch):
+        import sphinx_source_tree
+
+        self._generate(project, capsys)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("walked the project")
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", fail)
+        main(["--project-root", str(project), "--check"])
+        out = capsys.readouterr().out
+        assert f"Up to date {project / 'docs' / 'tree.rst'}" in out
+        assert f"Up to date {project / 'docs' / 'src.md'}" in out
+
+    def test_up_to_date_by_rendering(self, project, capsys, monkeypatch):
+        self._generate(project, capsys)
+        # Without a fingerprint the outputs are rendered and compared.
+        monkeypatch.setenv(
+            "SPHINX_SOURCE_TREE_CACHE_DIR", str(project / "empty-cache")
+        )
+        main(["--project-root", str(project), "--check"])
+        assert "Stale" not in capsys.readouterr().out
+        assert not (project / "empty-cache").exists()
+
+    def test_reports_only_stale_outputs(self, project, capsys):
+        self._generate(project, capsys)
+        (project / "tests" / "test_new.py").write_text("", encoding="utf-8")
+        code, out = self._check(project, capsys)
+        assert code == 1
+        assert f"Stale {project / 'docs' / 'tree.rst'}" in out
+        assert f"Up to date {project / 'docs' / 'src.md'}" in out
+
+    def test_stale_staged_copy(self, project, capsys):
+        self._generate(project, capsys)
+        src_md = (project / "docs" / "src.md").read_text(encoding="utf-8")
+        # A content edit leaves the bundle alone but not the staged copy.
+        (project / "src" / "app.py").write_text(
+            "# greet\nprint('hi')\n", encoding="utf-8"
+        )
+        code, out = self._check(project, capsys)
+        assert code == 1
+        staged = project / ".sphinx-source-tree" / "transformed" / "src"
+        assert f"Stale {staged / 'app.py'}" in out
+        assert (staged / "app.py").read_text(encoding="utf-8") == (
+            "print('hello')\n"
+        )
+        assert (project / "docs" / "src.md").read_text(
+            encoding="utf-8"
+        ) == src_md
+
+    def test_edited_output_is_stale(self, project, capsys):
+        self._generate(project, capsys)
+        tree = project / "docs" / "tree.rst"
+        tree.write_text("edited\n", encoding="utf-8")
+        code, out = self._check(project, capsys)
+        assert code == 1
+        assert f"Stale {tree}" in out
+        assert tree.read_text(encoding="utf-8") == "edited\n"
+
+    def test_incompatible_options(self, project):
+        for extra in ("--stdout", "--watch"):
+            with pytest.raises(SystemExit):
+                main(["--project-root", str(project), "--check", extra])
+
+
+# ----------------------------------------------------------------------------
+# --pre-commit
+# ----------------------------------------------------------------------------
+
+
+class TestPreCommit:
+    """Tests for the hook mode deciding relevance from changed files."""
+
+    @pytest.fixture
+    def project(self, sample_project, capsys, monkeypatch):
+        (sample_project / "pyproject.toml").write_text(
+            textwrap.dedent(f"""\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__", "*.pyc", "pyproject.toml"]
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "tree.rst"}"
+
+                [[tool.sphinx-source-tree.files]]
+                output = "{sample_project / "docs" / "src.md"}"
+                format = "markdown"
+                whitelist = ["src"]
+                include-all = false
+            """),
+            encoding="utf-8",
+        )
+        _backdate(sample_project)
+        # The second run lists the outputs the first one created.
+        main(["--project-root", str(sample_project)])
+        main(["--project-root", str(sample_project)])
+        capsys.readouterr()
+        monkeypatch.chdir(sample_project)
+        return sample_project
+
+    def _hook(self, project, capsys, *paths):
+        main(["--project-root", str(project), "--pre-commit", *paths])
+        return capsys.readouterr().out
+
+    @pytest.fixture
+    def no_walk(self, monkeypatch):
+        import sphinx_source_tree
+
+        def fail(*args, **kwargs):
+            raise AssertionError("walked the project")
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", fail)
+
+    def test_ignored_and_hidden_paths(self, project, capsys, no_walk):
+        out = self._hook(
+            project,
+            capsys,
+            "__pycache__/app.cpython-312.pyc",
+            "tests/test_app.py",
+            "../elsewhere.py",
+        )
+        assert f"Unaffected {project / 'docs' / 'tree.rst'}" in out
+        assert f"Unaffected {project / 'docs' / 'src.md'}" in out
+
+    def test_no_changed_files(self, project, capsys, no_walk):
+        out = self._hook(project, capsys)
+        assert out.count("Unaffected") == 2
+
+    def test_content_edit_only_affects_bundles(self, project, capsys):
+        (project / "src" / "app.py").write_text(
+            "print('hi')\n", encoding="utf-8"
+        )
+        out = self._hook(project, capsys, "src/app.py")
+        assert f"Unaffected {project / 'docs' / 'tree.rst'}" in out
+        assert f"Wrote {project / 'docs' / 'src.md'}" in out
+        assert "print('hi')" in (project / "docs" / "src.md").read_text(
+            encoding="utf-8"
+        )
+
+    def test_new_file(self, project, capsys):
+        (project / "tests" / "test_new.py").write_text("", encoding="utf-8")
+        out = self._hook(project, capsys, "tests/test_new.py")
+        assert f"Wrote {project / 'docs' / 'tree.rst'}" in out
+        assert f"Unaffected {project / 'docs' / 'src.md'}" in out
+        assert "test_new.py" in (project / "docs" / "tree.rst").read_text(
+            encoding="utf-8"
+        )
+
+    def test_deleted_file(self, project, capsys, no_walk):
+        (project / "src" / "utils.py").unlink()
+        with pytest.raises(AssertionError, match="walked the project"):
+            self._hook(project, capsys, "README.md")
+
+    def test_deleted_file_is_dropped(self, project, capsys):
+        (project / "src" / "utils.py").unlink()
+        out = self._hook(project, capsys)
+        assert "Unaffected" not in out
+        assert "utils.py" not in (project / "docs" / "src.md").read_text(
+            encoding="utf-8"
+        )
+
+    def test_shared_manifest_keeps_all_outputs(self, project, capsys):
+        import json
+
+        pyproject = project / "pyproject.toml"
+        pyproject.write_text(
+            pyproject.read_text(encoding="utf-8").replace(
+                '"pyproject.toml"]',
+                '"pyproject.toml", "*.json"]\n'
+                f'manifest = "{project / "docs" / "manifest.json"}"',
+            ),
+            encoding="utf-8",
+        )
+        main(["--project-root", str(project)])
+        main(["--project-root", str(project)])
+        capsys.readouterr()
+        (project / "tests" / "test_new.py").write_text("", encoding="utf-8")
+        out = self._hook(project, capsys, "tests/test_new.py")
+        assert "Unaffected" not in out
+        manifest = json.loads(
+            (project / "docs" / "manifest.json").read_text(encoding="utf-8")
+        )
+        assert len(manifest["outputs"]) == 2
+
+    def test_without_fingerprint(self, project, capsys, monkeypatch):
+        monkeypatch.setenv(
+            "SPHINX_SOURCE_TREE_CACHE_DIR", str(project / "empty-cache")
+        )
+        out = self._hook(project, capsys, "tests/test_app.py")
+        assert f"Unchanged {project / 'docs' / 'tree.rst'}" in out
+        assert f"Unaffected {project / 'docs' / 'src.md'}" in out
+
+    def test_config_change(self, project, capsys):
+        out = self._hook(project, capsys, "pyproject.toml")
+        assert "Unaffected" not in out
+
+    def test_changed_files_need_pre_commit(self, project):
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "src/app.py"])
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "--pre-commit", "--watch"])
+
+
+# ----------------------------------------------------------------------------
+# --changed-since
+# ----------------------------------------------------------------------------
+
+
+def _git(root: Path, *args: str) -> None:
+    import subprocess
+
+    subprocess.run(
+        [
+            "git",
+            "-C",
+            str(root),
+            "-c",
+            "user.name=Test",
+            "-c",
+            "user.email=test@example.com",
+            *args,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+class TestChangedSince:
+    """Tests for ``--changed-since``: only the files changed since a ref."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        (sample_project / "data.bin").write_bytes(b"\x00")
+        (sample_project / "gone.py").write_text("", encoding="utf-8")
+        _git(sample_project, "init", "-q")
+        _git(sample_project, "add", ".")
+        _git(sample_project, "commit", "-q", "-m", "base")
+        (sample_project / "src" / "pkg").mkdir()
+        (sample_project / "src" / "pkg" / "mod.py").write_text(
+            "x = 1\n", encoding="utf-8"
+        )
+        (sample_project / "data.bin").write_bytes(b"\x01")
+        (sample_project / "gone.py").unlink()
+        _git(sample_project, "add", "-A")
+        _git(sample_project, "commit", "-q", "-m", "change")
+        # Uncommitted changes count too.
+        (sample_project / "src" / "app.py").write_text(
+            "print('hi')\n", encoding="utf-8"
+        )
+        return sample_project
+
+    def _run(self, project, capsys, *extra):
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--changed-since",
+                "HEAD~1",
+                "--stdout",
+                *extra,
+            ]
+        )
+        return capsys.readouterr().out
+
+    def test_lists_only_changed_files(self, project, capsys, monkeypatch):
+        import sphinx_source_tree
+
+        def fail(*args, **kwargs):
+            raise AssertionError("walked the project")
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", fail)
+        out = self._run(project, capsys)
+        assert _literalinclude_order(out) == [
+            "src/app.py",
+            "src/pkg/mod.py",
+        ]
+        tree = _extract_tree_section(out)
+        assert "src" in tree and "pkg" in tree
+        for name in ("data.bin", "gone.py", "utils.py", "docs", "tests"):
+            assert name not in tree
+
+    def test_collect_rules_apply(self, project, capsys):
+        out = self._run(
+            project, capsys, "--whitelist", "src/pkg", "--no-include-all"
+        )
+        assert _literalinclude_order(out) == ["src/pkg/mod.py"]
+
+    def test_unknown_ref(self, project):
+        with pytest.raises(SystemExit):
+            main(
+                [
+                    "--project-root",
+                    str(project),
+                    "--changed-since",
+                    "no-such-ref",
+                    "--stdout",
+                ]
+            )
+
+    def test_incompatible_options(self, project):
+        with pytest.raises(SystemExit):
+            main(["--changed-since", "HEAD", "--watch"])
+
+    def test_configured_output_keeps_full_listing(
+        self, project, capsys, monkeypatch
+    ):
+        monkeypatch.chdir(project)
+        (project / "pyproject.toml").write_text(
+            textwrap.dedent("""\
+                [tool.sphinx-source-tree]
+                output = "docs/source_tree.rst"
+                manifest = "docs/manifest.json"
+            """),
+            encoding="utf-8",
+        )
+        main(["--project-root", str(project)])
+        out = project / "docs" / "source_tree.rst"
+        full = out.read_text(encoding="utf-8")
+        manifest = (project / "docs" / "manifest.json").read_bytes()
+
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "--changed-since", "HEAD~1"])
+        assert "--stdout or -o/--output" in capsys.readouterr().err
+
+        review = project / "review.rst"
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--changed-since",
+                "HEAD~1",
+                "--output",
+                str(review),
+            ]
+        )
+        assert out.read_text(encoding="utf-8") == full
+        assert (project / "docs" / "manifest.json").read_bytes() == manifest
+        assert _literalinclude_order(review.read_text(encoding="utf-8")) == [
+            "src/app.py",
+            "src/pkg/mod.py",
+        ]
+
+
+# ----------------------------------------------------------------------------
+# Scan limits
+# ----------------------------------------------------------------------------
+
+
+class TestScanLimits:
+    """Tests for max-files, max-entries-scanned and time-budget."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        raw = sample_project / "data" / "raw"
+        raw.mkdir(parents=True)
+        for index in range(40):
+            (raw / f"sample_{index:02d}.csv").write_text("", encoding="utf-8")
+        return sample_project
+
+    def test_unlimited_scan_is_complete(self, project):
+        scan = scan_project(project, ["__pycache__"])
+        assert scan.truncated is None
+        assert scan.entry_counts["data/raw"] == 40
+
+    def test_max_files(self, project):
+        scan = scan_project(project, ["__pycache__"], max_files=5)
+        assert scan.truncated == "max-files = 5"
+        assert sum(1 for _ in scan.iter_files()) <= 6
+
+    def test_max_entries_scanned(self, project):
+        scan = scan_project(project, [], max_entries_scanned=3)
+        assert scan.truncated == "max-entries-scanned = 3"
+        assert sum(len(children) for children in scan.entries.values()) == 3
+
+    def test_time_budget(self, project):
+        scan = scan_project(project, [], time_budget=0)
+        assert scan.truncated == "time-budget = 0s"
+
+    def test_limit_hit_by_last_file(self, sample_project):
+        # The sample project holds six files.
+        scan = scan_project(sample_project, ["__pycache__"], max_files=5)
+        assert scan.truncated == "max-files = 5"
+        scan = scan_project(sample_project, ["__pycache__"], max_files=6)
+        assert scan.truncated is None
+
+    def test_heaviest_dirs(self, project):
+        scan = scan_project(project, ["__pycache__"])
+        # Most entries sit below "data/raw", which is named instead of
+        # its ancestors.
+        assert scan.heaviest_dirs(2) == [("data/raw", 40), ("src", 3)]
+
+    def test_error_names_heaviest_dirs(self, project, capsys):
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "--max-files", "10"])
+        err = capsys.readouterr().err
+        assert "stopped at max-files = 10" in err
+        assert "data/raw" in err
+
+    def test_partial_output(self, project, capsys):
+        main(
+            [
+                "--project-root",
+                str(project),
+                "--max-entries-scanned",
+                "6",
+                "--on-scan-limit",
+                "partial",
+                "--stdout",
+            ]
+        )
+        captured = capsys.readouterr()
+        assert "Project source-tree (partial)" in captured.out
+        assert "partial scan, stopped at max-entries-scanned = 6" in (
+            captured.out
+        )
+        assert "the output is partial" in captured.err
+
+    def test_watch_reports_first_render_as_usage_error(self, project, capsys):
+        with pytest.raises(SystemExit):
+            main(
+                ["--project-root", str(project), "--watch", "--max-files", "0"]
+            )
+        assert "stopped at max-files = 0" in capsys.readouterr().err
+
+    def test_watch_survives_limit_hit_later(self, sample_project, capsys):
+        from sphinx_source_tree import _watch
+
+        out = sample_project / "docs" / "out.rst"
+        cfg = resolve_config(
+            build_parser().parse_args(
+                [
+                    "--project-root",
+                    str(sample_project),
+                    "--output",
+                    str(out),
+                    "--ignore",
+                    "__pycache__",
+                    "docs",
+                    "--max-files",
+                    "6",
+                ]
+            )
+        )
+
+        def add_files():
+            for index in range(3):
+                (sample_project / f"extra_{index}.py").write_text(
+                    "", encoding="utf-8"
+                )
+            return True
+
+        watcher = _ScriptedWatcher([add_files, None])
+        _watch(cfg, debounce=0, watcher=watcher)
+        assert watcher.closed
+        assert "Error: The scan of" in capsys.readouterr().err
+        assert "extra_0.py" not in out.read_text(encoding="utf-8")
+
+    def test_config(self, project):
+        (project / "pyproject.toml").write_text(
+            textwrap.dedent("""\
+                [tool.sphinx-source-tree]
+                max-files = 10
+            """),
+            encoding="utf-8",
+        )
+        with pytest.raises(SystemExit):
+            main(["--project-root", str(project), "--stdout"])
+        with pytest.raises(ValueError, match="on-scan-limit"):
+            collect_listing(project, on_scan_limit="ignore")
+
+
+# ----------------------------------------------------------------------------
+# --report-size
+# ----------------------------------------------------------------------------
+
+
+class TestReportSize:
+    """Tests for the largest-contributors report."""
+
+    @pytest.fixture
+    def project(self, sample_project):
+        (sample_project / "src" / "big.py").write_text(
+            "x = 1\n" * 200, encoding="utf-8"
+        )
+        return sample_project
+
+    def _report(self, project, capsys, *extra):
+        main(["--project-root", str(project), "--stdout", *extra])
+        return capsys.readouterr().err.splitlines()
+
+    def test_largest_files_and_directories(self, project, capsys):
+        lines = self._report(project, capsys, "--report-size", "2")
+        assert lines[0].startswith("Size report for ")
+        files = lines.index("Largest files:")
+        dirs = lines.index("Largest directories:")
+        assert dirs - files == 4  # heading, header and two rows
+        row = lines[files + 2].split()
+        assert row[:3] == ["1,200", "200", "300"]
+        assert row[-1] == "src/big.py"
+        assert lines[dirs + 2].endswith("  src/")
+
+    def test_shares(self, project, capsys):
+        lines = self._report(project, capsys, "--report-size")
+        files = lines.index("Largest files:")
+        dirs = lines.index("Largest directories:")
+        shares = [
+            float(line.split()[3][:-1]) for line in lines[files + 2 : dirs]
+        ]
+        assert sum(shares) == pytest.approx(100, abs=0.5)
+
+    def test_range_options(self, project, capsys):
+        (project / "pyproject.toml").write_text(
+            textwrap.dedent("""\
+                [tool.sphinx-source-tree]
+                ignore = ["__pycache__", "pyproject.toml"]
+
+                [tool.sphinx-source-tree.file-options."src/big.py"]
+                lines = "1-10"
+            """),
+            encoding="utf-8",
+        )
+        lines = self._report(project, capsys, "--report-size", "1")
+        row = lines[lines.index("Largest files:") + 2].split()
+        assert row[:3] == ["60", "10", "15"]
+        assert row[-1] == "src/big.py"
+
+
+# ----------------------------------------------------------------------------
+# Explain
+# ----------------------------------------------------------------------------
+
+
+class TestExplain:
+    """Tests for ``--explain``."""
+
+    @pytest.fixture
+    def explain(self, sample_project, monkeypatch, capsys):
+        import sphinx_source_tree
+
+        def fail(*args, **kwargs):
+            raise AssertionError("walked the project")
+
+        monkeypatch.setattr(sphinx_source_tree, "scan_project", fail)
+        monkeypatch.chdir(sample_project)
+
+        def run(*paths, extra=()):
+            main(["--project-root", ".", *extra, "--explain", *paths])
+            return capsys.readouterr().out.splitlines()
+
+        return run
+
+    def test_listed(self, explain):
+        lines = explain("src/app.py")
+        assert lines[0].endswith("source_tree.rst")
+        assert lines[1] == "  src/app.py: in the tree and listed"
+        assert "    - extension '.py' is in extensions" in lines
+
+    def test_ignore_pattern(self, explain):
+        lines = explain("__pycache__/app.cpython-312.pyc")
+        assert lines[1:] == [
+            "  __pycache__/app.cpython-312.pyc: left out",
+            "    - ignored: parent directory __pycache__/ matches "
+            + "ignore pattern '__pycache__'",
+        ]
+
+    def test_whitelist(self, explain):
+        lines = explain(
+            "src/app.py",
+            "README.md",
+            extra=("--whitelist", "src", "--no-include-all"),
+        )
+        assert "    - under whitelist entry 'src'" in lines
+        assert "  README.md: left out" in lines
+        assert lines[-1] == "    - not under any whitelist entry (src)"
+
+    def test_depth_and_extension(self, explain):
+        lines = explain(
+            "src/app.py",
+            "docs/index.rst",
+            extra=("--depth", "0", "--extensions", ".py"),
+        )
+        assert lines[1] == "  src/app.py: listed"
+        assert "    - level 1 is beyond depth = 0" in lines
+        assert "  docs/index.rst: left out" in lines
+        assert lines[-1] == "    - extension '.rst' is not in extensions"
+
+    def test_directory_and_missing_path(self, explain):
+        lines = explain("src", "src/new.py")
+        assert "  src: in the tree" in lines
+        assert "  src/new.py: in the tree and listed (does not exist)" in lines
+
+    def test_outside_root(self, explain, tmp_path_factory):
+        other = tmp_path_factory.mktemp("other")
+        lines = explain(str(other))
+        assert lines[1].startswith(f"  {other}: left out, outside ")
+
+    def test_incompatible_with_watch(self, sample_project):
+        with pytest.raises(SystemExit):
+            main(["--watch", "--explain", str(sample_project / "README.md")])